@@ -0,0 +1,220 @@
+"""
+Prueba de carga de punta a punta contra un servidor del portal.
+
+Inicia sesión como un comercio y dispara, a una tasa fija de requests por
+segundo, una mezcla de: confirmación de creacion_link (crear), polling de
+estado (estado) y ticket_pdf (ticket). Pensada para correr contra el
+simulador de PayZen (app1/simulador_payzen.py), nunca contra PayZen real.
+
+La carga es de lazo abierto: cada request tiene un instante programado y la
+latencia se mide desde ese instante, no desde que un hilo quedó libre. Así,
+si el servidor se atrasa, la espera en cola aparece en los percentiles en
+vez de esconderse (omisión coordinada).
+
+Se corre con `python manage.py prueba_carga` (ver app1/management).
+"""
+import math
+import platform
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import requests
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .models import Cliente, LinkPago
+
+FORMATO = 1  # versión del JSON de resultados
+OPERACIONES = ('crear', 'estado', 'ticket')
+MEZCLA_POR_DEFECTO = {'crear': 1.0, 'estado': 8.0, 'ticket': 1.0}
+
+
+def parsear_mezcla(texto: str) -> Dict[str, float]:
+    """'crear=1,estado=8' → {'crear': 1.0, 'estado': 8.0}."""
+    mezcla = {}
+    for parte in filter(None, (p.strip() for p in texto.split(','))):
+        nombre, _, peso = parte.partition('=')
+        nombre = nombre.strip().lower()
+        if nombre not in OPERACIONES:
+            raise ValueError(f"Operación desconocida: {nombre} (válidas: {', '.join(OPERACIONES)})")
+        mezcla[nombre] = float(peso or 1)
+    if not mezcla or sum(mezcla.values()) <= 0:
+        raise ValueError("Los pesos de la mezcla deben sumar más que cero.")
+    return mezcla
+
+
+def percentil(ordenados: List[float], p: float) -> Optional[float]:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not ordenados:
+        return None
+    rango = max(1, math.ceil(p / 100 * len(ordenados)))
+    return ordenados[rango - 1]
+
+
+def resumir(muestras: List[Dict[str, Any]], duracion: float) -> Dict[str, Any]:
+    """
+    {operacion: {requests, errores, rps, p50_ms, p95_ms, p99_ms, max_ms}} más 'total'.
+    Cada muestra es {'operacion', 'ms', 'ok'}.
+    """
+    grupos = {'total': muestras}
+    for muestra in muestras:
+        grupos.setdefault(muestra['operacion'], []).append(muestra)
+
+    resumen = {}
+    for nombre, grupo in grupos.items():
+        latencias = sorted(m['ms'] for m in grupo)
+        resumen[nombre] = {
+            'requests': len(grupo),
+            'errores':  sum(1 for m in grupo if not m['ok']),
+            'rps':      round(len(grupo) / duracion, 2) if duracion else None,
+            'p50_ms':   percentil(latencias, 50),
+            'p95_ms':   percentil(latencias, 95),
+            'p99_ms':   percentil(latencias, 99),
+            'max_ms':   latencias[-1] if latencias else None,
+        }
+    return resumen
+
+
+class PruebaCarga:
+
+    def __init__(self, url: str, email: str, password: str, mezcla: Optional[Dict[str, float]] = None,
+                 modo_async: bool = False, semilla: Optional[int] = None, timeout: float = 60.0):
+        self.url = url.rstrip('/')
+        self.email = email
+        self.password = password
+        self.mezcla = mezcla or dict(MEZCLA_POR_DEFECTO)
+        self.modo_async = modo_async
+        self.timeout = timeout
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.sesion = requests.Session()
+        self.cliente_id = None
+        self.token = ''
+        self.ids_estado: List[int] = []
+        self.ids_ticket: List[int] = []
+
+    # ── Preparación ──────────────────────────────────────────────────────────
+
+    def _csrf(self, ruta: str) -> str:
+        respuesta = self.sesion.get(self.url + ruta, timeout=self.timeout)
+        token = self.sesion.cookies.get('csrftoken')
+        if not token:
+            encontrado = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', respuesta.text)
+            token = encontrado.group(1) if encontrado else ''
+        return token
+
+    def iniciar_sesion(self, concurrencia: int):
+        adapter = HTTPAdapter(pool_maxsize=concurrencia, pool_block=False)
+        self.sesion.mount('http://', adapter)
+        self.sesion.mount('https://', adapter)
+
+        token = self._csrf('/login/cliente')
+        respuesta = self.sesion.post(
+            self.url + '/login/cliente',
+            data={'email': self.email, 'password': self.password, 'csrfmiddlewaretoken': token},
+            headers={'Referer': self.url + '/login/cliente'},
+            allow_redirects=False, timeout=self.timeout,
+        )
+        if respuesta.status_code != 302:
+            raise RuntimeError(f"No se pudo iniciar sesión como {self.email} (HTTP {respuesta.status_code}).")
+        self.token = self._csrf('/crear-link/')
+        self.cliente_id = Cliente.objects.values_list('pk', flat=True).get(email__iexact=self.email)
+
+    def actualizar_ids(self):
+        """Links del comercio para las operaciones estado (no finalizados) y ticket (pagados)."""
+        links = LinkPago.objects.filter(cliente_id=self.cliente_id).order_by('-pk')
+        ids_estado = list(links.filter(pagado=False).values_list('pk', flat=True)[:500])
+        ids_ticket = list(links.filter(pagado=True).values_list('pk', flat=True)[:500])
+        with self._lock:
+            self.ids_estado, self.ids_ticket = ids_estado, ids_ticket
+
+    # ── Operaciones ──────────────────────────────────────────────────────────
+
+    def _elegir(self, ids: List[int]) -> Optional[int]:
+        with self._lock:
+            return self._rng.choice(ids) if ids else None
+
+    def crear(self) -> bool:
+        ruta = '/crear-link/generar/' if self.modo_async else '/crear-link/'
+        with self._lock:
+            monto = f"{self._rng.randint(100, 500000)}.{self._rng.randint(0, 99):02d}"
+        respuesta = self.sesion.post(
+            self.url + ruta,
+            data={'monto': monto, 'cuotas': '1', 'tipo_tarjeta': 'debito', 'descripcion': 'prueba de carga',
+                  'confirm': '1', 'csrfmiddlewaretoken': self.token},
+            headers={'Referer': self.url + '/crear-link/'},
+            allow_redirects=False, timeout=self.timeout,
+        )
+        return respuesta.status_code == 302
+
+    def estado(self) -> bool:
+        link_id = self._elegir(self.ids_estado) or self._elegir(self.ids_ticket)
+        if link_id is None:
+            return False
+        ruta = f'/verificar-pago-async/{link_id}/' if self.modo_async else f'/verificar-pago-ajax/{link_id}/'
+        respuesta = self.sesion.get(self.url + ruta, timeout=self.timeout)
+        return respuesta.status_code == 200 and respuesta.json().get('status_raw') != 'Error Tecnico'
+
+    def ticket(self) -> bool:
+        link_id = self._elegir(self.ids_ticket)
+        if link_id is None:
+            return False
+        respuesta = self.sesion.get(f"{self.url}/ticket_pdf/{link_id}/", timeout=self.timeout)
+        return respuesta.status_code == 200 and respuesta.content[:4] == b'%PDF'
+
+    # ── Ejecución ────────────────────────────────────────────────────────────
+
+    def _ejecutar(self, operacion: str, programado: float, muestras: List[Dict[str, Any]]):
+        try:
+            ok = getattr(self, operacion)()
+        except requests.RequestException:
+            ok = False
+        ms = round((time.perf_counter() - programado) * 1000, 2)
+        with self._lock:
+            muestras.append({'operacion': operacion, 'ms': ms, 'ok': ok})
+
+    def correr(self, rps: float, duracion: float, concurrencia: int = 50, calentamiento: int = 5) -> Dict[str, Any]:
+        self.iniciar_sesion(concurrencia)
+        self.actualizar_ids()
+        # Calentamiento: algunos links para que estado y ticket tengan sobre qué operar
+        for _ in range(max(0, calentamiento - len(self.ids_estado) - len(self.ids_ticket))):
+            self.crear()
+        self.actualizar_ids()
+
+        operaciones = list(self.mezcla)
+        pesos = list(self.mezcla.values())
+        total = int(rps * duracion)
+        muestras: List[Dict[str, Any]] = []
+
+        with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix='carga') as pool:
+            inicio = time.perf_counter()
+            proxima_actualizacion = inicio + 5
+            for i in range(total):
+                programado = inicio + i / rps
+                espera = programado - time.perf_counter()
+                if espera > 0:
+                    time.sleep(espera)
+                if time.perf_counter() >= proxima_actualizacion:
+                    pool.submit(self.actualizar_ids)
+                    proxima_actualizacion += 5
+                with self._lock:
+                    operacion = self._rng.choices(operaciones, weights=pesos)[0]
+                pool.submit(self._ejecutar, operacion, programado, muestras)
+        transcurrido = time.perf_counter() - inicio
+
+        return {
+            'formato':      FORMATO,
+            'fecha':        timezone.now().isoformat(),
+            'python':       platform.python_version(),
+            'url':          self.url,
+            'modo_async':   self.modo_async,
+            'rps_objetivo': rps,
+            'duracion_s':   round(transcurrido, 2),
+            'concurrencia': concurrencia,
+            'mezcla':       self.mezcla,
+            'resultados':   resumir(muestras, transcurrido),
+        }
@@ -1,20 +1,32 @@
-import base64
+import asyncio
+import csv
+import io
+import math
+import hashlib
+import json
 import requests
+import time
 import uuid
 import traceback
-from decimal import Decimal, ROUND_HALF_UP
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List, Dict, Any
+from typing import Optional, Tuple, List, Dict, Any, Iterator
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.core.cache import cache
 from django.contrib.auth.hashers import make_password
 from django.template.loader import render_to_string
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.validators import validate_email
-from app2.models import ParametroFinanciero, CuotaConfig
 from .models import LinkPago, Cliente
+from . import payzen, pdfs
 import logging
 from django.utils import timezone
+from django.utils.text import slugify
 
 
 logger = logging.getLogger('app1')
@@ -27,12 +39,7 @@ PAYZEN_CHECK_URL = settings.PAYZEN_CHECK_URL
 
 
 def get_payzen_auth_header():
-    auth_str = f"{PAYZEN_SHOP_ID}:{PAYZEN_REST_PASS}"
-    encoded_auth = base64.b64encode(auth_str.encode()).decode()
-    return {
-        "Authorization": f"Basic {encoded_auth}",
-        "Content-Type": "application/json"
-    }
+    return payzen.auth_header()
 
 
 # ==============================================================================
@@ -201,11 +208,164 @@ def get_dashboard_stats(cliente_pk: Any) -> Dict[str, Any]:
 # LINKS DE PAGO
 # ==============================================================================
 
-def create_link(cliente_pk, monto_contado, cuotas=1, tipo_tarjeta='credito', descripcion=None):
+def create_link(cliente_pk, monto_contado, cuotas=1, tipo_tarjeta='credito', descripcion=None, clave_idempotencia=None):
     """
     Modelo ABSORBE: el vendedor ingresa el precio que cobra al cliente.
     Payway descuenta sobre ese precio y el vendedor recibe el neto resultante.
+
+    Con `clave_idempotencia`, un reenvío con la misma clave devuelve el link ya
+    creado sin llamar a PayZen, y los envíos simultáneos esperan al primero en vez
+    de crear otra orden. La restricción única (cliente, clave) respalda el lock del
+    cache entre workers. Reusar la clave con otros datos devuelve un error.
+    """
+    if clave_idempotencia is None:
+        return _create_link(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion, None)
+
+    clave, errores = _validar_clave_idempotencia(clave_idempotencia)
+    if errores:
+        return None, errores
+    clave_cache = _clave_cache_idempotencia(cliente_pk, clave)
+    limite = time.monotonic() + _espera_idempotencia()
+    while True:
+        existente = _link_por_clave(cliente_pk, clave)
+        if existente:
+            return _reenvio(existente, monto_contado, cuotas, tipo_tarjeta)
+        if cache.add(clave_cache, 1, timeout=int(_espera_idempotencia()) + 1):
+            break
+        if time.monotonic() >= limite:
+            return None, [MENSAJE_CREACION_EN_CURSO]
+        time.sleep(0.1)
+
+    try:
+        # El primero pudo terminar entre la consulta y el lock
+        existente = _link_por_clave(cliente_pk, clave)
+        if existente:
+            return _reenvio(existente, monto_contado, cuotas, tipo_tarjeta)
+        return _create_link(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion, clave)
+    finally:
+        cache.delete(clave_cache)
+
+
+def _create_link(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion, clave_idempotencia):
+    cotizacion, errores = _preparar_link(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion)
+    if errores:
+        return None, errores
+
+    payment_url, errores = _crear_orden_payzen(cotizacion['payload'])
+    if errores:
+        return None, errores
+
+    cotizacion['clave_idempotencia'] = clave_idempotencia
+    return _guardar_link(cotizacion, payment_url)
+
+
+async def create_link_async(cliente_pk, monto_contado, cuotas=1, tipo_tarjeta='credito', descripcion=None,
+                            clave_idempotencia=None):
+    """
+    create_link para vistas async (ASGI): la cotización y el guardado corren en un hilo
+    (ORM), pero la espera a PayZen no ocupa ninguno. Misma idempotencia que create_link.
     """
+    if clave_idempotencia is None:
+        return await _create_link_async(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion, None)
+
+    clave, errores = _validar_clave_idempotencia(clave_idempotencia)
+    if errores:
+        return None, errores
+    clave_cache = _clave_cache_idempotencia(cliente_pk, clave)
+    link_por_clave = sync_to_async(_link_por_clave)
+    limite = time.monotonic() + _espera_idempotencia()
+    reenvio = sync_to_async(_reenvio)
+    while True:
+        existente = await link_por_clave(cliente_pk, clave)
+        if existente:
+            return await reenvio(existente, monto_contado, cuotas, tipo_tarjeta)
+        if await cache.aadd(clave_cache, 1, timeout=int(_espera_idempotencia()) + 1):
+            break
+        if time.monotonic() >= limite:
+            return None, [MENSAJE_CREACION_EN_CURSO]
+        await asyncio.sleep(0.1)
+
+    try:
+        existente = await link_por_clave(cliente_pk, clave)
+        if existente:
+            return await reenvio(existente, monto_contado, cuotas, tipo_tarjeta)
+        return await _create_link_async(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion, clave)
+    finally:
+        await cache.adelete(clave_cache)
+
+
+async def _create_link_async(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion, clave_idempotencia):
+    cotizacion, errores = await sync_to_async(_preparar_link)(
+        cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion
+    )
+    if errores:
+        return None, errores
+
+    order_id = cotizacion['order_id']
+    try:
+        payment_url, errores = _resultado_orden_payzen(order_id, await payzen.crear_orden_async(cotizacion['payload']))
+    except Exception as e:
+        payment_url, errores = _falla_orden_payzen(order_id, e)
+    if errores:
+        return None, errores
+
+    cotizacion['clave_idempotencia'] = clave_idempotencia
+    return await sync_to_async(_guardar_link)(cotizacion, payment_url)
+
+
+MENSAJE_CREACION_EN_CURSO = "Este link todavía se está generando. Actualice la página en unos segundos."
+MENSAJE_CLAVE_REUSADA = "La clave de idempotencia ya se usó para un link con otros datos."
+
+
+def _validar_clave_idempotencia(clave) -> Tuple[Optional[str], List[str]]:
+    clave = str(clave).strip()
+    if not clave or len(clave) > 64:
+        return None, ['Clave de idempotencia inválida.']
+    return clave, []
+
+
+def _clave_cache_idempotencia(cliente_pk, clave: str) -> str:
+    return f"idempotencia:link:{cliente_pk}:{clave}"
+
+
+def _espera_idempotencia() -> float:
+    """Lo que puede tardar el primer envío: la llamada a PayZen más un margen para la base."""
+    return settings.PAYZEN_CONNECT_TIMEOUT + settings.PAYZEN_READ_TIMEOUT + 5
+
+
+def _link_por_clave(cliente_pk, clave: str) -> Optional[LinkPago]:
+    return LinkPago.objects.filter(cliente_id=cliente_pk, clave_idempotencia=clave).first()
+
+
+def _misma_solicitud(link, monto_contado, cuotas, tipo_tarjeta) -> bool:
+    """Si monto, cuotas y tarjeta pedidos son los del link (cuotas normalizadas como al cotizar)."""
+    from app2.tarifario import get_tarifario
+
+    try:
+        monto = Decimal(str(monto_contado))
+        cuotas = int(cuotas or 1)
+    except (InvalidOperation, TypeError, ValueError):
+        return False
+    tarifa, errores = get_tarifario().resolver(tipo_tarjeta, cuotas)
+    if not errores:
+        cuotas = tarifa.cuotas
+    return link.monto == monto and link.cuotas == cuotas and link.tipo_tarjeta == tipo_tarjeta
+
+
+def _reenvio(link, monto_contado, cuotas, tipo_tarjeta) -> Tuple[Optional[LinkPago], List[str]]:
+    """Respuesta a un envío con una clave ya usada: el mismo link, o error si cambiaron los datos."""
+    if not _misma_solicitud(link, monto_contado, cuotas, tipo_tarjeta):
+        logger.warning(
+            f"create_link — clave reusada con otros datos — id={link.pk} clave={link.clave_idempotencia} "
+            f"pedido={monto_contado}/{tipo_tarjeta}/{cuotas} link={link.monto}/{link.tipo_tarjeta}/{link.cuotas}"
+        )
+        return None, [MENSAJE_CLAVE_REUSADA]
+    logger.info(f"create_link — reenvío con clave repetida, se devuelve el link existente — "
+                f"id={link.pk} order_id={link.order_id} clave={link.clave_idempotencia}")
+    return link, []
+
+
+def _preparar_link(cliente_pk, monto_contado, cuotas, tipo_tarjeta, descripcion):
     logger.info(
         f"create_link — cliente={cliente_pk} monto_cobrado={monto_contado} "
         f"tipo={tipo_tarjeta} cuotas={cuotas} descripcion='{descripcion}'"
@@ -215,208 +375,100 @@ def create_link(cliente_pk, monto_contado, cuotas=1, tipo_tarjeta='credito', des
         logger.error(f"create_link — cliente no encontrado id={cliente_pk}")
         return None, ['Cliente no encontrado.']
 
-    # Débito siempre 1 cuota
-    if tipo_tarjeta == 'debito' and cuotas != 1:
-        logger.debug(f"create_link — débito detectado, forzando cuotas a 1")
-        cuotas = 1
-
-    # 1. Configuración financiera
-    config = ParametroFinanciero.objects.first()
-    if not config:
-        logger.warning("create_link — ParametroFinanciero no encontrado, creando fallback")
-        config = ParametroFinanciero.objects.create(
-            iva=21, iva_financiacion=10.5,
-            comision_pago_tech=4, arancel_plataforma=1.8,
-            comision_pago_tech_debito=3.49, arancel_plataforma_debito=0.8
-        )
+    from app2.tarifario import get_tarifario
+    from app2 import crud as admin_crud
+
+    return _cotizar_link(
+        cliente, monto_contado, cuotas, tipo_tarjeta, descripcion,
+        get_tarifario(), admin_crud.ids_cuotas_visibles(cliente.id),
+    )
+
+
+def _guardar_link(cotizacion, payment_url):
+    try:
+        link_obj = _nuevo_link(cotizacion, payment_url)
+        with transaction.atomic():
+            link_obj.save()
+    except IntegrityError:
+        # Otro worker guardó antes la misma clave de idempotencia (el lock del cache no lo
+        # frenó): vale su link; la orden recién creada en PayZen queda sin usar y vence
+        clave = cotizacion.get('clave_idempotencia')
+        existente = _link_por_clave(cotizacion['cliente'].pk, clave) if clave else None
+        if existente is None:
+            logger.exception(f"create_link — falla crítica guardando el link — order_id={cotizacion['order_id']}")
+            return None, ["Falla crítica guardando el link. Reintente."]
+        logger.warning(f"create_link — clave ya guardada por otro proceso — id={existente.pk} "
+                       f"order_id_descartado={cotizacion['order_id']} clave={clave}")
+        return _reenvio(existente, cotizacion['monto_cobrado'], cotizacion['cuotas'], cotizacion['tipo_tarjeta'])
+    except Exception as e:
+        logger.exception(f"create_link — falla crítica con PayZen — order_id={cotizacion['order_id']}: {e}")
+        return None, [f"Falla crítica con PayZen: {str(e)}"]
+
+    logger.info(
+        f"create_link — link creado OK — id={link_obj.id} order_id={link_obj.order_id} "
+        f"cliente={cotizacion['cliente'].nombre} cobrado={link_obj.monto} "
+        f"descuento={link_obj.commission_amount} neto={link_obj.receiver_amount} "
+        f"tipo={link_obj.tipo_tarjeta} cuotas={link_obj.cuotas}"
+    )
+    return link_obj, []
+
+
+def _cotizar_link(cliente, monto_contado, cuotas, tipo_tarjeta, descripcion, tarifario, planes_visibles):
+    """
+    Resuelve la tarifa, calcula el desglose y arma el payload de PayZen de un link,
+    sin tocar la red ni la base. Devuelve (cotizacion, errores).
+    """
+    # 1. Tarifa efectiva (tarifario compilado en memoria)
+    tarifa, errores = tarifario.resolver(tipo_tarjeta, cuotas, planes_visibles)
+    if errores:
+        logger.error(f"create_link — tarifa no disponible — tipo={tipo_tarjeta} cuotas={cuotas}: {errores}")
+        return None, errores
+
+    # Débito y tarjetas sin cuotas quedan siempre en 1 pago
+    cuotas = tarifa.cuotas
+    logger.debug(
+        f"create_link — tarifa {tarifa.tipo} {cuotas}c plan='{tarifa.plan_nombre or '-'}' "
+        f"tasa_eff={tarifa.tasa_eff:.4f}% pt_eff={tarifa.pt_eff:.4f}% ar_eff={tarifa.ar_eff:.4f}%"
+    )
 
     try:
         # El monto ingresado ES lo que cobra al cliente (precio bruto)
         monto_cobrado = Decimal(str(monto_contado))
 
-        if tipo_tarjeta == 'debito':
-            # Débito: siempre usa config global, sin tasa de financiación
-            iva_f   = Decimal(str(config.iva)) / 100
-            pt_eff  = Decimal(str(config.comision_pago_tech_debito)) * (1 + iva_f)
-            ar_eff  = Decimal(str(config.arancel_plataforma_debito)) * (1 + iva_f)
-            tasa_eff = Decimal('0')
-            logger.debug(
-                f"create_link — DÉBITO: pt_eff={pt_eff:.4f}% "
-                f"ar_eff={ar_eff:.4f}% tasa=0%"
-            )
-        # Tarjeta custom (no bancaria)
-        elif tipo_tarjeta.startswith('custom_'):
-            from app2.models import TarjetaCustom
-            slug = tipo_tarjeta.replace('custom_', '')
-            try:
-                tc = TarjetaCustom.objects.get(slug=slug, activa=True)
-            except TarjetaCustom.DoesNotExist:
-                return None, [f'La tarjeta seleccionada no esta disponible.']
-
-            if tc.acepta_cuotas and cuotas > 1:
-                # Tiene cuotas — buscar plan específico para esta tarjeta
-                # Cae al bloque else de abajo para reutilizar la lógica de CuotaConfig
-                # Usamos los parámetros base de la tarjeta custom para contado
-                # y los overrides del plan para cuotas
-                from django.db.models import Q
-                plan = CuotaConfig.objects.filter(
-                    numero_cuota=cuotas,
-                    activa=True,
-                    tarjeta_custom__slug=slug
-                ).first()
-
-                if not plan:
-                    return None, [f'No hay plan de {cuotas} cuotas configurado para {tc.nombre}.']
-
-                iva_val     = plan.iva_override              if plan.iva_override is not None              else tc.iva
-                iva_fin_val = plan.iva_financiacion_override if plan.iva_financiacion_override is not None else tc.iva
-                com_val     = plan.com_credito_override      if plan.com_credito_override is not None      else tc.comision
-                ar_val      = plan.arancel_credito_override  if plan.arancel_credito_override is not None  else tc.arancel
-
-                iva_f     = Decimal(str(iva_val))     / 100
-                iva_fin_f = Decimal(str(iva_fin_val)) / 100
-
-                tasa_eff = Decimal(str(plan.tasa_base)) * (1 + iva_fin_f) if plan.tasa_aplica_iva_fin else Decimal(str(plan.tasa_base))
-                pt_eff   = Decimal(str(com_val))        * (1 + iva_f)     if plan.comision_aplica_iva  else Decimal(str(com_val))
-                ar_eff   = Decimal(str(ar_val))         * (1 + iva_f)     if plan.comision_aplica_iva  else Decimal(str(ar_val))
-
-            else:
-                # Contado sin cuotas
-                cuotas = 1
-                iva_f    = Decimal(str(tc.iva)) / 100
-                pt_eff   = Decimal(str(tc.comision)) * (1 + iva_f) if tc.aplica_iva else Decimal(str(tc.comision))
-                ar_eff   = Decimal(str(tc.arancel))  * (1 + iva_f) if tc.aplica_iva else Decimal(str(tc.arancel))
-                tasa_eff = Decimal('0')
-                plan     = None
-        else:
-            # Crédito genérico
-            if cuotas > 1:
-                # Crédito genérico — plan sin tarjeta custom asignada
-                plan = CuotaConfig.objects.filter(
-                    numero_cuota=cuotas,
-                    activa=True,
-                    tarjeta_custom__isnull=True
-                ).first()
-
-                if not plan:
-                    logger.error(f"create_link — plan de {cuotas} cuotas no encontrado o inactivo")
-                    return None, [f'El plan de {cuotas} cuotas no está habilitado actualmente.']
-
-                # Valores efectivos del plan (override o global)
-                iva_val     = plan.iva_override              if plan.iva_override is not None              else config.iva
-                iva_fin_val = plan.iva_financiacion_override if plan.iva_financiacion_override is not None else config.iva_financiacion
-                com_val     = plan.com_credito_override      if plan.com_credito_override is not None      else config.comision_pago_tech
-                ar_val      = plan.arancel_credito_override  if plan.arancel_credito_override is not None  else config.arancel_plataforma
-
-                iva_f     = Decimal(str(iva_val))     / 100
-                iva_fin_f = Decimal(str(iva_fin_val)) / 100
-
-                # Cada toggle es independiente
-                tasa_eff = Decimal(str(plan.tasa_base)) * (1 + iva_fin_f) if plan.tasa_aplica_iva_fin else Decimal(str(plan.tasa_base))
-                pt_eff   = Decimal(str(com_val))        * (1 + iva_f)     if plan.comision_aplica_iva  else Decimal(str(com_val))
-                ar_eff   = Decimal(str(ar_val))         * (1 + iva_f)     if plan.comision_aplica_iva  else Decimal(str(ar_val))
-
-                logger.debug(
-                    f"create_link — CRÉDITO {cuotas}c plan='{plan.nombre}' "
-                    f"tasa_base={plan.tasa_base}% iva_factor={iva_f} "
-                    
-                    f"tasa_eff={tasa_eff:.4f}% pt_eff={pt_eff:.4f}% ar_eff={ar_eff:.4f}%"
-                )
-            else:
-                # Crédito contado (1 cuota): sin tasa de financiación
-                iva_f   = Decimal(str(config.iva)) / 100
-                pt_eff  = Decimal(str(config.comision_pago_tech)) * (1 + iva_f)
-                ar_eff  = Decimal(str(config.arancel_plataforma)) * (1 + iva_f)
-                tasa_eff = Decimal('0')
-                logger.debug(
-                    f"create_link — CRÉDITO contado: pt_eff={pt_eff:.4f}% ar_eff={ar_eff:.4f}%"
-                )
-
         # 2. Total de descuentos y validación
-        total_desc_pct = tasa_eff + pt_eff + ar_eff
-        logger.debug(
-            f"create_link — total_desc={total_desc_pct:.4f}% "
-            f"(tasa={tasa_eff:.4f}% + pt={pt_eff:.4f}% + ar={ar_eff:.4f}%)"
-        )
+        total_desc_pct = tarifa.total_pct
+        logger.debug(f"create_link — total_desc={total_desc_pct:.4f}%")
 
-        if total_desc_pct >= 100:
+        if not tarifa.valida:
             logger.error(f"create_link — tasas superan el 100%: {total_desc_pct}%")
             return None, ["Error crítico: La sumatoria de tasas supera el 100%. Verifique la configuración."]
 
-        # 3. Cálculo modelo ABSORBE
-        # El vendedor cobra monto_cobrado al cliente
-        # Payway descuenta el porcentaje y le liquida el neto
-        commission_amount = (monto_cobrado * (total_desc_pct / 100)).quantize(
-            Decimal('0.01'), rounding=ROUND_HALF_UP
-        )
-        receiver_amount = (monto_cobrado - commission_amount).quantize(
-            Decimal('0.01'), rounding=ROUND_HALF_UP
-        )
+        # 3. Cálculo modelo ABSORBE + desglose proporcional para guardar en DB
+        calculo = tarifa.calcular(monto_cobrado)
 
         logger.debug(
             f"create_link — ABSORBE: cobrado={monto_cobrado} "
-            f"descuento={commission_amount} neto_vendedor={receiver_amount}"
-        )
-        
-        # ── Desglose proporcional para guardar en DB ───────────────────
-        tasa_pct_val = tasa_eff
-        com_pct_val  = pt_eff
-        ar_pct_val   = ar_eff
-
-        if total_desc_pct > 0:
-            d_ar   = (commission_amount * (ar_pct_val   / total_desc_pct)).quantize(Decimal('0.01'), ROUND_HALF_UP)
-            d_tasa = (commission_amount * (tasa_pct_val / total_desc_pct)).quantize(Decimal('0.01'), ROUND_HALF_UP)
-            d_com  = commission_amount - d_ar - d_tasa
-        else:
-            d_ar   = Decimal('0.00')
-            d_tasa = Decimal('0.00')
-            d_com  = commission_amount
-
-        # IVA desglosado
-        d_iva_21  = Decimal('0.00')
-        d_iva_105 = Decimal('0.00')
-
-        if tipo_tarjeta == 'debito':
-            # Débito siempre IVA 21% sobre todo
-            base_sin_iva = commission_amount / (1 + Decimal(str(config.iva)) / 100)
-            d_iva_21 = (commission_amount - base_sin_iva).quantize(Decimal('0.01'), ROUND_HALF_UP)
-
-        elif cuotas > 1 and plan:
-            iva_fin_val = plan.iva_financiacion_override if plan.iva_financiacion_override is not None else config.iva_financiacion
-            iva_fin_f_local = Decimal(str(iva_fin_val)) / 100
-
-            if plan.comision_aplica_iva and (d_ar + d_com) > 0:
-                base_com_ar = (d_ar + d_com) / (1 + iva_f)
-                d_iva_21 = (d_ar + d_com - base_com_ar).quantize(Decimal('0.01'), ROUND_HALF_UP)
-
-            if plan.tasa_aplica_iva_fin and d_tasa > 0:
-                base_tasa = d_tasa / (1 + iva_fin_f_local)
-                d_iva_105 = (d_tasa - base_tasa).quantize(Decimal('0.01'), ROUND_HALF_UP)
-        else:
-            # Crédito contado 1 cuota
-            if (d_ar + d_com) > 0:
-                base_sin_iva = (d_ar + d_com) / (1 + iva_f)
-                d_iva_21 = (d_ar + d_com - base_sin_iva).quantize(Decimal('0.01'), ROUND_HALF_UP)
-
-        d_cuota_valor = (monto_cobrado / cuotas).quantize(Decimal('0.01'), ROUND_HALF_UP)
-
-        logger.debug(
-            f"create_link — desglose: ar={d_ar} com={d_com} tasa={d_tasa} "
-            f"iva_21={d_iva_21} iva_105={d_iva_105}"
+            f"descuento={calculo['commission_amount']} neto_vendedor={calculo['receiver_amount']} "
+            f"desglose: ar={calculo['desglose_arancel']} com={calculo['desglose_comision']} "
+            f"tasa={calculo['desglose_tasa']} iva_21={calculo['desglose_iva_21']} "
+            f"iva_105={calculo['desglose_iva_105']}"
         )
 
     except Exception as e:
-        logger.exception(f"create_link — error en cálculo financiero — cliente={cliente_pk}: {e}")
+        logger.exception(f"create_link — error en cálculo financiero — cliente={cliente.id}: {e}")
         return None, [f'Error en el cálculo financiero: {str(e)}']
 
     # 4. Payload PayZen — el amount es lo que paga el cliente
     amount_in_cents = int(monto_cobrado * 100)
     order_id = f"PAY-{uuid.uuid4().hex[:10].upper()}"
+    # PayZen deja de aceptar el pago al vencer, así el EXPIRED local nunca pisa un cobro
+    expires_at = timezone.now() + timedelta(hours=horas_expiracion(tipo_tarjeta))
 
     payload = {
         "amount": amount_in_cents,
         "currency": "ARS",
         "orderId": order_id,
+        "expirationDate": expires_at.isoformat(timespec='seconds'),
         "channelOptions": {"channelType": "URL"},
         "merchantComment": (
             f"Vendedor: {cliente.nombre} | "
@@ -433,81 +485,334 @@ def create_link(cliente_pk, monto_contado, cuotas=1, tipo_tarjeta='credito', des
             }
         }
     elif tipo_tarjeta.startswith('custom_'):
-        from app2.models import TarjetaCustom
-        slug_tc = tipo_tarjeta.replace('custom_', '')
-        try:
-            tc_obj = TarjetaCustom.objects.get(slug=slug_tc, activa=True)
-            if tc_obj.payzen_code:
-                payload["paymentCards"] = tc_obj.payzen_code
-                # Si acepta cuotas, agregar installmentNumber
-                if tc_obj.acepta_cuotas and cuotas > 1:
-                    payload["transactionOptions"] = {
-                        "cardOptions": {
-                            "installmentNumber": int(cuotas),
-                            "installmentOptionsEditability": "FORBIDDEN"
-                        }
+        if tarifa.payzen_code:
+            payload["paymentCards"] = tarifa.payzen_code
+            # Si acepta cuotas, agregar installmentNumber
+            if tarifa.acepta_cuotas and cuotas > 1:
+                payload["transactionOptions"] = {
+                    "cardOptions": {
+                        "installmentNumber": int(cuotas),
+                        "installmentOptionsEditability": "FORBIDDEN"
                     }
-        except TarjetaCustom.DoesNotExist:
-            pass
+                }
 
     logger.debug(
         f"create_link — payload PayZen: order_id={order_id} "
         f"amount={amount_in_cents} cents ({monto_cobrado} ARS)"
     )
 
-    # 5. Llamada a PayZen
+    return {
+        'cliente':       cliente,
+        'tarifa':        tarifa,
+        'monto_cobrado': monto_cobrado,
+        'cuotas':        cuotas,
+        'tipo_tarjeta':  tipo_tarjeta,
+        'descripcion':   descripcion or '',
+        'calculo':       calculo,
+        'order_id':      order_id,
+        'expires_at':    expires_at,
+        'payload':       payload,
+    }, []
+
+
+def _crear_orden_payzen(payload) -> Tuple[Optional[str], List[str]]:
+    """POST CreatePaymentOrder. Devuelve (paymentURL, errores)."""
+    order_id = payload.get('orderId')
     try:
-        headers = get_payzen_auth_header()
-        response = requests.post(settings.PAYZEN_URL, json=payload, headers=headers, timeout=20)
-        res_data = response.json()
-        logger.debug(
-            f"create_link — respuesta PayZen status={res_data.get('status')} "
-            f"order_id={order_id}"
-        )
+        return _resultado_orden_payzen(order_id, payzen.crear_orden(payload))
+    except Exception as e:
+        return _falla_orden_payzen(order_id, e)
 
-        if res_data.get("status") == "SUCCESS":
-            payment_url = res_data["answer"]["paymentURL"]
-            link_obj = LinkPago.objects.create(
-                cliente=cliente,
-                order_id=order_id,
-                monto=monto_cobrado,          # lo que paga el cliente
-                cuotas=cuotas,
-                tipo_tarjeta=tipo_tarjeta,
-                descripcion=descripcion or '',
-                commission_percent=total_desc_pct,
-                commission_amount=commission_amount,
-                receiver_amount=receiver_amount,  # lo que recibe el vendedor
-                link=payment_url,
-                desglose_arancel=d_ar,
-                desglose_comision=d_com,
-                desglose_tasa=d_tasa,
-                desglose_iva_21=d_iva_21,
-                desglose_iva_105=d_iva_105,
-                desglose_cuota_valor=d_cuota_valor
-            )
-            logger.info(
-                f"create_link — link creado OK — id={link_obj.id} order_id={order_id} "
-                f"cliente={cliente.nombre} cobrado={monto_cobrado} "
-                f"descuento={commission_amount} neto={receiver_amount} "
-                f"tipo={tipo_tarjeta} cuotas={cuotas}"
-            )
-            return link_obj, []
 
-        else:
-            answer    = res_data.get("answer", {})
-            error_msg = answer.get("errorMessage", "Respuesta fallida del gateway.")
-            logger.error(
-                f"create_link — PayZen rechazó — order_id={order_id} "
-                f"error='{error_msg}'"
-            )
-            return None, [f"Pasarela PayZen indica: {error_msg}"]
+def _resultado_orden_payzen(order_id, res_data) -> Tuple[Optional[str], List[str]]:
+    logger.debug(
+        f"create_link — respuesta PayZen status={res_data.get('status')} "
+        f"order_id={order_id}"
+    )
+
+    if res_data.get("status") == "SUCCESS":
+        return res_data["answer"]["paymentURL"], []
 
-    except requests.exceptions.Timeout:
+    answer    = res_data.get("answer", {})
+    error_msg = answer.get("errorMessage", "Respuesta fallida del gateway.")
+    logger.error(
+        f"create_link — PayZen rechazó — order_id={order_id} "
+        f"error='{error_msg}'"
+    )
+    return None, [f"Pasarela PayZen indica: {error_msg}"]
+
+
+MENSAJE_PASARELA_DEGRADADA = (
+    "La pasarela de pago PayZen está degradada en este momento y no se generó el link. "
+    "Reintente en unos minutos."
+)
+
+
+def _falla_orden_payzen(order_id, e) -> Tuple[None, List[str]]:
+    if isinstance(e, payzen.CircuitoAbierto):
+        logger.warning(f"create_link — PayZen degradado, sin llamar — order_id={order_id}")
+        return None, [MENSAJE_PASARELA_DEGRADADA]
+    if isinstance(e, requests.exceptions.Timeout):
         logger.error(f"create_link — Timeout con PayZen — order_id={order_id}")
         return None, ["La pasarela de pago tardó demasiado. Reintente."]
-    except Exception as e:
-        logger.exception(f"create_link — falla crítica con PayZen — order_id={order_id}: {e}")
-        return None, [f"Falla crítica con PayZen: {str(e)}"]
+    logger.exception(f"create_link — falla crítica con PayZen — order_id={order_id}: {e}")
+    return None, [f"Falla crítica con PayZen: {str(e)}"]
+
+
+def _nuevo_link(cotizacion, payment_url) -> LinkPago:
+    """LinkPago sin guardar a partir de una cotización y la URL devuelta por PayZen."""
+    from app2 import crud as admin_crud
+
+    calculo = cotizacion['calculo']
+    return LinkPago(
+        cliente=cotizacion['cliente'],
+        tarifa_id=admin_crud.congelar_tarifa(cotizacion['tarifa']),
+        order_id=cotizacion['order_id'],
+        clave_idempotencia=cotizacion.get('clave_idempotencia'),
+        expires_at=cotizacion['expires_at'],
+        monto=cotizacion['monto_cobrado'],          # lo que paga el cliente
+        cuotas=cotizacion['cuotas'],
+        tipo_tarjeta=cotizacion['tipo_tarjeta'],
+        descripcion=cotizacion['descripcion'],
+        commission_percent=cotizacion['tarifa'].total_pct,
+        commission_amount=calculo['commission_amount'],
+        receiver_amount=calculo['receiver_amount'],  # lo que recibe el vendedor
+        link=payment_url,
+        desglose_arancel=calculo['desglose_arancel'],
+        desglose_comision=calculo['desglose_comision'],
+        desglose_tasa=calculo['desglose_tasa'],
+        desglose_iva_21=calculo['desglose_iva_21'],
+        desglose_iva_105=calculo['desglose_iva_105'],
+        desglose_cuota_valor=calculo['desglose_cuota_valor']
+    )
+
+
+# ==============================================================================
+# CREACIÓN MASIVA DE LINKS
+# ==============================================================================
+
+MAX_FILAS_MASIVAS = 200
+COLUMNAS_MASIVAS = ('monto', 'cuotas', 'tipo_tarjeta', 'descripcion')
+
+
+def parsear_filas_masivas(contenido: str, formato: str = 'csv') -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Convierte un CSV (con encabezado monto,cuotas,tipo_tarjeta,descripcion; separador ',' o ';')
+    o una lista JSON de objetos con esas claves en la lista de filas que recibe create_links_masivo.
+    """
+    contenido = (contenido or '').lstrip('\ufeff').strip()
+    if not contenido:
+        return [], ['El archivo está vacío.']
+
+    if formato == 'json':
+        try:
+            datos = json.loads(contenido)
+        except json.JSONDecodeError:
+            return [], ['JSON inválido.']
+        if isinstance(datos, dict):
+            datos = datos.get('filas')
+        if not isinstance(datos, list) or not all(isinstance(f, dict) for f in datos):
+            return [], ['Se esperaba una lista de filas con monto, cuotas, tipo_tarjeta y descripcion.']
+        return datos, []
+
+    primera_linea = contenido.splitlines()[0]
+    separador = ';' if primera_linea.count(';') > primera_linea.count(',') else ','
+    lector = csv.DictReader(io.StringIO(contenido), delimiter=separador)
+    encabezado = [(c or '').strip().lower() for c in (lector.fieldnames or [])]
+    if 'monto' not in encabezado:
+        return [], [f"El CSV debe tener encabezado con las columnas: {', '.join(COLUMNAS_MASIVAS)}."]
+    lector.fieldnames = encabezado
+    return [{k: (v or '').strip() for k, v in fila.items() if k in COLUMNAS_MASIVAS} for fila in lector], []
+
+
+def create_links_masivo(cliente_pk: Any, filas: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Crea varios links de una vez. Todas las filas se cotizan contra el mismo tarifario,
+    las órdenes de PayZen se crean en paralelo (hasta PAYZEN_CONCURRENCIA a la vez) y
+    los links aceptados se guardan con un único bulk_create.
+    Devuelve un reporte por fila: {fila, ok, order_id, link, monto, neto, errors}.
+    Una fila rechazada no frena al resto.
+    """
+    cliente = get_cliente(cliente_pk)
+    if not cliente:
+        logger.error(f"create_links_masivo — cliente no encontrado id={cliente_pk}")
+        return [], ['Cliente no encontrado.']
+    if not filas:
+        return [], ['No hay filas para procesar.']
+    if len(filas) > MAX_FILAS_MASIVAS:
+        return [], [f'Se pueden crear hasta {MAX_FILAS_MASIVAS} links por lote.']
+
+    from app2.tarifario import get_tarifario
+    from app2 import crud as admin_crud
+
+    tarifario = get_tarifario()
+    planes_visibles = admin_crud.ids_cuotas_visibles(cliente.id)
+
+    # 1. Validación y cotización de todas las filas en una pasada
+    reporte = []
+    cotizaciones = {}
+    for numero, fila in enumerate(filas, start=1):
+        resultado = {'fila': numero, 'ok': False, 'order_id': None, 'link': None,
+                     'monto': None, 'neto': None, 'errors': []}
+        reporte.append(resultado)
+
+        monto = str(fila.get('monto') or '').strip().replace(',', '.')
+        tipo = str(fila.get('tipo_tarjeta') or 'credito').strip().lower()
+        descripcion = str(fila.get('descripcion') or '').strip()
+        try:
+            monto_dec = Decimal(monto)
+            if not monto_dec.is_finite() or monto_dec <= 0:
+                raise ValueError(monto)
+        except Exception:
+            resultado['errors'] = ['Monto inválido.']
+            continue
+        try:
+            cuotas = int(str(fila.get('cuotas') or '1').strip())
+            if cuotas < 1:
+                raise ValueError(cuotas)
+        except ValueError:
+            resultado['errors'] = ['Cantidad de cuotas inválida.']
+            continue
+
+        cotizacion, errores = _cotizar_link(
+            cliente, monto_dec, cuotas, tipo, descripcion, tarifario, planes_visibles
+        )
+        if errores:
+            resultado['errors'] = errores
+            continue
+        cotizaciones[numero] = cotizacion
+        resultado['order_id'] = cotizacion['order_id']
+
+    # 2. Órdenes PayZen con concurrencia acotada
+    urls = {}
+    if cotizaciones:
+        concurrencia = max(1, min(settings.PAYZEN_CONCURRENCIA, len(cotizaciones)))
+        with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix='payzen') as pool:
+            futuros = {
+                numero: pool.submit(_crear_orden_payzen, cotizacion['payload'])
+                for numero, cotizacion in cotizaciones.items()
+            }
+            for numero, futuro in futuros.items():
+                payment_url, errores = futuro.result()
+                if errores:
+                    reporte[numero - 1]['errors'] = errores
+                else:
+                    urls[numero] = payment_url
+
+    # 3. Alta en un solo INSERT
+    if urls:
+        try:
+            links = LinkPago.objects.bulk_create(
+                [_nuevo_link(cotizaciones[numero], url) for numero, url in urls.items()]
+            )
+        except Exception as e:
+            logger.exception(f"create_links_masivo — error guardando links — cliente={cliente.id}: {e}")
+            for numero in urls:
+                reporte[numero - 1]['errors'] = [f'Error guardando el link: {str(e)}']
+        else:
+            for numero, link_obj in zip(urls, links):
+                reporte[numero - 1].update({
+                    'ok':    True,
+                    'link':  link_obj.link,
+                    'monto': float(link_obj.monto),
+                    'neto':  float(link_obj.receiver_amount),
+                })
+
+    creados = sum(1 for r in reporte if r['ok'])
+    logger.info(
+        f"create_links_masivo — cliente={cliente.nombre} filas={len(filas)} "
+        f"creados={creados} rechazados={len(filas) - creados}"
+    )
+    return reporte, []
+
+
+MAX_MONTOS_COTIZACION = 50
+
+
+def cotizar_montos(cliente_pk: Any, montos: List[Any]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Cotiza uno o varios montos contra todos los planes visibles para el cliente
+    (débito, crédito genérico y cada tarjeta custom activa) en una sola pasada.
+    """
+    from app2.tarifario import get_tarifario
+    from app2 import crud as admin_crud
+
+    if not montos:
+        return [], ['Debe indicar al menos un monto.']
+    if len(montos) > MAX_MONTOS_COTIZACION:
+        return [], [f'Se pueden cotizar hasta {MAX_MONTOS_COTIZACION} montos por consulta.']
+
+    try:
+        montos_dec = [Decimal(str(m).strip()) for m in montos]
+    except Exception:
+        logger.warning(f"cotizar_montos — monto inválido — cliente={cliente_pk} montos={montos}")
+        return [], ['Monto inválido.']
+    if any(not m.is_finite() or m < 0 for m in montos_dec):
+        return [], ['Monto inválido.']
+
+    tarifas = get_tarifario().tarifas_visibles(admin_crud.ids_cuotas_visibles(cliente_pk))
+
+    cotizaciones = []
+    for monto in montos_dec:
+        planes = []
+        for tarifa in tarifas:
+            calculo = tarifa.calcular(monto)
+            planes.append({
+                'tipo_tarjeta': tarifa.tipo_tarjeta,
+                'cuotas':       tarifa.cuotas,
+                'nombre':       tarifa.nombre,
+                'porcentaje':   float(tarifa.total_pct),
+                'comision':     float(calculo['commission_amount']),
+                'neto':         float(calculo['receiver_amount']),
+                'valor_cuota':  float(calculo['desglose_cuota_valor']),
+            })
+        cotizaciones.append({'monto': float(monto), 'planes': planes})
+
+    logger.debug(
+        f"cotizar_montos — cliente={cliente_pk} montos={len(montos_dec)} planes={len(tarifas)}"
+    )
+    return cotizaciones, []
+
+
+def matriz_tarifas(cliente_pk: Any) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Matriz de tasas efectivas visibles para el cliente, para que la vista previa
+    calcule comisión y neto en el navegador (modelo ABSORBE).
+
+    Los porcentajes van como texto con todos sus decimales: el cliente aplica
+    monto × porcentaje / 100 redondeado al centavo (half-up) y obtiene el mismo
+    resultado que create_link. `version` es un hash del contenido (sirve de ETag)
+    y `modificado` el momento en que se armó el tarifario.
+    """
+    from app2.tarifario import get_tarifario
+    from app2 import crud as admin_crud
+
+    try:
+        cliente = Cliente.objects.only('id').get(pk=cliente_pk)
+    except Cliente.DoesNotExist:
+        return None, ['Cliente no encontrado.']
+
+    tarifario = get_tarifario()
+    tarifas = tarifario.tarifas_visibles(admin_crud.ids_cuotas_visibles(cliente.id))
+    planes = [
+        {
+            'tipo_tarjeta': tarifa.tipo_tarjeta,
+            'cuotas':       tarifa.cuotas,
+            'nombre':       tarifa.nombre,
+            'porcentaje':   format(tarifa.total_pct.normalize(), 'f'),
+        }
+        for tarifa in tarifas
+    ]
+    contenido = json.dumps(planes, sort_keys=True, separators=(',', ':'))
+    version = hashlib.sha1(contenido.encode('utf-8')).hexdigest()[:16]
+
+    logger.debug(f"matriz_tarifas — cliente={cliente.id} planes={len(planes)} version={version}")
+    return {
+        'version':    version,
+        'modificado': tarifario.construido_en,
+        'planes':     planes,
+    }, []
+
 
 def list_links_for_cliente(cliente_pk: Any):
     qs = LinkPago.objects.filter(cliente_id=cliente_pk).order_by('-created_at')
@@ -530,18 +835,300 @@ def get_invoice_for_link(link_id: Any, cliente_pk: Any) -> Tuple[Optional[str],
         return None, None, ['Link no encontrado.']
 
 
+def contexto_ticket(link) -> Dict[str, Any]:
+    """Contexto de ticket_pdf.html para un link con cliente y tarifa ya cargados."""
+    from app2 import crud as admin_crud
+
+    monto = Decimal(str(link.monto))
+
+    # ── Leer desglose congelado directamente de la DB ──────────────
+    # Si el link fue creado antes de esta migración, los campos
+    # tendrán valor 0 — en ese caso recalculamos como fallback
+    tiene_desglose = link.desglose_arancel + link.desglose_comision + link.desglose_tasa > 0
+
+    if tiene_desglose:
+        ar_monto    = link.desglose_arancel
+        com_monto   = link.desglose_comision
+        tasa_monto  = link.desglose_tasa
+        iva_21      = link.desglose_iva_21
+        iva_105     = link.desglose_iva_105
+        cuota_valor = link.desglose_cuota_valor
+        logger.debug(f"PDF — usando desglose congelado de DB — link_id={link.pk}")
+    else:
+        # Fallback para links anteriores a la migración
+        logger.warning(f"PDF — desglose no guardado, recalculando — link_id={link.pk}")
+        total_commission = Decimal(str(link.commission_amount))
+        cuota_valor = (monto / link.cuotas_elegidas).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        ar_monto    = (total_commission / 3).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        tasa_monto  = (total_commission / 3).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        com_monto   = total_commission - ar_monto - tasa_monto
+        iva_21      = Decimal('0.00')
+        iva_105     = Decimal('0.00')
+
+    # Arancel nominal: el de la tarifa congelada; los links anteriores
+    # a las tarifas congeladas usan la configuración actual
+    if link.tarifa_id:
+        arancel_pct = link.tarifa.arancel
+    else:
+        config = admin_crud.get_or_create_config()
+        arancel_pct = config.arancel_plataforma if link.tipo_tarjeta == 'credito' else config.arancel_plataforma_debito
+
+    logger.debug(
+        f"PDF — ar={ar_monto} com={com_monto} tasa={tasa_monto} "
+        f"iva_21={iva_21} iva_105={iva_105}"
+    )
+
+    return {
+        'link':     link,
+        'cliente':  link.cliente,
+        'arancel_pct': Decimal(str(arancel_pct)).quantize(Decimal('0.01')),
+        'desglose': {
+            'arancel':     ar_monto,
+            'servicio':    com_monto,
+            'costo_finan': tasa_monto,
+            'iva_21':      iva_21,
+            'iva_105':     iva_105,
+            'cuota_valor': cuota_valor,
+        },
+        'liq_nro':  link.auth_code if link.auth_code else f"00{link.id}",
+        'lote_nro': link.lote_number if link.lote_number else "001",
+    }
+
+
+def html_ticket(link) -> str:
+    return render_to_string('ticket_pdf.html', contexto_ticket(link))
+
+
+def pdf_ticket(link) -> Tuple[str, str]:
+    """
+    (ruta, clave) del PDF del ticket en el almacén de app1/pdfs.py. El desglose está
+    congelado en el link, así que se renderiza una vez por versión del contenido.
+    """
+    return pdfs.obtener('tickets', link.pk, html_ticket(link))
+
+
+def bytes_ticket(link) -> bytes:
+    with open(pdf_ticket(link)[0], 'rb') as f:
+        return f.read()
+
+
+def nombre_pdf_ticket(link) -> str:
+    return f"Liquidacion_{link.auth_code if link.auth_code else link.id}.pdf"
+
+
+class _SalidaZip(io.RawIOBase):
+    """Destino no posicionable de zipfile: acumula lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        super().__init__()
+        self.partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self) -> bytes:
+        datos = b''.join(self.partes)
+        self.partes.clear()
+        return datos
+
+
+def zip_tickets(links) -> Iterator[bytes]:
+    """
+    ZIP con el ticket PDF de cada link, generado de a partes para un StreamingHttpResponse.
+    El HTML se arma acá (lee la base); los PDF que no están en el almacén se renderizan
+    en un pool de procesos propio de la exportación, PDF_ZIP_PROCESOS a la vez, y cada
+    uno entra al ZIP apenas termina. El pool se cierra al terminar el ZIP; en memoria
+    queda a lo sumo una ventana de pedidos en curso.
+    """
+    hilos = max(1, settings.PDF_ZIP_PROCESOS)
+    salida = _SalidaZip()
+    errores = []
+    total = 0
+
+    with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_STORED) as zf, \
+            pdfs.PoolDeRender('PDF_ZIP_PROCESOS') as procesos, \
+            ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='pdf-zip') as pool:
+        en_curso = {}
+
+        def agregar(listos):
+            nonlocal total
+            for futuro in listos:
+                link = en_curso.pop(futuro)
+                nombre = f"{slugify(link.cliente.nombre) or link.cliente_id}/{link.created_at:%Y-%m-%d}_{link.order_id or link.pk}.pdf"
+                try:
+                    zf.write(futuro.result()[0], nombre)
+                    total += 1
+                except Exception as e:
+                    logger.exception(f"zip_tickets — error renderizando — link_id={link.pk}: {e}")
+                    errores.append(f"{link.order_id or link.pk}: {e}")
+
+        for link in links.iterator(chunk_size=200):
+            en_curso[pool.submit(pdfs.obtener, 'tickets', link.pk, html_ticket(link), procesos)] = link
+            if len(en_curso) >= 2 * hilos:
+                listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+                agregar(listos)
+                yield salida.vaciar()
+        while en_curso:
+            listos, _ = wait(en_curso, return_when=FIRST_COMPLETED)
+            agregar(listos)
+            yield salida.vaciar()
+
+        if errores:
+            zf.writestr('errores.txt', "\n".join(errores) + "\n")
+    logger.info(f"zip_tickets — tickets={total} errores={len(errores)}")
+    yield salida.vaciar()
+
+
+def _periodo_mensual(periodo: str) -> Optional[Tuple[datetime, datetime]]:
+    """'AAAA-MM' → [inicio, fin) en la zona horaria activa; None si no es un mes válido."""
+    try:
+        inicio = datetime.strptime(periodo or '', '%Y-%m')
+    except ValueError:
+        return None
+    fin = inicio.replace(year=inicio.year + 1, month=1) if inicio.month == 12 else inicio.replace(month=inicio.month + 1)
+    return timezone.make_aware(inicio), timezone.make_aware(fin)
+
+
+def resumen_mensual(cliente_pk: Any, periodo: str) -> Tuple[Optional[Tuple[str, str, str]], List[str]]:
+    """
+    Resumen de liquidaciones del mes `periodo` ('AAAA-MM') de un comercio en un solo PDF:
+    una fila por pago con el desglose congelado del link y los totales del mes sumados
+    en la base. Va al almacén de app1/pdfs.py como los tickets: la clave sale del HTML,
+    así que solo se vuelve a renderizar si cambia algún pago del período.
+    Devuelve ((ruta, clave, nombre_archivo), errores).
+    """
+    rango = _periodo_mensual(periodo)
+    if not rango:
+        return None, ['Período inválido, use el formato AAAA-MM.']
+    cliente = get_cliente(cliente_pk)
+    if not cliente:
+        return None, ['Cliente no encontrado.']
+
+    inicio, fin = rango
+    pagos = LinkPago.objects.filter(
+        cliente_id=cliente.pk, pagado=True, created_at__gte=inicio, created_at__lt=fin,
+    )
+    totales = pagos.aggregate(
+        cantidad=Count('id'),
+        monto=Sum('monto'),
+        retenido=Sum('commission_amount'),
+        neto=Sum('receiver_amount'),
+        arancel=Sum('desglose_arancel'),
+        servicio=Sum('desglose_comision'),
+        costo_finan=Sum('desglose_tasa'),
+        iva_21=Sum('desglose_iva_21'),
+        iva_105=Sum('desglose_iva_105'),
+    )
+    if not totales['cantidad']:
+        return None, ['No hay pagos en el período.']
+    cantidad = totales.pop('cantidad')
+    totales = {k: Decimal(v or 0).quantize(Decimal('0.01')) for k, v in totales.items()}
+    totales['cantidad'] = cantidad
+
+    filas = pagos.order_by('created_at', 'id').only(
+        'created_at', 'order_id', 'auth_code', 'lote_number', 'tipo_tarjeta', 'cuotas_elegidas',
+        'monto', 'commission_amount', 'receiver_amount',
+        'desglose_arancel', 'desglose_comision', 'desglose_tasa', 'desglose_iva_21', 'desglose_iva_105',
+    )
+    html = render_to_string('resumen_mensual_pdf.html', {
+        'cliente': cliente,
+        'inicio':  inicio,
+        'cierre':  fin - timedelta(days=1),
+        'links':   filas.iterator(chunk_size=500),
+        'totales': totales,
+    })
+    ruta_pdf, clave_pdf = pdfs.obtener('resumenes', f"{cliente.pk}/{inicio:%Y-%m}", html)
+    logger.info(f"resumen_mensual — cliente={cliente.pk} período={inicio:%Y-%m} pagos={totales['cantidad']} clave={clave_pdf}")
+    return (ruta_pdf, clave_pdf, f"Resumen_{inicio:%Y-%m}_{cliente.pk:05d}.pdf"), []
+
+
+CAMPOS_LIQUIDACION = (
+    'commission_amount', 'receiver_amount',
+    'desglose_arancel', 'desglose_comision', 'desglose_tasa',
+    'desglose_iva_21', 'desglose_iva_105', 'desglose_cuota_valor',
+)
+MAX_DIFERENCIAS_AUDITORIA = 200
+
+
+def auditar_liquidaciones(periodo: str, cliente_pk: Any = None) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Recalcula los pagos del mes `periodo` ('AAAA-MM') con la tarifa congelada de cada
+    link y los compara con los importes guardados. Corre en centavos enteros
+    (TarifaEfectiva.calcular_centavos, idéntico a calcular()): los totales se acumulan
+    como int y las tarifas se arman una vez por TarifaCongelada, no una por link.
+    Los links anteriores a las tarifas congeladas se cuentan aparte, sin recalcular.
+    """
+    from app2.models import TarifaCongelada
+    from app2.punto_fijo import centavos_a_decimal, decimal_a_centavos
+
+    rango = _periodo_mensual(periodo)
+    if not rango:
+        return None, ['Período inválido, use el formato AAAA-MM.']
+    inicio, fin = rango
+
+    pagos = LinkPago.objects.filter(pagado=True, created_at__gte=inicio, created_at__lt=fin)
+    if cliente_pk is not None:
+        if not get_cliente(cliente_pk):
+            return None, ['Cliente no encontrado.']
+        pagos = pagos.filter(cliente_id=cliente_pk)
+
+    sin_tarifa = pagos.filter(tarifa__isnull=True).count()
+    pagos = pagos.filter(tarifa__isnull=False)
+    tarifas = {
+        congelada.pk: congelada.como_tarifa()
+        for congelada in TarifaCongelada.objects.filter(pk__in=pagos.values('tarifa_id'))
+    }
+
+    totales = dict.fromkeys(CAMPOS_LIQUIDACION, 0)
+    diferencias = []
+    revisados = con_diferencias = 0
+    filas = pagos.order_by('id').values_list('id', 'order_id', 'tarifa_id', 'monto', *CAMPOS_LIQUIDACION)
+    for link_id, order_id, tarifa_id, monto, *guardados in filas.iterator(chunk_size=2000):
+        calculo = tarifas[tarifa_id].calcular_centavos(decimal_a_centavos(monto))
+        revisados += 1
+        distinto = False
+        for campo, guardado in zip(CAMPOS_LIQUIDACION, guardados):
+            recalculado = calculo[campo]
+            totales[campo] += recalculado
+            if decimal_a_centavos(guardado) != recalculado:
+                distinto = True
+                if len(diferencias) < MAX_DIFERENCIAS_AUDITORIA:
+                    diferencias.append({
+                        'link_id':     link_id,
+                        'order_id':    order_id,
+                        'campo':       campo,
+                        'guardado':    guardado,
+                        'recalculado': centavos_a_decimal(recalculado),
+                    })
+        con_diferencias += distinto
+
+    logger.info(
+        f"auditar_liquidaciones — período={inicio:%Y-%m} cliente={cliente_pk or '-'} "
+        f"revisados={revisados} con_diferencias={con_diferencias} sin_tarifa={sin_tarifa}"
+    )
+    return {
+        'periodo':        f"{inicio:%Y-%m}",
+        'revisados':      revisados,
+        'con_diferencias': con_diferencias,
+        'sin_tarifa':     sin_tarifa,
+        'diferencias':    diferencias,
+        'totales':        {campo: centavos_a_decimal(total) for campo, total in totales.items()},
+    }, []
+
+
 def generate_pdf_for_link(link_id: Any, cliente_pk: Any) -> Tuple[Optional[str], Optional[bytes], List[str]]:
     logger.debug(f"generate_pdf_for_link — link_id={link_id} cliente={cliente_pk}")
     try:
-        link = LinkPago.objects.get(pk=link_id, cliente_id=cliente_pk)
+        link = LinkPago.objects.select_related('cliente', 'tarifa').get(pk=link_id, cliente_id=cliente_pk)
         if not link.invoice_text:
             logger.debug(f"generate_pdf_for_link — generando invoice_text para link_id={link_id}")
             link.generate_invoice_text()
             link.save()
-        context = {'link': link, 'cliente': link.cliente}
-        html = render_to_string('ticket_pdf.html', context)
-        from weasyprint import HTML
-        pdf_bytes = HTML(string=html).write_pdf()
+        pdf_bytes = bytes_ticket(link)
         logger.info(f"generate_pdf_for_link — PDF generado OK — link_id={link_id}")
         return f"ticket_link_{link.id}.pdf", pdf_bytes, []
     except Exception as e:
@@ -553,191 +1140,556 @@ def generate_pdf_for_link(link_id: Any, cliente_pk: Any) -> Tuple[Optional[str],
 # VERIFICACIÓN DE PAGOS (PayZen)
 # ==============================================================================
 
+# Estados de PayZen que dan el link por terminado sin pago
+ESTADOS_ANULADOS = ("REFUSED", "CANCELLED", "ERROR", "EXPIRED")
+
+
+def _estado_desde_db(link) -> Dict[str, Any]:
+    """Estado del link con lo que ya hay en la base (actualizado por IPN o por una consulta previa)."""
+    if link.pagado:
+        return {'status': 'CAPTURED', 'pagado': True, 'anulado': False, 'cuotas': link.cuotas_elegidas}
+    if link.status_detalle in ESTADOS_ANULADOS:
+        return {'status': link.status_detalle, 'pagado': False, 'anulado': True, 'cuotas': link.cuotas_elegidas}
+    if link.status_detalle == 'INITIAL':
+        return {
+            'status': 'Esperando Pago...',
+            'pagado': False,
+            'anulado': False,
+            'cuotas': link.cuotas,
+            'mensaje': 'Esperando que el cliente abra el link'
+        }
+    return {'status': link.status_detalle, 'pagado': False, 'anulado': False, 'cuotas': link.cuotas_elegidas}
+
+
+def horas_expiracion(tipo_tarjeta: str) -> int:
+    """Vigencia en horas de un link según su tipo de tarjeta."""
+    return settings.PAYZEN_HORAS_EXPIRACION_POR_TARJETA.get(tipo_tarjeta, settings.PAYZEN_HORAS_EXPIRACION)
+
+
+def _expira_localmente(link, ahora=None) -> bool:
+    """PSP_010 (orden nunca abierta) + link vencido = EXPIRED."""
+    expires_at = link.expires_at or link.created_at + timedelta(hours=horas_expiracion(link.tipo_tarjeta))
+    return (ahora or timezone.now()) >= expires_at
+
+
+def _vencidos(ahora=None):
+    """Links sin pagar que siguen en INITIAL con expires_at pasado (usa el índice de expires_at)."""
+    return LinkPago.objects.filter(
+        pagado=False, status_detalle='INITIAL', expires_at__lte=ahora or timezone.now()
+    )
+
+
+def _marcar_expirados(ids, ahora) -> int:
+    """
+    Marca EXPIRED en un solo UPDATE los `ids` que PayZen confirmó sin actividad (PSP_010)
+    con el link ya vencido. Un pago que entre justo antes sigue llegando por IPN o por
+    la conciliación, que vuelve a mirar los EXPIRED durante PAYZEN_HORAS_GRACIA_EXPIRADOS.
+    """
+    if not ids:
+        return 0
+    expirados = (
+        LinkPago.objects.filter(pk__in=ids, pagado=False)
+        .exclude(status_detalle='EXPIRED')
+        .update(status_detalle='EXPIRED', estado_actualizado_en=ahora)
+    )
+    if expirados:
+        logger.info(f"expirar — links expirados={expirados}")
+    return expirados
+
+
+def expirar_vencidos(limite: int = 100, por_segundo: float = 5.0) -> Dict[str, int]:
+    """
+    Confirma con Order/Get los links vencidos que siguen en INITIAL, los de vencimiento
+    más viejo primero, y expira juntos los que PayZen da sin actividad. Si alguno tuvo
+    actividad (p. ej. se pagó sobre la hora) se aplica como en verificar_estado_pago.
+    """
+    ahora = timezone.now()
+    vencidos = list(_vencidos(ahora).select_related('cliente').order_by('expires_at')[:limite])
+    return _conciliar(vencidos, ahora, por_segundo, origen='expirar_vencidos')
+
+
+def _consulta_vencida(link) -> bool:
+    """Con IPN activo, PayZen se consulta solo si el estado no se actualizó en PAYZEN_IPN_RESPALDO segundos."""
+    referencia = link.estado_actualizado_en or link.created_at
+    return timezone.now() - referencia >= timedelta(seconds=settings.PAYZEN_IPN_RESPALDO)
+
+
+ERROR_TECNICO = {'status': 'Error Tecnico', 'pagado': False, 'anulado': False, 'cuotas': 1}
+
+
+def _estado_degradado(link) -> Dict[str, Any]:
+    """Con el circuito de PayZen abierto se responde el último estado conocido en la base."""
+    logger.debug(f"verificar_estado_pago — PayZen degradado, estado desde DB — order_id={link.order_id}")
+    return {**_estado_desde_db(link), 'degradado': True}
+
+
 def verificar_estado_pago(link_id):
     logger.debug(f"verificar_estado_pago — link_id={link_id}")
 
     try:
         link = LinkPago.objects.get(pk=link_id)
-
-        # 1. Si ya está pagado en DB, no consultamos la API
-        if link.pagado:
-            logger.debug(f"verificar_estado_pago — ya pagado en DB, omitiendo API — link_id={link_id} order_id={link.order_id}")
-            return {'status': 'CAPTURED', 'pagado': True, 'anulado': False, 'cuotas': link.cuotas_elegidas}
+        if not _requiere_consulta(link):
+            return _estado_desde_db(link)
 
         logger.debug(f"verificar_estado_pago — consultando PayZen — order_id={link.order_id}")
+        return _aplicar_consulta(link, payzen.consultar_orden_cacheada(link.order_id))
 
-        payload = {"orderId": link.order_id}
-        response = requests.post(PAYZEN_CHECK_URL, json=payload, headers=get_payzen_auth_header())
-        res_data = response.json()
-
-        payzen_status = res_data.get("status")
-        logger.debug(f"verificar_estado_pago — respuesta PayZen status={payzen_status} order_id={link.order_id}")
-
-        # --- ERROR PSP_010: orden sin actividad aún ---
-        if payzen_status == "ERROR":
-            answer = res_data.get("answer", {})
-            error_code = answer.get("errorCode")
-
-            if error_code == "PSP_010":
-                from django.utils import timezone
-                from datetime import timedelta
-
-                # PayZen no retorna EXPIRED si el link nunca fue abierto.
-                # Lo determinamos localmente comparando la fecha de creación.
-                HORAS_EXPIRACION = 24  # ajustá según tu config en PayZen
-
-                ya_expiro = timezone.now() > link.created_at + timedelta(hours=HORAS_EXPIRACION)
-
-                if ya_expiro:
-                    if link.status_detalle != 'EXPIRED':
-                        link.status_detalle = 'EXPIRED'
-                        link.save(update_fields=['status_detalle'])
-
-                    logger.info(
-                        f"verificar_estado_pago — PSP_010 + tiempo excedido = EXPIRED local "
-                        f"— order_id={link.order_id} created_at={link.created_at}"
-                    )
-                    return {
-                        'status': 'EXPIRED',
-                        'pagado': False,
-                        'anulado': True,   # para que el JS lo trate como finalizado
-                        'cuotas': link.cuotas,
-                    }
+    except payzen.CircuitoAbierto:
+        return _estado_degradado(link)
+    except Exception as e:
+        logger.exception(f"verificar_estado_pago — error técnico — link_id={link_id}: {e}")
 
-                # Si no expiró, sigue esperando normalmente
-                logger.debug(
-                    f"verificar_estado_pago — PSP_010: link aún no abierto — "
-                    f"order_id={link.order_id}"
-                )
-                return {
-                    'status': 'Esperando Pago...',
-                    'pagado': False,
-                    'anulado': False,
-                    'cuotas': link.cuotas,
-                    'mensaje': 'Esperando que el cliente abra el link'
-                }
+    return dict(ERROR_TECNICO)
 
-            logger.warning(
-                f"verificar_estado_pago — error PayZen desconocido — "
-                f"order_id={link.order_id} errorCode={error_code} answer={answer}"
-            )
-            return {'status': 'Error de Api', 'pagado': False, 'anulado': False, 'cuotas': 1}
 
-        # --- SUCCESS: hay actividad de transacciones ---
-        if payzen_status == "SUCCESS":
-            answer = res_data.get("answer", {})
-            transactions = answer.get("transactions", [])
+async def verificar_estado_pago_async(link_id):
+    """verificar_estado_pago para vistas async: la consulta a PayZen no ocupa un hilo."""
+    logger.debug(f"verificar_estado_pago — link_id={link_id}")
 
-            if not transactions:
-                logger.debug(f"verificar_estado_pago — SUCCESS pero sin transacciones — order_id={link.order_id}")
-                return {'status': 'PENDING', 'pagado': False, 'anulado': False, 'cuotas': link.cuotas}
+    try:
+        link = await LinkPago.objects.aget(pk=link_id)
+        if not _requiere_consulta(link):
+            return _estado_desde_db(link)
 
-            tx = transactions[0]
-            status_payzen = tx.get("status")
-            detailed_status = tx.get("detailedStatus")
+        logger.debug(f"verificar_estado_pago — consultando PayZen — order_id={link.order_id}")
+        res_data = await payzen.consultar_orden_cacheada_async(link.order_id)
+        return await sync_to_async(_aplicar_consulta)(link, res_data)
 
-            logger.debug(
-                f"verificar_estado_pago — transacción encontrada — order_id={link.order_id} "
-                f"status={status_payzen} detailed={detailed_status}"
-            )
+    except payzen.CircuitoAbierto:
+        return _estado_degradado(link)
+    except Exception as e:
+        logger.exception(f"verificar_estado_pago — error técnico — link_id={link_id}: {e}")
 
-            link.status_detalle = detailed_status
+    return dict(ERROR_TECNICO)
 
-            # A) Pago exitoso
-            if status_payzen == "PAID" or detailed_status in ["AUTHORISED", "CAPTURED"]:
-                t_details = tx.get("transactionDetails", {})
-                card_details = t_details.get("cardDetails", {})
-                auth_response = card_details.get("authorizationResponse", {})
 
-                link.nro_transaccion = tx.get("uuid")
-                link.auth_code = (
-                    auth_response.get("authorizationNumber")
-                    or tx.get("uuid", "")[:8].upper()
-                )
-                link.lote_number = (
-                    t_details.get("sequenceNumber")
-                    or t_details.get("batchNumber")
-                    or "001"
-                )
-                cuotas_api = card_details.get("installmentNumber")
-                link.cuotas_elegidas = int(cuotas_api) if cuotas_api else 1
-                link.pagado = True
-                link.save()
-                logger.info(
-                    f"verificar_estado_pago — PAGO EXITOSO — order_id={link.order_id} "
-                    f"auth_code={link.auth_code} lote={link.lote_number} "
-                    f"cuotas={link.cuotas_elegidas} nro_tx={link.nro_transaccion}"
-                )
+MAX_LINKS_ESTADO = 50
+
 
-                # ── Email de liquidacion ──────────────────────────────────────
+def verificar_estados_pago(cliente_pk: Any, link_ids: List[Any]) -> Tuple[Dict[int, Dict[str, Any]], List[str]]:
+    """
+    Estado de varios links del cliente en una sola llamada. Los finalizados (pagados o
+    anulados) y los que no requieren consulta salen de la base; el resto se consulta a
+    PayZen en paralelo, hasta PAYZEN_CONCURRENCIA a la vez. Los ids ajenos se ignoran.
+    """
+    try:
+        ids = {int(i) for i in link_ids}
+    except (TypeError, ValueError):
+        return {}, ['Identificadores inválidos.']
+    if len(ids) > MAX_LINKS_ESTADO:
+        return {}, [f'Se pueden consultar hasta {MAX_LINKS_ESTADO} links por vez.']
+
+    estados = {}
+    pendientes = []
+    for link in LinkPago.objects.select_related('cliente').filter(cliente_id=cliente_pk, pk__in=ids):
+        if link.status_detalle in ESTADOS_ANULADOS or not _requiere_consulta(link):
+            estados[link.pk] = _estado_desde_db(link)
+        else:
+            pendientes.append(link)
+
+    if pendientes:
+        concurrencia = max(1, min(settings.PAYZEN_CONCURRENCIA, len(pendientes)))
+        with ThreadPoolExecutor(max_workers=concurrencia, thread_name_prefix='payzen') as pool:
+            futuros = [(link, pool.submit(payzen.consultar_orden_cacheada, link.order_id)) for link in pendientes]
+            # Las respuestas se aplican acá, en el hilo del request: los hilos solo hacen HTTP
+            for link, futuro in futuros:
                 try:
-                    if link.cliente.recibir_liquidacion_email and link.cliente.email:
-                        from utils.email_utils import mail
-                        from django.utils import timezone
-
-                        total_costos = link.desglose_arancel + link.desglose_comision + link.desglose_tasa + link.desglose_iva_21 + link.desglose_iva_105
-
-                        mail(
-                            asunto=f"Liquidacion de pago - Orden {link.order_id}",
-                            destinatarios=[link.cliente.email],
-                            template_html="emails/liquidacion.html",
-                            contexto={
-                                "cliente_nombre": link.cliente.nombre.title(),
-                                "monto_bruto":    f"{link.monto:,.2f}".replace(',', '.'),
-                                "monto_neto":     f"{link.receiver_amount:,.2f}".replace(',', '.'),
-                                "arancel":        f"{link.desglose_arancel:,.2f}".replace(',', '.'),
-                                "comision":       f"{link.desglose_comision:,.2f}".replace(',', '.'),
-                                "tasa":           f"{link.desglose_tasa:,.2f}".replace(',', '.'),
-                                "iva_21":         f"{link.desglose_iva_21:,.2f}".replace(',', '.'),
-                                "iva_105":        f"{link.desglose_iva_105:,.2f}".replace(',', '.'),
-                                "total_costos":   f"{total_costos:,.2f}".replace(',', '.'),
-                                "cuotas":         link.cuotas_elegidas,
-                                "tipo_tarjeta":   link.tipo_tarjeta,
-                                "order_id":       link.order_id,
-                                "auth_code":      link.auth_code or "",
-                                "descripcion":    link.descripcion or "",
-                                "fecha":          timezone.now().strftime("%d/%m/%Y %H:%M"),
-                            },
-                        )
-                        logger.info(f"verificar_estado_pago — email liquidacion enviado — order_id={link.order_id}")
+                    estados[link.pk] = _aplicar_consulta(link, futuro.result())
+                except payzen.CircuitoAbierto:
+                    estados[link.pk] = _estado_degradado(link)
                 except Exception as e:
-                    logger.error(f"verificar_estado_pago — error enviando email liquidacion — order_id={link.order_id}: {e}")
+                    logger.exception(f"verificar_estados_pago — error técnico — link_id={link.pk}: {e}")
+                    estados[link.pk] = dict(ERROR_TECNICO)
 
-                return {
-                    'status': detailed_status,
-                    'pagado': True,
-                    'anulado': False,
-                    'cuotas': link.cuotas_elegidas
-                }
+    logger.debug(
+        f"verificar_estados_pago — cliente={cliente_pk} pedidos={len(ids)} "
+        f"desde_db={len(estados) - len(pendientes)} consultados={len(pendientes)}"
+    )
+    return estados, []
 
-            # B) Pago rechazado / cancelado
-            if status_payzen == "UNPAID" or detailed_status in ["REFUSED", "CANCELLED", "ERROR", "EXPIRED"]:
-                link.pagado = False
-                link.save()
-                logger.warning(
-                    f"verificar_estado_pago — PAGO FALLIDO — order_id={link.order_id} "
-                    f"detailed_status={detailed_status}"
+async def verificar_estados_pago_async(cliente_pk: Any, link_ids: List[Any]) -> Tuple[Dict[int, Dict[str, Any]], List[str]]:
+    """
+    verificar_estados_pago para vistas async: todas las consultas pendientes a PayZen
+    salen a la vez (acotadas por PAYZEN_ASYNC_CONEXIONES) y se aplican una por una.
+    """
+    try:
+        ids = {int(i) for i in link_ids}
+    except (TypeError, ValueError):
+        return {}, ['Identificadores inválidos.']
+    if len(ids) > MAX_LINKS_ESTADO:
+        return {}, [f'Se pueden consultar hasta {MAX_LINKS_ESTADO} links por vez.']
+
+    estados = {}
+    pendientes = []
+    async for link in LinkPago.objects.select_related('cliente').filter(cliente_id=cliente_pk, pk__in=ids):
+        if link.status_detalle in ESTADOS_ANULADOS or not _requiere_consulta(link):
+            estados[link.pk] = _estado_desde_db(link)
+        else:
+            pendientes.append(link)
+
+    respuestas = await asyncio.gather(
+        *(payzen.consultar_orden_cacheada_async(link.order_id) for link in pendientes),
+        return_exceptions=True,
+    )
+    for link, respuesta in zip(pendientes, respuestas):
+        try:
+            if isinstance(respuesta, Exception):
+                raise respuesta
+            estados[link.pk] = await sync_to_async(_aplicar_consulta)(link, respuesta)
+        except payzen.CircuitoAbierto:
+            estados[link.pk] = _estado_degradado(link)
+        except Exception as e:
+            logger.exception(f"verificar_estados_pago — error técnico — link_id={link.pk}: {e}")
+            estados[link.pk] = dict(ERROR_TECNICO)
+
+    logger.debug(
+        f"verificar_estados_pago — cliente={cliente_pk} pedidos={len(ids)} "
+        f"desde_db={len(estados) - len(pendientes)} consultados={len(pendientes)}"
+    )
+    return estados, []
+
+
+def _requiere_consulta(link) -> bool:
+    # 1. Si ya está pagado en DB, no consultamos la API
+    if link.pagado:
+        logger.debug(f"verificar_estado_pago — ya pagado en DB, omitiendo API — link_id={link.pk} order_id={link.order_id}")
+        return False
+
+    # Con el comando conciliar_pagos corriendo, la base ya está al día
+    if settings.PAYZEN_CONCILIADOR_ACTIVO:
+        return False
+
+    # 2. Con IPN, PayZen avisa los cambios: la consulta queda como respaldo
+    if settings.PAYZEN_IPN_ACTIVO and not _consulta_vencida(link):
+        logger.debug(f"verificar_estado_pago — estado desde DB (IPN) — order_id={link.order_id} status={link.status_detalle}")
+        return False
+    return True
+
+
+def _aplicar_consulta(link, res_data) -> Dict[str, Any]:
+    """Aplica al link la respuesta de Order/Get."""
+    payzen_status = res_data.get("status")
+    logger.debug(f"verificar_estado_pago — respuesta PayZen status={payzen_status} order_id={link.order_id}")
+    link.estado_actualizado_en = timezone.now()
+    LinkPago.objects.filter(pk=link.pk).update(estado_actualizado_en=link.estado_actualizado_en)
+
+    # --- ERROR PSP_010: orden sin actividad aún ---
+    if payzen_status == "ERROR":
+        answer = res_data.get("answer", {})
+        error_code = answer.get("errorCode")
+
+        if error_code == "PSP_010":
+            # PayZen no retorna EXPIRED si el link nunca fue abierto.
+            # Lo determinamos localmente comparando la fecha de creación.
+            if _expira_localmente(link):
+                if link.status_detalle != 'EXPIRED':
+                    link.status_detalle = 'EXPIRED'
+                    link.save(update_fields=['status_detalle'])
+
+                logger.info(
+                    f"verificar_estado_pago — PSP_010 + tiempo excedido = EXPIRED local "
+                    f"— order_id={link.order_id} created_at={link.created_at}"
                 )
                 return {
-                    'status': detailed_status,
+                    'status': 'EXPIRED',
                     'pagado': False,
-                    'anulado': True,
-                    'cuotas': link.cuotas_elegidas
+                    'anulado': True,   # para que el JS lo trate como finalizado
+                    'cuotas': link.cuotas,
                 }
 
-            # C) Estado intermedio (en proceso)
+            # Si no expiró, sigue esperando normalmente
             logger.debug(
-                f"verificar_estado_pago — estado intermedio — order_id={link.order_id} "
-                f"detailed_status={detailed_status}"
+                f"verificar_estado_pago — PSP_010: link aún no abierto — "
+                f"order_id={link.order_id}"
             )
             return {
-                'status': detailed_status,
+                'status': 'Esperando Pago...',
                 'pagado': False,
                 'anulado': False,
-                'cuotas': link.cuotas_elegidas
+                'cuotas': link.cuotas,
+                'mensaje': 'Esperando que el cliente abra el link'
             }
 
+        logger.warning(
+            f"verificar_estado_pago — error PayZen desconocido — "
+            f"order_id={link.order_id} errorCode={error_code} answer={answer}"
+        )
+        return {'status': 'Error de Api', 'pagado': False, 'anulado': False, 'cuotas': 1}
+
+    # --- SUCCESS: hay actividad de transacciones ---
+    if payzen_status == "SUCCESS":
+        return _aplicar_respuesta_payzen(link, res_data.get("answer", {}), origen='verificar_estado_pago')
+
+    return dict(ERROR_TECNICO)
+
+
+def _aplicar_respuesta_payzen(link, answer, origen):
+    """
+    Aplica al link la primera transacción de una respuesta de PayZen: el `answer`
+    de Order/Get o el kr-answer (V4/Payment) de una IPN, que tienen la misma forma.
+    Es idempotente: repetir la misma respuesta no vuelve a guardar ni a enviar el email.
+    """
+    transactions = answer.get("transactions", [])
+
+    if not transactions:
+        logger.debug(f"{origen} — SUCCESS pero sin transacciones — order_id={link.order_id}")
+        return {'status': 'PENDING', 'pagado': False, 'anulado': False, 'cuotas': link.cuotas}
+
+    tx = transactions[0]
+    status_payzen = tx.get("status")
+    detailed_status = tx.get("detailedStatus")
+
+    logger.debug(
+        f"{origen} — transacción encontrada — order_id={link.order_id} "
+        f"status={status_payzen} detailed={detailed_status}"
+    )
+
+    if link.pagado:
+        logger.debug(f"{origen} — link ya pagado, sin cambios — order_id={link.order_id}")
+        return _estado_desde_db(link)
+
+    # Fila bloqueada durante la transición: dos consultas concurrentes (o una consulta
+    # y una IPN) no pueden marcar el pago dos veces ni pisar un pago con un estado viejo
+    with transaction.atomic():
+        if LinkPago.objects.select_for_update().values_list('pagado', flat=True).get(pk=link.pk):
+            link.refresh_from_db()
+            logger.debug(f"{origen} — pagado por otra consulta, sin cambios — order_id={link.order_id}")
+            return _estado_desde_db(link)
+        return _aplicar_transaccion(link, tx, status_payzen, detailed_status, origen)
+
+
+def _aplicar_transaccion(link, tx, status_payzen, detailed_status, origen):
+    link.status_detalle = detailed_status
+
+    # A) Pago exitoso
+    if status_payzen == "PAID" or detailed_status in ["AUTHORISED", "CAPTURED"]:
+        t_details = tx.get("transactionDetails", {})
+        card_details = t_details.get("cardDetails", {})
+        auth_response = card_details.get("authorizationResponse", {})
+
+        link.nro_transaccion = tx.get("uuid")
+        link.auth_code = (
+            auth_response.get("authorizationNumber")
+            or tx.get("uuid", "")[:8].upper()
+        )
+        link.lote_number = (
+            t_details.get("sequenceNumber")
+            or t_details.get("batchNumber")
+            or "001"
+        )
+        cuotas_api = card_details.get("installmentNumber")
+        link.cuotas_elegidas = int(cuotas_api) if cuotas_api else 1
+        link.pagado = True
+        link.save()
+        logger.info(
+            f"{origen} — PAGO EXITOSO — order_id={link.order_id} "
+            f"auth_code={link.auth_code} lote={link.lote_number} "
+            f"cuotas={link.cuotas_elegidas} nro_tx={link.nro_transaccion}"
+        )
+
+        transaction.on_commit(lambda: _despues_del_pago(link))
+
+        return {
+            'status': detailed_status,
+            'pagado': True,
+            'anulado': False,
+            'cuotas': link.cuotas_elegidas
+        }
+
+    # B) Pago rechazado / cancelado
+    if status_payzen == "UNPAID" or detailed_status in ESTADOS_ANULADOS:
+        link.pagado = False
+        link.save()
+        logger.warning(
+            f"{origen} — PAGO FALLIDO — order_id={link.order_id} "
+            f"detailed_status={detailed_status}"
+        )
+        return {
+            'status': detailed_status,
+            'pagado': False,
+            'anulado': True,
+            'cuotas': link.cuotas_elegidas
+        }
+
+    # C) Estado intermedio (en proceso)
+    link.save(update_fields=['status_detalle'])
+    logger.debug(
+        f"{origen} — estado intermedio — order_id={link.order_id} "
+        f"detailed_status={detailed_status}"
+    )
+    return {
+        'status': detailed_status,
+        'pagado': False,
+        'anulado': False,
+        'cuotas': link.cuotas_elegidas
+    }
+
+
+def _despues_del_pago(link):
+    """
+    Al confirmarse la transacción de un pago. El email de liquidación sale acá, en el
+    request y sin adjunto: un hilo de fondo se pierde si el proceso se recicla. Solo
+    el render del ticket va a segundo plano, para que el comercio lo encuentre en el
+    almacén al descargarlo.
+    """
+    pdfs.encolar(_prerenderizar_ticket, link.pk)
+    _enviar_email_liquidacion(link)
+
+
+def _prerenderizar_ticket(link_id):
+    """Trabajo de fondo (best effort): deja el ticket de un pago en el almacén de PDFs."""
+    link = LinkPago.objects.select_related('cliente', 'tarifa').get(pk=link_id)
+    pdf_ticket(link)
+    logger.debug(f"verificar_estado_pago — ticket pre-renderizado — order_id={link.order_id}")
+
+
+def _enviar_email_liquidacion(link):
+    """Email de liquidación del pago, sin adjunto: el ticket se descarga desde el panel."""
+    try:
+        if link.cliente.recibir_liquidacion_email and link.cliente.email:
+            from utils.email_utils import mail
+
+            total_costos = link.desglose_arancel + link.desglose_comision + link.desglose_tasa + link.desglose_iva_21 + link.desglose_iva_105
+
+            asunto = f"Liquidacion de pago - Orden {link.order_id}"
+            contexto = {
+                "cliente_nombre": link.cliente.nombre.title(),
+                "monto_bruto":    f"{link.monto:,.2f}".replace(',', '.'),
+                "monto_neto":     f"{link.receiver_amount:,.2f}".replace(',', '.'),
+                "arancel":        f"{link.desglose_arancel:,.2f}".replace(',', '.'),
+                "comision":       f"{link.desglose_comision:,.2f}".replace(',', '.'),
+                "tasa":           f"{link.desglose_tasa:,.2f}".replace(',', '.'),
+                "iva_21":         f"{link.desglose_iva_21:,.2f}".replace(',', '.'),
+                "iva_105":        f"{link.desglose_iva_105:,.2f}".replace(',', '.'),
+                "total_costos":   f"{total_costos:,.2f}".replace(',', '.'),
+                "cuotas":         link.cuotas_elegidas,
+                "tipo_tarjeta":   link.tipo_tarjeta,
+                "order_id":       link.order_id,
+                "auth_code":      link.auth_code or "",
+                "descripcion":    link.descripcion or "",
+                "fecha":          timezone.now().strftime("%d/%m/%Y %H:%M"),
+            }
+            mail(asunto=asunto, destinatarios=[link.cliente.email],
+                 template_html="emails/liquidacion.html", contexto=contexto)
+            logger.info(f"verificar_estado_pago — email liquidacion enviado — order_id={link.order_id}")
     except Exception as e:
-        logger.exception(f"verificar_estado_pago — error técnico — link_id={link_id}: {e}")
+        logger.error(f"verificar_estado_pago — error enviando email liquidacion — order_id={link.order_id}: {e}")
+
 
-    return {'status': 'Error Tecnico', 'pagado': False, 'anulado': False, 'cuotas': 1}
\ No newline at end of file
+def procesar_ipn(kr_answer: str) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+    """
+    Notificación instantánea (IPN) de PayZen, con la firma ya validada.
+    Actualiza el LinkPago de la orden con la misma lógica que verificar_estado_pago;
+    las IPN repetidas (PayZen reintenta hasta recibir 200) no tienen efecto.
+    """
+    try:
+        answer = json.loads(kr_answer)
+        order_id = answer["orderDetails"]["orderId"]
+    except (ValueError, KeyError, TypeError):
+        logger.warning(f"procesar_ipn — kr-answer inválido: {kr_answer[:200]}")
+        return None, ['kr-answer inválido.']
+
+    link = LinkPago.objects.select_related('cliente').filter(order_id=order_id).first()
+    if link is None:
+        logger.warning(f"procesar_ipn — orden desconocida — order_id={order_id}")
+        return None, ['Orden desconocida.']
+
+    logger.info(f"procesar_ipn — IPN recibida — order_id={order_id} orderStatus={answer.get('orderStatus')}")
+    payzen.olvidar_orden(order_id)
+    link.estado_actualizado_en = timezone.now()
+    LinkPago.objects.filter(pk=link.pk).update(estado_actualizado_en=link.estado_actualizado_en)
+    return _aplicar_respuesta_payzen(link, answer, origen='procesar_ipn'), []
+
+
+# ==============================================================================
+# CONCILIACIÓN DE LINKS PENDIENTES
+# ==============================================================================
+
+def intervalo_conciliacion(edad: timedelta) -> timedelta:
+    """
+    Cada cuánto se vuelve a consultar un link pendiente según su antigüedad:
+    PAYZEN_CONCILIACION_BASE segundos al principio, el doble cada vez que la edad
+    se duplica, con tope en PAYZEN_CONCILIACION_MAX.
+    """
+    base = settings.PAYZEN_CONCILIACION_BASE
+    segundos = edad.total_seconds()
+    duplicaciones = int(math.log2(segundos / base)) if segundos > base else 0
+    return timedelta(seconds=min(settings.PAYZEN_CONCILIACION_MAX, base * 2 ** duplicaciones))
+
+
+def links_a_conciliar(ahora, limite: int) -> List[LinkPago]:
+    """
+    Links sin pagar ni anular cuya próxima consulta ya venció, los más atrasados primero.
+    Los EXPIRED se siguen mirando hasta PAYZEN_HORAS_GRACIA_EXPIRADOS horas después de
+    su vencimiento, por si PayZen aceptó un pago sobre la hora.
+    """
+    gracia = ahora - timedelta(hours=settings.PAYZEN_HORAS_GRACIA_EXPIRADOS)
+    pendientes = (
+        LinkPago.objects
+        .select_related('cliente')
+        .filter(pagado=False, order_id__isnull=False)
+        .filter(~Q(status_detalle__in=ESTADOS_ANULADOS) | Q(status_detalle='EXPIRED', expires_at__gte=gracia))
+        .order_by(F('estado_actualizado_en').asc(nulls_first=True), 'created_at')
+    )
+    vencidos = []
+    for link in pendientes.iterator(chunk_size=500):
+        ultima = link.estado_actualizado_en
+        if ultima is None or ahora - ultima >= intervalo_conciliacion(ahora - link.created_at):
+            vencidos.append(link)
+            if len(vencidos) >= limite:
+                break
+    return vencidos
+
+
+def conciliar_pagos_pendientes(limite: int = 100, por_segundo: float = 5.0) -> Dict[str, int]:
+    """
+    Una pasada de conciliación: consulta Order/Get para los links cuya próxima consulta
+    ya venció, a lo sumo `por_segundo` consultas por segundo, y aplica el resultado como
+    verificar_estado_pago. Los PSP_010 con el link vencido se expiran juntos en un UPDATE.
+    """
+    ahora = timezone.now()
+    return _conciliar(links_a_conciliar(ahora, limite), ahora, por_segundo, origen='conciliar_pagos')
+
+
+def _conciliar(links, ahora, por_segundo: float, origen: str) -> Dict[str, int]:
+    resumen = {'consultados': 0, 'pagados': 0, 'anulados': 0, 'en_curso': 0,
+               'sin_abrir': 0, 'expirados': 0, 'errores': 0}
+    sin_abrir, a_expirar = [], []
+    espacio = 1 / por_segundo if por_segundo > 0 else 0
+    proxima = time.monotonic()
+
+    for link in links:
+        espera = proxima - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        proxima = time.monotonic() + espacio
+
+        try:
+            res_data = payzen.consultar_orden(link.order_id)
+        except payzen.CircuitoAbierto:
+            logger.warning(f"{origen} — PayZen degradado, se corta la pasada — pendientes={len(links) - resumen['consultados'] - resumen['errores']}")
+            break
+        except Exception as e:
+            logger.warning(f"{origen} — error consultando PayZen — order_id={link.order_id}: {e}")
+            resumen['errores'] += 1
+            continue
+        resumen['consultados'] += 1
+
+        if res_data.get("status") == "ERROR" and res_data.get("answer", {}).get("errorCode") == "PSP_010":
+            vence = link.status_detalle != 'EXPIRED' and _expira_localmente(link, ahora)
+            (a_expirar if vence else sin_abrir).append(link.pk)
+            continue
+
+        resultado = _aplicar_consulta(link, res_data)
+        clave = 'pagados' if resultado['pagado'] else 'anulados' if resultado['anulado'] else 'en_curso'
+        resumen[clave] += 1
+
+    if sin_abrir:
+        LinkPago.objects.filter(pk__in=sin_abrir).update(estado_actualizado_en=ahora)
+        resumen['sin_abrir'] = len(sin_abrir)
+    resumen['expirados'] = _marcar_expirados(a_expirar, ahora)
+
+    logger.info(
+        f"{origen} — " + " ".join(f"{clave}={valor}" for clave, valor in resumen.items())
+    )
+    return resumen
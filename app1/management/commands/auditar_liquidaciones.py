@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app1 import crud
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula los pagos de un mes con la tarifa congelada de cada link y lista los "
+        "que no coinciden con los importes guardados, más los totales recalculados."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('periodo', help="Mes a auditar, AAAA-MM")
+        parser.add_argument('--cliente', type=int, default=None, help="Solo los pagos de este comercio")
+
+    def handle(self, *args, **options):
+        reporte, errores = crud.auditar_liquidaciones(options['periodo'], options['cliente'])
+        if errores:
+            raise CommandError(" ".join(errores))
+
+        for diferencia in reporte['diferencias']:
+            self.stdout.write(
+                f"link={diferencia['link_id']} order_id={diferencia['order_id']} {diferencia['campo']}: "
+                f"guardado {diferencia['guardado']}, recalculado {diferencia['recalculado']}"
+            )
+        self.stdout.write(" ".join(
+            f"{clave}={reporte[clave]}" for clave in ('periodo', 'revisados', 'con_diferencias', 'sin_tarifa')
+        ))
+        self.stdout.write(" ".join(f"{campo}={total}" for campo, total in reporte['totales'].items()))
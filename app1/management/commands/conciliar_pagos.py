@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app1 import crud
+
+
+class Command(BaseCommand):
+    help = (
+        "Concilia con PayZen los links sin pagar ni anular (y los EXPIRED dentro de "
+        "PAYZEN_HORAS_GRACIA_EXPIRADOS): consulta Order/Get con límite de tasa y un intervalo "
+        "que crece con la antigüedad del link, y expira en bloque los vencidos que PayZen da "
+        "sin actividad."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=200, help="Máximo de links por pasada")
+        parser.add_argument('--por-segundo', type=float, default=settings.PAYZEN_CONCILIACION_POR_SEGUNDO,
+                            help="Máximo de consultas a PayZen por segundo")
+        parser.add_argument('--continuo', action='store_true', help="Repetir indefinidamente")
+        parser.add_argument('--pausa', type=int, default=30, help="Segundos entre pasadas con --continuo")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            resumen = crud.conciliar_pagos_pendientes(options['limite'], options['por_segundo'])
+            self.stdout.write(" ".join(f"{clave}={valor}" for clave, valor in resumen.items()))
+            if not options['continuo']:
+                return
+            try:
+                time.sleep(options['pausa'])
+            except KeyboardInterrupt:
+                return
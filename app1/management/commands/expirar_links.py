@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app1 import crud
+
+
+class Command(BaseCommand):
+    help = (
+        "Confirma con PayZen (Order/Get) los links sin pagar que siguen en INITIAL y cuyo "
+        "expires_at ya pasó, y marca EXPIRED con un solo UPDATE los que no tuvieron actividad."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limite', type=int, default=200, help="Máximo de links por barrido")
+        parser.add_argument('--por-segundo', type=float, default=settings.PAYZEN_CONCILIACION_POR_SEGUNDO,
+                            help="Máximo de consultas a PayZen por segundo")
+        parser.add_argument('--continuo', action='store_true', help="Repetir indefinidamente")
+        parser.add_argument('--pausa', type=int, default=60, help="Segundos entre barridos con --continuo")
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            resumen = crud.expirar_vencidos(options['limite'], options['por_segundo'])
+            self.stdout.write(" ".join(f"{clave}={valor}" for clave, valor in resumen.items()))
+            if not options['continuo']:
+                return
+            try:
+                time.sleep(options['pausa'])
+            except KeyboardInterrupt:
+                return
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from app1 import pdfs
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra del almacén de PDFs (PDF_CACHE_DIR) las versiones anteriores de cada ticket o "
+        "resumen que no se usan hace más de --horas. Siempre conserva la versión usada más recientemente."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=float, default=24,
+                            help="Antigüedad mínima (desde el último uso) de una versión para borrarla")
+
+    def handle(self, *args, **options):
+        borrados = pdfs.limpiar(options['horas'] * 3600)
+        self.stdout.write(f"borrados={borrados}")
@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app1 import carga
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de punta a punta contra un servidor del portal (idealmente con "
+        "simular_payzen): crea links, consulta estados y pide tickets a una tasa fija e "
+        "imprime p50/p95/p99 y throughput por operación en JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000')
+        parser.add_argument('--email', required=True, help="Comercio aprobado con el que iniciar sesión")
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--rps', type=float, default=10.0, help="Requests por segundo a sostener")
+        parser.add_argument('--duracion', type=float, default=30.0, help="Segundos de carga")
+        parser.add_argument('--concurrencia', type=int, default=50, help="Requests en curso como máximo")
+        parser.add_argument('--mezcla', default='crear=1,estado=8,ticket=1', help="Pesos por operación")
+        parser.add_argument('--async', dest='modo_async', action='store_true',
+                            help="Usar las vistas async (PAYZEN_ASYNC) para crear y consultar")
+        parser.add_argument('--semilla', type=int)
+        parser.add_argument('--salida', help="Archivo donde guardar el JSON de resultados")
+
+    def handle(self, *args, **options):
+        try:
+            mezcla = carga.parsear_mezcla(options['mezcla'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['rps'] <= 0 or options['duracion'] <= 0:
+            raise CommandError("--rps y --duracion deben ser mayores que cero.")
+
+        prueba = carga.PruebaCarga(
+            options['url'], options['email'], options['password'], mezcla,
+            modo_async=options['modo_async'], semilla=options['semilla'],
+        )
+        try:
+            resultado = prueba.correr(options['rps'], options['duracion'], options['concurrencia'])
+        except RuntimeError as e:
+            raise CommandError(str(e))
+
+        salida = json.dumps(resultado, ensure_ascii=False, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(salida + '\n')
+        else:
+            self.stdout.write(salida)
@@ -0,0 +1,28 @@
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from app1 import payzen
+
+
+class Command(BaseCommand):
+    help = (
+        "Envía a la URL de IPN una notificación grabada de PayZen (app1/payzen_ipn/<nombre>.json) "
+        "para una orden, firmada con PAYZEN_REST_PASS como lo haría PayZen."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_id')
+        parser.add_argument('nombre', nargs='?', default='pagado',
+                            help="IPN grabada: pagado, rechazado, expirado, en_proceso")
+        parser.add_argument('--url', default='http://127.0.0.1:8000/payzen/ipn/')
+
+    def handle(self, *args, **options):
+        try:
+            answer = payzen.ipn_grabada(options['nombre'], options['order_id'])
+        except FileNotFoundError:
+            raise CommandError(f"No existe la IPN grabada '{options['nombre']}' en {payzen.RUTA_IPN_GRABADAS}")
+
+        response = requests.post(options['url'], data=payzen.armar_ipn(answer), timeout=10)
+        self.stdout.write(f"{response.status_code} {response.text}")
+        if response.status_code != 200:
+            raise CommandError("La IPN no fue aceptada.")
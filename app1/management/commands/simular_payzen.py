@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app1 import simulador_payzen
+
+
+class Command(BaseCommand):
+    help = (
+        "Levanta un simulador local de PayZen (CreatePaymentOrder y Order/Get) con latencia, "
+        "errores HTTP y desenlaces configurables. Apuntar PAYZEN_URL y PAYZEN_CHECK_URL a las "
+        "URLs que imprime al arrancar."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--puerto', type=int, default=8765)
+        parser.add_argument('--latencia', type=float, default=0.2, help="Segundos de demora por respuesta")
+        parser.add_argument('--jitter', type=float, default=0.1, help="Demora adicional al azar, en segundos")
+        parser.add_argument('--error-http', type=float, default=0.0,
+                            help="Probabilidad de responder 503 (0.05 = 5%%)")
+        parser.add_argument('--rechazo-creacion', type=float, default=0.0,
+                            help="Probabilidad de rechazar CreatePaymentOrder")
+        parser.add_argument('--desenlaces', default='',
+                            help="Pesos por desenlace, ej: pagado=6,rechazado=1,expirado=1,en_proceso=1,psp_010=1")
+        parser.add_argument('--apertura', type=float, default=0.0,
+                            help="Segundos durante los que una orden nueva responde PSP_010")
+        parser.add_argument('--semilla', type=int)
+
+    def handle(self, *args, **options):
+        try:
+            pesos = simulador_payzen.parsear_pesos(options['desenlaces']) if options['desenlaces'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        simulador = simulador_payzen.SimuladorPayZen(
+            latencia=options['latencia'], jitter=options['jitter'], error_http=options['error_http'],
+            rechazo_creacion=options['rechazo_creacion'], pesos=pesos,
+            apertura=options['apertura'], semilla=options['semilla'],
+        )
+        servidor = simulador_payzen.crear_servidor(simulador, options['host'], options['puerto'])
+        for clave, valor in simulador_payzen.urls(options['host'], servidor.server_port).items():
+            self.stdout.write(f"{clave}={valor}")
+        self.stdout.write(f"desenlaces={simulador.pesos}")
+
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
+            self.stdout.write(" ".join(f"{clave}={valor}" for clave, valor in simulador.contadores.items()))
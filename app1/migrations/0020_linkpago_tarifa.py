@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app1', '0019_alter_cliente_fecha_registro'),
+        ('app2', '0014_tarifacongelada'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkpago',
+            name='tarifa',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='links', to='app2.tarifacongelada'),
+        ),
+    ]
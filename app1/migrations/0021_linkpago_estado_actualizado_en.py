@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app1', '0020_linkpago_tarifa'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkpago',
+            name='estado_actualizado_en',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
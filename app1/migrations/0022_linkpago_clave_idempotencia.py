@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app1', '0021_linkpago_estado_actualizado_en'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkpago',
+            name='clave_idempotencia',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:22
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def poblar_vencimientos(apps, schema_editor):
+    LinkPago = apps.get_model('app1', 'LinkPago')
+
+    # Un UPDATE por tipo de tarjeta con vigencia propia y otro para el resto
+    pendientes = LinkPago.objects.filter(expires_at__isnull=True)
+    for tipo, horas in settings.PAYZEN_HORAS_EXPIRACION_POR_TARJETA.items():
+        pendientes.filter(tipo_tarjeta=tipo).update(expires_at=F('created_at') + timedelta(hours=horas))
+    pendientes.update(expires_at=F('created_at') + timedelta(hours=settings.PAYZEN_HORAS_EXPIRACION))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app1', '0022_linkpago_clave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='linkpago',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(poblar_vencimientos, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:44
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def liberar_claves_repetidas(apps, schema_editor):
+    LinkPago = apps.get_model('app1', 'LinkPago')
+
+    # Antes de la restricción, una clave podía repetirse fuera de la ventana de reenvío:
+    # se conserva en el link más nuevo de cada (cliente, clave)
+    repetidas = (
+        LinkPago.objects.filter(clave_idempotencia__isnull=False)
+        .values('cliente_id', 'clave_idempotencia')
+        .annotate(total=Count('id'))
+        .filter(total__gt=1)
+    )
+    for fila in repetidas:
+        links = LinkPago.objects.filter(cliente_id=fila['cliente_id'], clave_idempotencia=fila['clave_idempotencia'])
+        ultimo = links.order_by('-pk').values_list('pk', flat=True).first()
+        links.exclude(pk=ultimo).update(clave_idempotencia=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app1', '0023_linkpago_expires_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(liberar_claves_repetidas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='linkpago',
+            constraint=models.UniqueConstraint(condition=models.Q(('clave_idempotencia__isnull', False)), fields=('cliente', 'clave_idempotencia'), name='linkpago_clave_idempotencia_unica'),
+        ),
+    ]
@@ -42,6 +42,9 @@ class LinkPago(models.Model):
     auth_code = models.CharField(max_length=50, blank=True, null=True) # Número de Autorización
     lote_number = models.CharField(max_length=50, blank=True, null=True) # Cierre de Lote
     nro_transaccion = models.CharField(max_length=50, blank=True, null=True) # ID de Transacción PayZen
+    estado_actualizado_en = models.DateTimeField(null=True, blank=True)  # Última IPN o consulta a PayZen
+    clave_idempotencia = models.CharField(max_length=64, null=True, blank=True, db_index=True)  # Clave del envío que lo creó
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)  # Vencimiento del link (también enviado a PayZen)
     
     # comisión y montos calculados
     commission_percent = models.DecimalField(max_digits=5, decimal_places=2, default=Decimal('0.00'))
@@ -62,6 +65,24 @@ class LinkPago(models.Model):
     desglose_iva_105    = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     desglose_cuota_valor = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
+    # Tasas con las que se cotizó (null en links anteriores a las tarifas congeladas)
+    tarifa = models.ForeignKey(
+        'app2.TarifaCongelada',
+        on_delete=models.PROTECT,
+        null=True, blank=True,
+        related_name='links',
+    )
+
+    class Meta:
+        constraints = [
+            # Respaldo en la base de la idempotencia de create_link: una clave, un link por cliente
+            models.UniqueConstraint(
+                fields=['cliente', 'clave_idempotencia'],
+                condition=models.Q(clave_idempotencia__isnull=False),
+                name='linkpago_clave_idempotencia_unica',
+            ),
+        ]
+
     def generate_invoice_text(self):
         """Genera un texto simple de factura/ticket y lo guarda en invoice_text (no reemplaza un PDF)."""
         lines = []
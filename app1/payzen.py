@@ -0,0 +1,503 @@
+"""
+Cliente HTTP de PayZen.
+
+Todas las llamadas del proceso comparten una requests.Session con un pool de
+conexiones keep-alive, así cada consulta de estado reutiliza la conexión TLS
+en vez de abrir una nueva. Los timeouts de conexión y lectura salen de
+settings y siempre se aplican: ninguna llamada puede quedar colgada.
+
+Solo Order/Get se reintenta (es una consulta); CreatePaymentOrder no, porque
+un reintento después de un timeout de lectura podría crear la orden dos veces.
+
+Bajo ASGI las vistas async usan las variantes *_async, sobre un httpx.AsyncClient
+por event loop: una llamada lenta a PayZen no ocupa un hilo, así unos pocos
+procesos sostienen cientos de consultas en curso. Ambas variantes propagan las
+mismas excepciones de requests (Timeout, ConnectionError).
+
+Todas las llamadas pasan por un circuit breaker por proceso: si en la ventana
+reciente fallan (o tardan más que PAYZEN_CIRCUITO_LATENCIA) demasiadas, el
+circuito se abre y las llamadas siguientes se rechazan al instante con
+CircuitoAbierto durante PAYZEN_CIRCUITO_PAUSA segundos; después una sola
+llamada de prueba decide si se vuelve a cerrar.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('app1')
+
+# Respuestas HTTP ante las que vale la pena reintentar una consulta
+ESTADOS_REINTENTABLES = {429, 500, 502, 503, 504}
+
+_sesion: Optional[requests.Session] = None
+_lock = threading.Lock()
+_auth: Optional[tuple] = None  # ((shop_id, password), header)
+
+
+def auth_header() -> Dict[str, str]:
+    """Header Basic de PayZen. Se arma una vez y se rehace solo si cambian las credenciales."""
+    global _auth
+    credenciales = (settings.PAYZEN_SHOP_ID, settings.PAYZEN_REST_PASS)
+    actual = _auth
+    if actual is None or actual[0] != credenciales:
+        encoded_auth = base64.b64encode(f"{credenciales[0]}:{credenciales[1]}".encode()).decode()
+        actual = (credenciales, {
+            "Authorization": f"Basic {encoded_auth}",
+            "Content-Type": "application/json"
+        })
+        _auth = actual
+    return dict(actual[1])
+
+
+# ── Circuit breaker ───────────────────────────────────────────────────────────
+
+class CircuitoAbierto(requests.exceptions.RequestException):
+    """PayZen degradado: la llamada se rechazó sin salir a la red."""
+
+
+class Circuito:
+    CERRADO, ABIERTO, SEMIABIERTO = 'cerrado', 'abierto', 'semiabierto'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self._lock:
+            self.estado = self.CERRADO
+            self._muestras = deque()  # (instante, ok, lenta)
+            self._abierto_hasta = 0.0
+            self._sonda_desde = None
+            self.aperturas = 0
+            self.rechazadas = 0
+
+    def _podar(self, ahora: float):
+        limite = ahora - settings.PAYZEN_CIRCUITO_VENTANA
+        while self._muestras and self._muestras[0][0] < limite:
+            self._muestras.popleft()
+
+    def _abrir(self, ahora: float, motivo: str):
+        self.estado = self.ABIERTO
+        self._abierto_hasta = ahora + settings.PAYZEN_CIRCUITO_PAUSA
+        self._sonda_desde = None
+        self._muestras.clear()
+        self.aperturas += 1
+        logger.error(f"payzen — circuito ABIERTO por {settings.PAYZEN_CIRCUITO_PAUSA}s — {motivo}")
+
+    def permitir(self) -> bool:
+        """True si la llamada puede salir; en semiabierto deja pasar una sola sonda."""
+        if not settings.PAYZEN_CIRCUITO_ACTIVO:
+            return True
+        ahora = time.monotonic()
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return True
+            if self.estado == self.ABIERTO and ahora >= self._abierto_hasta:
+                self.estado = self.SEMIABIERTO
+                logger.warning("payzen — circuito SEMIABIERTO, enviando sonda")
+            # Una sonda que nunca volvió (ej: excepción inesperada) no bloquea para siempre
+            if self.estado == self.SEMIABIERTO and (
+                    self._sonda_desde is None or ahora - self._sonda_desde > _espera_maxima()):
+                self._sonda_desde = ahora
+                return True
+            self.rechazadas += 1
+            return False
+
+    def registrar(self, ok: bool, duracion: float):
+        if not settings.PAYZEN_CIRCUITO_ACTIVO:
+            return
+        ahora = time.monotonic()
+        lenta = duracion > settings.PAYZEN_CIRCUITO_LATENCIA
+        with self._lock:
+            if self.estado == self.SEMIABIERTO:
+                if ok and not lenta:
+                    self.estado = self.CERRADO
+                    self._sonda_desde = None
+                    logger.warning("payzen — circuito CERRADO, sonda OK")
+                else:
+                    self._abrir(ahora, f"sonda fallida ok={ok} duracion={duracion:.2f}s")
+                return
+            if self.estado != self.CERRADO:
+                return
+
+            self._muestras.append((ahora, ok, lenta))
+            self._podar(ahora)
+            total = len(self._muestras)
+            if total < settings.PAYZEN_CIRCUITO_MIN_LLAMADAS:
+                return
+            fallas = sum(1 for _, ok_m, _ in self._muestras if not ok_m)
+            lentas = sum(1 for _, _, lenta_m in self._muestras if lenta_m)
+            if fallas / total >= settings.PAYZEN_CIRCUITO_TASA_ERROR:
+                self._abrir(ahora, f"fallas={fallas}/{total}")
+            elif lentas / total >= settings.PAYZEN_CIRCUITO_TASA_LENTAS:
+                self._abrir(ahora, f"lentas={lentas}/{total} (>{settings.PAYZEN_CIRCUITO_LATENCIA}s)")
+
+    def disponible(self) -> bool:
+        """Sin efectos: False mientras el circuito está abierto y no toca sonda."""
+        return (not settings.PAYZEN_CIRCUITO_ACTIVO or self.estado == self.CERRADO
+                or time.monotonic() >= self._abierto_hasta)
+
+    def metricas(self) -> Dict[str, Any]:
+        ahora = time.monotonic()
+        with self._lock:
+            self._podar(ahora)
+            total = len(self._muestras)
+            fallas = sum(1 for _, ok, _ in self._muestras if not ok)
+            lentas = sum(1 for _, _, lenta in self._muestras if lenta)
+            return {
+                'estado':           self.estado,
+                'llamadas_ventana': total,
+                'fallas_ventana':   fallas,
+                'lentas_ventana':   lentas,
+                'tasa_error':       round(fallas / total, 4) if total else 0.0,
+                'reabre_en_s':      round(max(0.0, self._abierto_hasta - ahora), 1) if self.estado == self.ABIERTO else 0.0,
+                'aperturas_total':  self.aperturas,
+                'rechazadas_total': self.rechazadas,
+            }
+
+
+circuito = Circuito()
+
+
+def _ok_http(response) -> bool:
+    return response.status_code not in ESTADOS_REINTENTABLES
+
+
+def _con_circuito(enviar):
+    if not circuito.permitir():
+        raise CircuitoAbierto("Pasarela PayZen degradada (circuito abierto).")
+    inicio = time.monotonic()
+    try:
+        response = enviar()
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        circuito.registrar(False, time.monotonic() - inicio)
+        raise
+    circuito.registrar(_ok_http(response), time.monotonic() - inicio)
+    return response
+
+
+def get_sesion() -> requests.Session:
+    global _sesion
+    if _sesion is None:
+        with _lock:
+            if _sesion is None:
+                sesion = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=2,  # api.payzen.lat y, a lo sumo, un host alternativo
+                    pool_maxsize=settings.PAYZEN_POOL_SIZE,
+                    pool_block=False,
+                    max_retries=0,
+                )
+                sesion.mount('https://', adapter)
+                sesion.mount('http://', adapter)
+                _sesion = sesion
+                logger.debug(f"payzen — sesión creada pool_maxsize={settings.PAYZEN_POOL_SIZE}")
+    return _sesion
+
+
+def cerrar_sesion():
+    """Cierra el pool (ej: al cambiar settings en tests); la próxima llamada crea otro."""
+    global _sesion
+    with _lock:
+        sesion, _sesion = _sesion, None
+    if sesion is not None:
+        sesion.close()
+
+
+def _timeout():
+    return (settings.PAYZEN_CONNECT_TIMEOUT, settings.PAYZEN_READ_TIMEOUT)
+
+
+def crear_orden(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """CreatePaymentOrder. Sin reintentos; propaga las excepciones de requests."""
+    response = _con_circuito(lambda: get_sesion().post(
+        settings.PAYZEN_URL, json=payload, headers=auth_header(), timeout=_timeout()
+    ))
+    return response.json()
+
+
+def consultar_orden(order_id: str) -> Dict[str, Any]:
+    """
+    Order/Get con reintentos ante errores de conexión, timeouts y 429/5xx.
+    La espera entre intentos crece exponencialmente con jitter, para no
+    sincronizar a todos los workers contra PayZen después de un corte.
+    """
+    reintentos = settings.PAYZEN_REINTENTOS
+    for intento in range(reintentos + 1):
+        try:
+            response = _con_circuito(lambda: get_sesion().post(
+                settings.PAYZEN_CHECK_URL, json={"orderId": order_id},
+                headers=auth_header(), timeout=_timeout(),
+            ))
+            if response.status_code not in ESTADOS_REINTENTABLES or intento == reintentos:
+                return response.json()
+            motivo = f"HTTP {response.status_code}"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if intento == reintentos:
+                raise
+            motivo = type(e).__name__
+
+        time.sleep(_espera_reintento(order_id, intento, motivo))
+
+
+def _espera_reintento(order_id: str, intento: int, motivo: str) -> float:
+    espera = settings.PAYZEN_BACKOFF * (2 ** intento) * random.uniform(0.5, 1.5)
+    logger.warning(
+        f"payzen — Order/Get reintento {intento + 1}/{settings.PAYZEN_REINTENTOS} — order_id={order_id} "
+        f"motivo={motivo} espera={espera:.2f}s"
+    )
+    return espera
+
+
+# ── Cliente async (vistas ASGI) ───────────────────────────────────────────────
+# httpx.AsyncClient queda atado al event loop que lo creó: se crea uno por loop
+# (bajo uvicorn/daphne hay uno solo por proceso).
+
+_cliente_async: Optional[httpx.AsyncClient] = None
+_cliente_async_loop = None
+
+
+def get_cliente_async() -> httpx.AsyncClient:
+    global _cliente_async, _cliente_async_loop
+    loop = asyncio.get_running_loop()
+    if _cliente_async is None or _cliente_async_loop is not loop:
+        _cliente_async = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.PAYZEN_ASYNC_CONEXIONES,
+                max_keepalive_connections=settings.PAYZEN_POOL_SIZE,
+            ),
+            timeout=httpx.Timeout(settings.PAYZEN_READ_TIMEOUT, connect=settings.PAYZEN_CONNECT_TIMEOUT),
+        )
+        _cliente_async_loop = loop
+        logger.debug(f"payzen — cliente async creado max_connections={settings.PAYZEN_ASYNC_CONEXIONES}")
+    return _cliente_async
+
+
+async def cerrar_cliente_async():
+    global _cliente_async, _cliente_async_loop
+    cliente, _cliente_async, _cliente_async_loop = _cliente_async, None, None
+    if cliente is not None:
+        await cliente.aclose()
+
+
+async def _post_async(url: str, payload: Dict[str, Any]):
+    """POST con el cliente async; traduce las excepciones de httpx a las de requests."""
+    if not circuito.permitir():
+        raise CircuitoAbierto("Pasarela PayZen degradada (circuito abierto).")
+    inicio = time.monotonic()
+    try:
+        response = await get_cliente_async().post(url, json=payload, headers=auth_header())
+    except httpx.TimeoutException as e:
+        circuito.registrar(False, time.monotonic() - inicio)
+        raise requests.exceptions.Timeout(str(e)) from e
+    except httpx.TransportError as e:
+        circuito.registrar(False, time.monotonic() - inicio)
+        raise requests.exceptions.ConnectionError(str(e)) from e
+    circuito.registrar(_ok_http(response), time.monotonic() - inicio)
+    return response
+
+
+async def crear_orden_async(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """CreatePaymentOrder sin bloquear el event loop. Sin reintentos, como crear_orden."""
+    response = await _post_async(settings.PAYZEN_URL, payload)
+    return response.json()
+
+
+async def consultar_orden_async(order_id: str) -> Dict[str, Any]:
+    """Order/Get sin bloquear el event loop, con los mismos reintentos que consultar_orden."""
+    reintentos = settings.PAYZEN_REINTENTOS
+    for intento in range(reintentos + 1):
+        try:
+            response = await _post_async(settings.PAYZEN_CHECK_URL, {"orderId": order_id})
+            if response.status_code not in ESTADOS_REINTENTABLES or intento == reintentos:
+                return response.json()
+            motivo = f"HTTP {response.status_code}"
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if intento == reintentos:
+                raise
+            motivo = type(e).__name__
+
+        await asyncio.sleep(_espera_reintento(order_id, intento, motivo))
+
+
+# ── Cache de estado con single-flight ─────────────────────────────────────────
+# Dos pestañas (o el comercio y un admin) mirando el mismo link comparten la
+# respuesta de Order/Get: queda PAYZEN_ESTADO_TTL segundos en el cache de Django
+# y, mientras una consulta está en curso, las demás para la misma orden la esperan
+# en vez de salir a PayZen — dentro del proceso con un Event, entre procesos con
+# un lock en el cache (cache.add).
+
+class _Vuelo:
+    __slots__ = ('evento', 'resultado', 'error')
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+
+_en_vuelo: Dict[str, _Vuelo] = {}
+_en_vuelo_lock = threading.Lock()
+
+
+def _clave_estado(order_id: str) -> str:
+    return f"payzen:orden:{order_id}"
+
+
+def _espera_maxima() -> float:
+    return settings.PAYZEN_CONNECT_TIMEOUT + settings.PAYZEN_READ_TIMEOUT
+
+
+def olvidar_orden(order_id: str):
+    """Descarta el estado cacheado (ej: llegó una IPN con novedades)."""
+    cache.delete(_clave_estado(order_id))
+
+
+def consultar_orden_cacheada(order_id: str) -> Dict[str, Any]:
+    clave = _clave_estado(order_id)
+    datos = cache.get(clave)
+    if datos is not None:
+        return datos
+
+    with _en_vuelo_lock:
+        vuelo = _en_vuelo.get(order_id)
+        lider = vuelo is None
+        if lider:
+            vuelo = _en_vuelo[order_id] = _Vuelo()
+
+    if not lider:
+        if vuelo.evento.wait(_espera_maxima()):
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+        return consultar_orden(order_id)
+
+    try:
+        vuelo.resultado = _consultar_compartida(order_id, clave)
+        return vuelo.resultado
+    except Exception as e:
+        vuelo.error = e
+        raise
+    finally:
+        with _en_vuelo_lock:
+            _en_vuelo.pop(order_id, None)
+        vuelo.evento.set()
+
+
+def _consultar_compartida(order_id: str, clave: str) -> Dict[str, Any]:
+    """Una consulta por orden entre todos los procesos que comparten el cache."""
+    clave_lock = f"{clave}:lock"
+    limite = time.monotonic() + _espera_maxima()
+    while not cache.add(clave_lock, 1, timeout=int(_espera_maxima()) + 1):
+        # Otro proceso está consultando esta orden: esperar su resultado
+        time.sleep(0.1)
+        datos = cache.get(clave)
+        if datos is not None:
+            return datos
+        if time.monotonic() >= limite:
+            break
+    try:
+        datos = consultar_orden(order_id)
+        cache.set(clave, datos, settings.PAYZEN_ESTADO_TTL)
+        return datos
+    finally:
+        cache.delete(clave_lock)
+
+
+_en_vuelo_async: Dict[tuple, asyncio.Task] = {}
+
+
+async def consultar_orden_cacheada_async(order_id: str) -> Dict[str, Any]:
+    """Igual que consultar_orden_cacheada, con single-flight entre las tareas del event loop."""
+    clave = _clave_estado(order_id)
+    datos = await cache.aget(clave)
+    if datos is not None:
+        return datos
+
+    loop = asyncio.get_running_loop()
+    llave = (id(loop), order_id)
+    tarea = _en_vuelo_async.get(llave)
+    if tarea is None or tarea.get_loop() is not loop:
+        tarea = _en_vuelo_async[llave] = loop.create_task(_consultar_compartida_async(order_id, clave))
+        tarea.add_done_callback(lambda _: _en_vuelo_async.pop(llave, None))
+    # shield: si un request se cancela, la consulta sigue para los demás que la esperan
+    return await asyncio.shield(tarea)
+
+
+async def _consultar_compartida_async(order_id: str, clave: str) -> Dict[str, Any]:
+    clave_lock = f"{clave}:lock"
+    limite = time.monotonic() + _espera_maxima()
+    while not await cache.aadd(clave_lock, 1, timeout=int(_espera_maxima()) + 1):
+        await asyncio.sleep(0.1)
+        datos = await cache.aget(clave)
+        if datos is not None:
+            return datos
+        if time.monotonic() >= limite:
+            break
+    try:
+        datos = await consultar_orden_async(order_id)
+        await cache.aset(clave, datos, settings.PAYZEN_ESTADO_TTL)
+        return datos
+    finally:
+        await cache.adelete(clave_lock)
+
+
+def clave_firma(kr_hash_key: str) -> Optional[str]:
+    """
+    Clave con la que PayZen firmó el kr-answer: la contraseña REST para la IPN
+    (kr-hash-key=password) o la clave HMAC-SHA-256 para el retorno del navegador.
+    """
+    if kr_hash_key == 'password':
+        return settings.PAYZEN_REST_PASS
+    if kr_hash_key == 'sha256_hmac':
+        return settings.PAYZEN_HMAC_KEY
+    return None
+
+
+def firmar(kr_answer: str, clave: str) -> str:
+    return hmac.new(clave.encode(), kr_answer.encode(), hashlib.sha256).hexdigest()
+
+
+def verificar_firma(kr_answer: str, kr_hash: str, kr_hash_key: str, kr_hash_algorithm: str = 'sha256_hmac') -> bool:
+    clave = clave_firma(kr_hash_key)
+    if not clave or kr_hash_algorithm != 'sha256_hmac' or not kr_hash:
+        return False
+    return hmac.compare_digest(firmar(kr_answer, clave), kr_hash.lower())
+
+
+# IPN grabadas de PayZen (app1/payzen_ipn/*.json) para tests y el comando simular_ipn
+RUTA_IPN_GRABADAS = Path(__file__).with_name('payzen_ipn')
+
+
+def ipn_grabada(nombre: str, order_id: str) -> Dict[str, Any]:
+    with open(RUTA_IPN_GRABADAS / f"{nombre}.json", encoding='utf-8') as archivo:
+        answer = json.load(archivo)
+    answer['orderDetails']['orderId'] = order_id
+    return answer
+
+
+def armar_ipn(answer: Dict[str, Any], clave: Optional[str] = None) -> Dict[str, str]:
+    """Campos del POST que hace PayZen a la URL de IPN, firmados con la contraseña REST."""
+    kr_answer = json.dumps(answer, separators=(',', ':'))
+    return {
+        'kr-hash': firmar(kr_answer, clave if clave is not None else settings.PAYZEN_REST_PASS),
+        'kr-hash-algorithm': 'sha256_hmac',
+        'kr-hash-key': 'password',
+        'kr-answer-type': 'V4/Payment',
+        'kr-answer': kr_answer,
+    }
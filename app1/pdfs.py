@@ -0,0 +1,293 @@
+"""
+Almacén en disco de PDFs renderizados (tickets de liquidación).
+
+Cada PDF se guarda en PDF_CACHE_DIR/<tipo>/<id>/<clave>.pdf. La clave es un hash
+del HTML ya renderizado, que depende del contexto y de la plantilla: mientras
+ninguno cambie, el PDF se sirve del disco sin pasar otra vez por WeasyPrint, y la
+misma clave sirve de ETag. Las versiones anteriores de un objeto no se borran al
+guardar una nueva: un FileResponse o un zip puede estar leyéndolas. Las borra
+`manage.py limpiar_pdfs` (`limpiar`) cuando llevan un rato sin usarse.
+
+Los recursos bajo STATIC_URL se leen del disco y no por HTTP, así el resultado no
+depende del host del request y se puede renderizar fuera de uno: `encolar` corre
+trabajos best effort (p. ej. pre-renderizar el ticket de un pago recién
+confirmado) en hilos de fondo; lo que no puede perderse no va ahí.
+
+WeasyPrint corre en un pool de PDF_PROCESOS procesos aparte (`renderizar`): cada
+uno importa WeasyPrint, arma la configuración de fuentes y hace un render de
+calentamiento al arrancar, y después recibe HTML y devuelve bytes. El pool acota
+el CPU que se lleva el render; los hilos web solo esperan el resultado. Con
+PDF_PROCESOS=0 se renderiza en el mismo proceso. Los trabajos largos, como el ZIP
+de tickets, abren su propio `PoolDeRender` (PDF_ZIP_PROCESOS) mientras duran, así
+no compiten con los requests ni agrandan el pool de cada worker.
+"""
+import functools
+import hashlib
+import logging
+import mimetypes
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.db import connections
+
+logger = logging.getLogger('app1')
+
+# Subir si cambia la forma de renderizar (la plantilla ya entra en la clave)
+VERSION = 1
+# Base ficticia de los documentos: lo que cuelga de STATIC_URL se resuelve en disco
+BASE_URL = 'http://pagotech.pdf/'
+
+_lock = threading.Lock()
+_en_curso: Dict[str, threading.Lock] = {}
+_fondo: Optional[ThreadPoolExecutor] = None
+_fuentes = None  # FontConfiguration del proceso que renderiza
+_fetcher = None
+
+
+def clave(html: str) -> str:
+    return hashlib.sha256(f"{VERSION}\0{html}".encode('utf-8')).hexdigest()[:32]
+
+
+def ruta(tipo: str, ident, clave_pdf: str) -> str:
+    return os.path.join(settings.PDF_CACHE_DIR, tipo, str(ident), f"{clave_pdf}.pdf")
+
+
+def _archivo_estatico(relativa: str):
+    archivo = finders.find(relativa)
+    if not archivo and settings.STATIC_ROOT:
+        candidato = os.path.join(settings.STATIC_ROOT, relativa)
+        archivo = candidato if os.path.isfile(candidato) else None
+    return archivo
+
+
+@functools.lru_cache(maxsize=64)
+def _estatico(relativa: str) -> Optional[Tuple[bytes, Optional[str]]]:
+    """Contenido y tipo de un recurso estático; queda en memoria del proceso."""
+    archivo = _archivo_estatico(relativa)
+    if not archivo:
+        return None
+    with open(archivo, 'rb') as f:
+        return f.read(), mimetypes.guess_type(archivo)[0]
+
+
+def _recurso_local(url: str):
+    prefijo = BASE_URL.rstrip('/') + settings.STATIC_URL
+    return _estatico(url[len(prefijo):]) if url.startswith(prefijo) else None
+
+
+def _crear_fetcher():
+    """url_fetcher de WeasyPrint que resuelve STATIC_URL en disco (URLFetcher en las versiones nuevas, función en las anteriores)."""
+    try:
+        from weasyprint.urls import URLFetcher, URLFetcherResponse
+    except ImportError:
+        from weasyprint import default_url_fetcher
+
+        def fetcher(url):
+            recurso = _recurso_local(url)
+            if recurso:
+                return {'string': recurso[0], 'mime_type': recurso[1], 'redirected_url': url}
+            return default_url_fetcher(url)
+        return fetcher
+
+    class Fetcher(URLFetcher):
+        def fetch(self, url, headers=None):
+            recurso = _recurso_local(url)
+            if recurso:
+                return URLFetcherResponse(url, recurso[0], {'Content-Type': recurso[1] or 'application/octet-stream'})
+            return super().fetch(url, headers)
+    return Fetcher()
+
+
+def _renderizar_local(html: str) -> bytes:
+    """HTML → PDF con WeasyPrint en este proceso, reusando fuentes y fetcher entre renders."""
+    global _fuentes, _fetcher
+    from weasyprint import HTML
+    try:
+        from weasyprint.text.fonts import FontConfiguration
+    except ImportError:
+        from weasyprint.fonts import FontConfiguration
+
+    if _fuentes is None:
+        _fuentes, _fetcher = FontConfiguration(), _crear_fetcher()
+    return HTML(string=html, base_url=BASE_URL, url_fetcher=_fetcher).write_pdf(font_config=_fuentes)
+
+
+def _iniciar_proceso():
+    """Inicializador de cada proceso del pool: Django, WeasyPrint y un render de calentamiento."""
+    import django
+    django.setup()
+    _renderizar_local('<html><body><p>Pago Tech</p></body></html>')
+
+
+def _calentar() -> int:
+    return os.getpid()
+
+
+class PoolDeRender:
+    """
+    Pool de procesos de WeasyPrint dimensionado por el setting `ajuste`. Los procesos
+    arrancan con el primer render; si uno muere el pool se descarta y el render
+    siguiente arranca otro. Con el setting en 0 se renderiza en el proceso actual.
+    """
+
+    def __init__(self, ajuste: str):
+        self.ajuste = ajuste
+        self._ejecutor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def procesos(self) -> int:
+        return getattr(settings, self.ajuste)
+
+    def _abrir(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._ejecutor is None:
+                procesos = self.procesos
+                # spawn: los procesos no heredan hilos, locks ni conexiones del proceso web
+                self._ejecutor = ProcessPoolExecutor(
+                    max_workers=procesos,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_iniciar_proceso,
+                )
+                for _ in range(procesos):
+                    self._ejecutor.submit(_calentar)
+                logger.info(f"pdfs — pool de render iniciado — {self.ajuste}={procesos}")
+            return self._ejecutor
+
+    def _descartar(self, roto: ProcessPoolExecutor):
+        with self._lock:
+            if self._ejecutor is roto:
+                self._ejecutor = None
+        roto.shutdown(wait=False, cancel_futures=True)
+
+    def renderizar(self, html: str) -> bytes:
+        """HTML → PDF. Espera a lo sumo PDF_TIMEOUT segundos a un proceso del pool."""
+        if self.procesos <= 0:
+            return _renderizar_local(html)
+        ejecutor = self._abrir()
+        try:
+            return ejecutor.submit(_renderizar_local, html).result(timeout=settings.PDF_TIMEOUT)
+        except BrokenProcessPool:
+            # Un proceso murió (p. ej. sin memoria): el próximo render arranca un pool nuevo
+            logger.error(f"pdfs — pool de render roto, se reinicia — {self.ajuste}")
+            self._descartar(ejecutor)
+            raise
+
+    def cerrar(self):
+        with self._lock:
+            ejecutor, self._ejecutor = self._ejecutor, None
+        if ejecutor is not None:
+            ejecutor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self) -> 'PoolDeRender':
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+# Pool que atiende los requests (tickets, resúmenes, pre-render al confirmar un pago)
+_pool_web = PoolDeRender('PDF_PROCESOS')
+
+
+def renderizar(html: str, pool: Optional[PoolDeRender] = None) -> bytes:
+    """HTML → PDF en `pool`, o en el pool de PDF_PROCESOS de los requests."""
+    return (pool or _pool_web).renderizar(html)
+
+
+def _guardar(destino: str, datos: bytes):
+    """Escritura atómica (archivo temporal + rename)."""
+    carpeta = os.path.dirname(destino)
+    os.makedirs(carpeta, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=carpeta, suffix='.tmp', delete=False) as tmp:
+        tmp.write(datos)
+    os.replace(tmp.name, destino)
+
+
+def _marcar_uso(destino: str):
+    """Anota el uso en el atime: `limpiar` lo mira, y el mtime sigue siendo el Last-Modified."""
+    os.utime(destino, (time.time(), os.stat(destino).st_mtime))
+
+
+def limpiar(antiguedad: float) -> int:
+    """
+    Borra las versiones viejas de cada objeto: en cada carpeta conserva el PDF usado
+    más recientemente y borra los demás (y los .tmp de escrituras cortadas) que no se
+    usan hace más de `antiguedad` segundos. Devuelve cuántos archivos borró.
+    """
+    limite = time.time() - antiguedad
+    borrados = 0
+    for carpeta, _, nombres in os.walk(settings.PDF_CACHE_DIR):
+        archivos = []
+        for nombre in nombres:
+            if nombre.endswith(('.pdf', '.tmp')):
+                try:
+                    archivos.append((os.stat(os.path.join(carpeta, nombre)).st_atime, nombre))
+                except FileNotFoundError:
+                    continue
+        versiones = [a for a in archivos if a[1].endswith('.pdf')]
+        vigente = max(versiones)[1] if versiones else None
+        for usado, nombre in archivos:
+            if nombre == vigente or usado >= limite:
+                continue
+            try:
+                os.remove(os.path.join(carpeta, nombre))
+                borrados += 1
+            except FileNotFoundError:
+                pass
+    logger.info(f"pdfs — limpieza — borrados={borrados} antiguedad={antiguedad:.0f}s")
+    return borrados
+
+
+def obtener(tipo: str, ident, html: str, pool: Optional[PoolDeRender] = None) -> Tuple[str, str]:
+    """
+    (ruta, clave) del PDF de `html`, renderizándolo (en `pool`, ver `renderizar`) solo
+    si no está en disco. Dos pedidos simultáneos del mismo PDF en el proceso hacen un
+    único render.
+    """
+    clave_pdf = clave(html)
+    destino = ruta(tipo, ident, clave_pdf)
+    try:
+        _marcar_uso(destino)
+        logger.debug(f"pdfs — desde disco — {tipo}/{ident} clave={clave_pdf}")
+        return destino, clave_pdf
+    except FileNotFoundError:
+        pass
+
+    with _lock:
+        lock = _en_curso.setdefault(destino, threading.Lock())
+    with lock:
+        try:
+            if not os.path.exists(destino):
+                _guardar(destino, renderizar(html, pool=pool))
+                logger.info(f"pdfs — renderizado — {tipo}/{ident} clave={clave_pdf}")
+        finally:
+            with _lock:
+                _en_curso.pop(destino, None)
+    return destino, clave_pdf
+
+
+def _en_fondo(fn: Callable, *args):
+    try:
+        return fn(*args)
+    except Exception as e:
+        logger.exception(f"pdfs — error en trabajo de fondo {fn.__name__}: {e}")
+    finally:
+        connections.close_all()  # conexiones de este hilo
+
+
+def encolar(fn: Callable, *args) -> Future:
+    """Corre fn(*args) en los PDF_HILOS_FONDO hilos de fondo, sin esperar el resultado."""
+    global _fondo
+    with _lock:
+        if _fondo is None:
+            _fondo = ThreadPoolExecutor(max_workers=settings.PDF_HILOS_FONDO, thread_name_prefix='pdf')
+    return _fondo.submit(_en_fondo, fn, *args)
@@ -0,0 +1,197 @@
+"""
+Simulador local de PayZen para desarrollo y pruebas de carga.
+
+Implementa CreatePaymentOrder y Order/Get con las mismas formas de respuesta
+que la API real, así crud y payzen.py funcionan sin cambios apuntando
+PAYZEN_URL / PAYZEN_CHECK_URL al simulador. Cada orden creada recibe un
+desenlace al azar según los pesos configurados (pagado, rechazado, expirado,
+en proceso o sin abrir); hasta `apertura` segundos después de crearla,
+Order/Get responde PSP_010 como una orden que nadie abrió todavía. Las
+transacciones salen de las IPN grabadas en app1/payzen_ipn.
+
+Se levanta con `python manage.py simular_payzen` (ver app1/management).
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from socketserver import ThreadingMixIn
+from typing import Any, Dict, Optional, Tuple
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from . import payzen
+
+RUTA_CREAR = '/api-payment/V4/Charge/CreatePaymentOrder'
+RUTA_CONSULTAR = '/api-payment/V4/Order/Get'
+
+# Desenlace → IPN grabada con la transacción que devuelve Order/Get (None = PSP_010)
+DESENLACES = {
+    'pagado':     'pagado',
+    'rechazado':  'rechazado',
+    'expirado':   'expirado',
+    'en_proceso': 'en_proceso',
+    'psp_010':    None,
+}
+
+PESOS_POR_DEFECTO = {'pagado': 0.6, 'rechazado': 0.1, 'expirado': 0.1, 'en_proceso': 0.1, 'psp_010': 0.1}
+
+
+def parsear_pesos(texto: str) -> Dict[str, float]:
+    """'pagado=0.5,rechazado=0.2' → {'pagado': 0.5, 'rechazado': 0.2}."""
+    pesos = {}
+    for parte in filter(None, (p.strip() for p in texto.split(','))):
+        nombre, _, valor = parte.partition('=')
+        nombre = nombre.strip().lower()
+        if nombre not in DESENLACES:
+            raise ValueError(f"Desenlace desconocido: {nombre} (válidos: {', '.join(DESENLACES)})")
+        pesos[nombre] = float(valor or 1)
+    if not pesos or sum(pesos.values()) <= 0:
+        raise ValueError("Los pesos de los desenlaces deben sumar más que cero.")
+    return pesos
+
+
+def _error(codigo: str, mensaje: str) -> Dict[str, Any]:
+    return {
+        'status': 'ERROR',
+        'answer': {'errorCode': codigo, 'errorMessage': mensaje, '_type': 'V4/WebService/WebServiceError'},
+    }
+
+
+class SimuladorPayZen:
+    """
+    Estado y reglas del simulador. `latencia` y `jitter` en segundos; `error_http`
+    es la probabilidad de responder 503 (que payzen.consultar_orden reintenta) y
+    `rechazo_creacion` la de rechazar CreatePaymentOrder.
+    """
+
+    def __init__(self, latencia: float = 0.0, jitter: float = 0.0, error_http: float = 0.0,
+                 rechazo_creacion: float = 0.0, pesos: Optional[Dict[str, float]] = None,
+                 apertura: float = 0.0, semilla: Optional[int] = None,
+                 url_pago: str = 'https://payzen.simulador/pago'):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.error_http = error_http
+        self.rechazo_creacion = rechazo_creacion
+        self.pesos = pesos or dict(PESOS_POR_DEFECTO)
+        self.apertura = apertura
+        self.url_pago = url_pago.rstrip('/')
+        self._rng = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.ordenes: Dict[str, Dict[str, Any]] = {}
+        self.contadores = {'crear': 0, 'consultar': 0, 'error_http': 0}
+
+    def _azar(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _esperar(self):
+        if self.latencia or self.jitter:
+            with self._lock:
+                demora = self.latencia + self._rng.uniform(0, self.jitter)
+            time.sleep(demora)
+
+    def _falla_http(self) -> bool:
+        if self.error_http and self._azar() < self.error_http:
+            with self._lock:
+                self.contadores['error_http'] += 1
+            return True
+        return False
+
+    def crear_orden(self, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        self._esperar()
+        with self._lock:
+            self.contadores['crear'] += 1
+        order_id = payload.get('orderId')
+        if not order_id or not payload.get('amount'):
+            return 200, _error('INT_902', 'orderId y amount son obligatorios')
+        if self._falla_http():
+            return 503, _error('INT_999', 'Servicio no disponible')
+        if self.rechazo_creacion and self._azar() < self.rechazo_creacion:
+            return 200, _error('PSP_999', 'Orden rechazada por el simulador')
+
+        with self._lock:
+            desenlace = self._rng.choices(list(self.pesos), weights=list(self.pesos.values()))[0]
+            self.ordenes[order_id] = {
+                'desenlace': desenlace,
+                'amount':    payload['amount'],
+                'cuotas':    ((payload.get('transactionOptions') or {}).get('cardOptions') or {}).get('installmentNumber'),
+                'creada':    time.monotonic(),
+            }
+        return 200, {
+            'status': 'SUCCESS',
+            'answer': {
+                'paymentURL':     f"{self.url_pago}/{order_id}",
+                'paymentOrderId': uuid.uuid4().hex,
+                'orderId':        order_id,
+                '_type':          'V4/PaymentOrder',
+            },
+        }
+
+    def consultar_orden(self, order_id: str) -> Tuple[int, Dict[str, Any]]:
+        self._esperar()
+        with self._lock:
+            self.contadores['consultar'] += 1
+            orden = self.ordenes.get(order_id)
+        if self._falla_http():
+            return 503, _error('INT_999', 'Servicio no disponible')
+
+        grabada = DESENLACES[orden['desenlace']] if orden else None
+        if grabada is None or time.monotonic() - orden['creada'] < self.apertura:
+            return 200, _error('PSP_010', 'transaction not found')
+
+        answer = payzen.ipn_grabada(grabada, order_id)
+        answer['orderDetails']['orderTotalAmount'] = orden['amount']
+        answer['orderDetails']['orderEffectiveAmount'] = orden['amount']
+        for tx in answer['transactions']:
+            tx['amount'] = orden['amount']
+            if orden['cuotas'] and grabada == 'pagado':
+                tx['transactionDetails']['cardDetails']['installmentNumber'] = orden['cuotas']
+        return 200, {'status': 'SUCCESS', 'answer': answer}
+
+    def __call__(self, environ, start_response):
+        """Aplicación WSGI: POST JSON a RUTA_CREAR o RUTA_CONSULTAR."""
+        ruta = environ.get('PATH_INFO', '')
+        try:
+            largo = int(environ.get('CONTENT_LENGTH') or 0)
+            payload = json.loads(environ['wsgi.input'].read(largo) or b'{}')
+        except (ValueError, json.JSONDecodeError):
+            codigo, cuerpo = 400, _error('INT_905', 'JSON inválido')
+        else:
+            if environ.get('REQUEST_METHOD') != 'POST':
+                codigo, cuerpo = 405, _error('INT_904', 'Solo POST')
+            elif ruta == RUTA_CREAR:
+                codigo, cuerpo = self.crear_orden(payload)
+            elif ruta == RUTA_CONSULTAR:
+                codigo, cuerpo = self.consultar_orden(payload.get('orderId', ''))
+            else:
+                codigo, cuerpo = 404, _error('INT_404', f'Ruta desconocida: {ruta}')
+
+        datos = json.dumps(cuerpo).encode()
+        estados = {200: '200 OK', 400: '400 Bad Request', 404: '404 Not Found',
+                   405: '405 Method Not Allowed', 503: '503 Service Unavailable'}
+        start_response(estados[codigo], [('Content-Type', 'application/json'),
+                                         ('Content-Length', str(len(datos)))])
+        return [datos]
+
+
+class _Servidor(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _Handler(WSGIRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como la API real
+
+    def log_message(self, *args):
+        pass
+
+
+def crear_servidor(simulador: SimuladorPayZen, host: str = '127.0.0.1', puerto: int = 8765):
+    """Servidor WSGI multihilo; puerto=0 elige uno libre (ver servidor.server_port)."""
+    return make_server(host, puerto, simulador, server_class=_Servidor, handler_class=_Handler)
+
+
+def urls(host: str, puerto: int) -> Dict[str, str]:
+    base = f"http://{host}:{puerto}"
+    return {'PAYZEN_URL': base + RUTA_CREAR, 'PAYZEN_CHECK_URL': base + RUTA_CONSULTAR}
@@ -1,3 +1,1495 @@
-from django.test import TestCase
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_finished, request_started
+from django.db.models import F
+from django.forms.models import model_to_dict
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import carga, crud, payzen, pdfs, simulador_payzen
+from .models import Cliente, LinkPago
+from app2 import benchmark, crud as admin_crud
+from app2.crud import VERSION_CONFIG, get_or_create_config
+from app2.models import CuotaConfig, ParametroFinanciero, SelloVersion, TarifaCongelada, TarjetaCustom, User_admin
+from app2.tarifario import VERSION_TARIFARIO, get_tarifario
+from utils import versionado
+
+
+class PayZenTestCase(TestCase):
+    """
+    Cada test arranca con el cache de estados vacío y el circuito de PayZen cerrado.
+    Los PDF van a una carpeta temporal, sin WeasyPrint, y los trabajos de fondo corren en línea.
+    """
+
+    def setUp(self):
+        cache.clear()
+        payzen.circuito.reiniciar()
+        self.addCleanup(payzen.circuito.reiniciar)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.enterContext(override_settings(PDF_CACHE_DIR=directorio.name))
+        self.renderizar = self.enterContext(mock.patch('app1.pdfs.renderizar', return_value=b'%PDF-1.7 ticket'))
+        self.enterContext(mock.patch('app1.pdfs.encolar', side_effect=lambda fn, *args: fn(*args)))
+
+
+class PayZenStub:
+    """
+    Reemplazo local de la sesión de PayZen (app1.payzen.get_sesion) para CreatePaymentOrder:
+    responde SUCCESS con una URL por orden, o rechaza los montos (en centavos) indicados.
+    Registra la concurrencia máxima observada.
+    """
+
+    def __init__(self, rechazar_montos=()):
+        self.rechazar_montos = set(rechazar_montos)
+        self.pedidos = []
+        self._lock = threading.Lock()
+        self._en_curso = 0
+        self.max_en_curso = 0
+
+    def post(self, url, json=None, headers=None, timeout=None):
+        with self._lock:
+            self.pedidos.append(json)
+            self._en_curso += 1
+            self.max_en_curso = max(self.max_en_curso, self._en_curso)
+        try:
+            if json['amount'] in self.rechazar_montos:
+                cuerpo = {'status': 'ERROR', 'answer': {'errorMessage': 'Monto rechazado'}}
+            else:
+                cuerpo = {'status': 'SUCCESS',
+                          'answer': {'paymentURL': f"https://payzen.test/{json['orderId']}"}}
+            return mock.Mock(json=mock.Mock(return_value=cuerpo))
+        finally:
+            with self._lock:
+                self._en_curso -= 1
+
+
+class PayZenStubAsync(PayZenStub):
+    """PayZenStub con la interfaz de httpx.AsyncClient (app1.payzen.get_cliente_async)."""
+
+    async def post(self, url, json=None, headers=None):
+        return PayZenStub.post(self, url, json=json, headers=headers)
+
+
+@override_settings(PAYZEN_CONCURRENCIA=3)
+class CreacionMasivaTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+
+    def test_parsear_csv_y_json(self):
+        filas, errores = crud.parsear_filas_masivas(
+            'Monto;Cuotas;Tipo_Tarjeta;Descripcion\n1500,50;1;debito;Remera\n', 'csv'
+        )
+        self.assertEqual(errores, [])
+        self.assertEqual(filas, [{'monto': '1500,50', 'cuotas': '1',
+                                  'tipo_tarjeta': 'debito', 'descripcion': 'Remera'}])
+
+        filas, errores = crud.parsear_filas_masivas('{"filas": [{"monto": 10}]}', 'json')
+        self.assertEqual((filas, errores), ([{'monto': 10}], []))
+
+        self.assertTrue(crud.parsear_filas_masivas('producto,precio\na,1', 'csv')[1])
+        self.assertTrue(crud.parsear_filas_masivas('[1, 2]', 'json')[1])
+
+    def test_reporte_por_fila_y_bulk_create(self):
+        stub = PayZenStub(rechazar_montos={77700})
+        filas = [
+            {'monto': '1000', 'cuotas': 1, 'tipo_tarjeta': 'debito', 'descripcion': 'A'},
+            {'monto': 'abc', 'tipo_tarjeta': 'debito'},
+            {'monto': '777', 'tipo_tarjeta': 'credito'},
+            {'monto': '2500.5', 'tipo_tarjeta': 'credito', 'cuotas': 24},
+        ] + [{'monto': str(100 + i), 'tipo_tarjeta': 'credito'} for i in range(8)]
+
+        with mock.patch('app1.payzen.get_sesion', return_value=stub):
+            reporte, errores = crud.create_links_masivo(self.cliente.pk, filas)
+
+        self.assertEqual(errores, [])
+        self.assertEqual([r['fila'] for r in reporte], list(range(1, len(filas) + 1)))
+        self.assertTrue(reporte[0]['ok'])
+        self.assertEqual(reporte[1]['errors'], ['Monto inválido.'])
+        self.assertEqual(reporte[2]['errors'], ['Pasarela PayZen indica: Monto rechazado'])
+        self.assertFalse(reporte[3]['ok'])  # sin plan de 24 cuotas
+        self.assertTrue(all(r['ok'] for r in reporte[4:]))
+
+        # Solo las filas válidas llegan a PayZen, y nunca más de PAYZEN_CONCURRENCIA a la vez
+        self.assertEqual(len(stub.pedidos), 10)
+        self.assertLessEqual(stub.max_en_curso, 3)
+
+        links = LinkPago.objects.filter(cliente=self.cliente)
+        self.assertEqual(links.count(), 9)
+        link = links.get(order_id=reporte[0]['order_id'])
+        self.assertEqual(link.link, reporte[0]['link'])
+        self.assertEqual(link.monto, Decimal('1000'))
+        self.assertEqual(link.commission_amount + link.receiver_amount, link.monto)
+        self.assertIsNotNone(link.tarifa_id)
+
+    def test_mismo_calculo_que_create_link(self):
+        stub = PayZenStub()
+        with mock.patch('app1.payzen.get_sesion', return_value=stub):
+            individual, _ = crud.create_link(self.cliente.pk, '1234.56', 1, 'credito', 'x')
+            reporte, _ = crud.create_links_masivo(
+                self.cliente.pk, [{'monto': '1234.56', 'tipo_tarjeta': 'credito', 'descripcion': 'x'}]
+            )
+        individual = LinkPago.objects.get(pk=individual.pk)
+        masivo = LinkPago.objects.get(order_id=reporte[0]['order_id'])
+        for campo in ('monto', 'commission_percent', 'commission_amount', 'receiver_amount',
+                      'desglose_arancel', 'desglose_comision', 'desglose_tasa',
+                      'desglose_iva_21', 'desglose_iva_105', 'desglose_cuota_valor', 'tarifa_id'):
+            self.assertEqual(getattr(masivo, campo), getattr(individual, campo), campo)
+        self.assertEqual(stub.pedidos[0]['amount'], stub.pedidos[1]['amount'])
+
+    def test_vista_con_archivo_csv(self):
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+
+        archivo = SimpleUploadedFile('links.csv', b'monto,cuotas,tipo_tarjeta,descripcion\n500,1,debito,Taza\n')
+        with mock.patch('app1.payzen.get_sesion', return_value=PayZenStub()):
+            respuesta = self.client.post(reverse('crear_links_masivo'), {'archivo': archivo})
+
+        datos = respuesta.json()
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual((datos['creados'], datos['rechazados']), (1, 0))
+
+        respuesta = self.client.post(reverse('crear_links_masivo'),
+                                     json.dumps({'filas': [{'monto': 1}] * (crud.MAX_FILAS_MASIVAS + 1)}),
+                                     content_type='application/json')
+        self.assertEqual(respuesta.status_code, 400)
+
+
+@override_settings(PAYZEN_SHOP_ID='123', PAYZEN_REST_PASS='clave', PAYZEN_REINTENTOS=2,
+                   PAYZEN_CONNECT_TIMEOUT=1.5, PAYZEN_READ_TIMEOUT=7)
+class ClientePayZenTests(PayZenTestCase):
+
+    def _respuesta(self, status_code=200, cuerpo=None):
+        return mock.Mock(status_code=status_code, json=mock.Mock(return_value=cuerpo or {'status': 'SUCCESS'}))
+
+    def test_sesion_compartida_y_header_cacheado(self):
+        payzen.cerrar_sesion()
+        self.addCleanup(payzen.cerrar_sesion)
+        self.assertIs(payzen.get_sesion(), payzen.get_sesion())
+        self.assertEqual(payzen.auth_header()['Authorization'], 'Basic MTIzOmNsYXZl')
+        with override_settings(PAYZEN_REST_PASS='otra'):
+            self.assertEqual(payzen.auth_header()['Authorization'], 'Basic MTIzOm90cmE=')
+
+    def test_consultar_orden_reintenta_con_timeouts(self):
+        sesion = mock.Mock()
+        sesion.post.side_effect = [
+            requests.exceptions.ConnectTimeout(),
+            self._respuesta(503),
+            self._respuesta(cuerpo={'status': 'SUCCESS', 'answer': {}}),
+        ]
+        with mock.patch('app1.payzen.get_sesion', return_value=sesion), \
+                mock.patch('app1.payzen.time.sleep') as sleep:
+            self.assertEqual(payzen.consultar_orden('PAY-1')['status'], 'SUCCESS')
+
+        self.assertEqual(sesion.post.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(sesion.post.call_args.kwargs['timeout'], (1.5, 7))
+        self.assertEqual(sesion.post.call_args.kwargs['json'], {'orderId': 'PAY-1'})
+
+    def test_consultar_orden_agota_reintentos(self):
+        sesion = mock.Mock()
+        sesion.post.side_effect = requests.exceptions.ReadTimeout()
+        with mock.patch('app1.payzen.get_sesion', return_value=sesion), \
+                mock.patch('app1.payzen.time.sleep'):
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                payzen.consultar_orden('PAY-1')
+        self.assertEqual(sesion.post.call_count, 3)
+
+    def test_crear_orden_no_reintenta(self):
+        sesion = mock.Mock()
+        sesion.post.side_effect = requests.exceptions.ReadTimeout()
+        with mock.patch('app1.payzen.get_sesion', return_value=sesion):
+            self.assertEqual(crud._crear_orden_payzen({'orderId': 'PAY-2'}),
+                             (None, ['La pasarela de pago tardó demasiado. Reintente.']))
+        self.assertEqual(sesion.post.call_count, 1)
+
+
+@override_settings(PAYZEN_REST_PASS='clave-ipn', PAYZEN_IPN_ACTIVO=True, PAYZEN_IPN_RESPALDO=300)
+class IpnPayZenTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', email='c@example.com')
+        self.link = LinkPago.objects.create(
+            cliente=self.cliente, monto=Decimal('1500.00'), order_id='PAY-IPN0000001',
+            receiver_amount=Decimal('1400.00'), link='https://payzen.test/PAY-IPN0000001',
+        )
+
+    def _enviar(self, nombre, clave=None):
+        datos = payzen.armar_ipn(payzen.ipn_grabada(nombre, self.link.order_id), clave)
+        return self.client.post(reverse('ipn_payzen'), datos)
+
+    def test_pago_por_ipn_es_idempotente(self):
+        with mock.patch('utils.email_utils.mail') as enviar, self.captureOnCommitCallbacks(execute=True):
+            primera = self._enviar('pagado')
+            segunda = self._enviar('pagado')
+
+        self.assertEqual((primera.status_code, segunda.status_code), (200, 200))
+        self.assertEqual(enviar.call_count, 1)
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.pagado)
+        self.assertEqual(self.link.status_detalle, 'AUTHORISED')
+        self.assertEqual(self.link.auth_code, '3fe4a1')
+        self.assertEqual(self.link.lote_number, '1')
+        self.assertEqual(self.link.cuotas_elegidas, 3)
+        self.assertIsNotNone(self.link.estado_actualizado_en)
+
+        # Un rechazo posterior (IPN fuera de orden) no deshace el pago
+        self._enviar('rechazado')
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.pagado)
+
+    def test_firma_invalida(self):
+        respuesta = self._enviar('pagado', clave='otra-clave')
+        self.assertEqual(respuesta.status_code, 400)
+        self.link.refresh_from_db()
+        self.assertFalse(self.link.pagado)
+
+    def test_orden_desconocida_o_sin_orden_responde_200(self):
+        datos = payzen.armar_ipn(payzen.ipn_grabada('pagado', 'PAY-NOEXISTE'))
+        with self.assertLogs('app1', 'WARNING') as logs:
+            respuesta = self.client.post(reverse('ipn_payzen'), datos)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.content, 'IGNORADA Orden desconocida.'.encode())
+        self.assertTrue(any('PAY-NOEXISTE' in linea for linea in logs.output))
+
+        respuesta = self.client.post(reverse('ipn_payzen'), payzen.armar_ipn({'orderStatus': 'PAID'}))
+        self.assertEqual(respuesta.status_code, 200)
+        self.link.refresh_from_db()
+        self.assertFalse(self.link.pagado)
+
+    def test_verificar_estado_lee_la_base_con_ipn(self):
+        self._enviar('rechazado')
+        with mock.patch('app1.payzen.consultar_orden') as consultar:
+            estado = crud.verificar_estado_pago(self.link.pk)
+        consultar.assert_not_called()
+        self.assertEqual(estado['status'], 'REFUSED')
+        self.assertTrue(estado['anulado'])
+
+        # Sin novedades dentro de PAYZEN_IPN_RESPALDO, vuelve a consultar PayZen
+        LinkPago.objects.filter(pk=self.link.pk).update(
+            status_detalle='INITIAL', estado_actualizado_en=None,
+            created_at=self.link.created_at - timedelta(hours=1),
+        )
+        respuesta = {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('en_proceso', self.link.order_id)}
+        with mock.patch('app1.payzen.consultar_orden', return_value=respuesta) as consultar:
+            estado = crud.verificar_estado_pago(self.link.pk)
+        consultar.assert_called_once_with(self.link.order_id)
+        self.assertEqual(estado['status'], 'WAITING_AUTHORISATION')
+        self.link.refresh_from_db()
+        self.assertEqual(self.link.status_detalle, 'WAITING_AUTHORISATION')
+
+
+@override_settings(PAYZEN_CONCURRENCIA=2, PAYZEN_IPN_ACTIVO=False)
+class EstadosEnLoteTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x')
+        otro = Cliente.objects.create(nombre='Otro', password='x')
+        self.links = {
+            nombre: LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id=f'PAY-{nombre}',
+                                            link=f'https://payzen.test/{nombre}', **campos)
+            for nombre, campos in {
+                'pagado':    {'pagado': True, 'status_detalle': 'CAPTURED'},
+                'rechazado': {'status_detalle': 'REFUSED'},
+                'abierto1':  {},
+                'abierto2':  {},
+            }.items()
+        }
+        self.ajeno = LinkPago.objects.create(cliente=otro, monto=Decimal('100'), order_id='PAY-ajeno',
+                                             link='https://payzen.test/ajeno')
+
+    def test_finalizados_desde_db_y_resto_en_paralelo(self):
+        def consultar(order_id):
+            return {'status': 'SUCCESS', 'answer': payzen.ipn_grabada(
+                'pagado' if order_id == 'PAY-abierto1' else 'en_proceso', order_id)}
+
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+        ids = [link.pk for link in self.links.values()] + [self.ajeno.pk]
+
+        with mock.patch('app1.payzen.consultar_orden', side_effect=consultar) as consultar_orden, \
+                mock.patch('utils.email_utils.mail'):
+            respuesta = self.client.get(reverse('verificar_pagos_ajax'), {'id': ids})
+
+        self.assertEqual(respuesta.status_code, 200)
+        estados = respuesta.json()['estados']
+        self.assertEqual(set(estados), {str(link.pk) for link in self.links.values()})
+        self.assertEqual(sorted(c.args[0] for c in consultar_orden.call_args_list),
+                         ['PAY-abierto1', 'PAY-abierto2'])
+        self.assertTrue(estados[str(self.links['pagado'].pk)]['pagado'])
+        self.assertTrue(estados[str(self.links['rechazado'].pk)]['anulado'])
+        self.assertTrue(estados[str(self.links['abierto1'].pk)]['pagado'])
+        self.assertEqual(estados[str(self.links['abierto2'].pk)]['status_raw'], 'WAITING_AUTHORISATION')
+
+    def test_limite_de_ids(self):
+        _, errores = crud.verificar_estados_pago(self.cliente.pk, range(crud.MAX_LINKS_ESTADO + 1))
+        self.assertTrue(errores)
+        _, errores = crud.verificar_estados_pago(self.cliente.pk, ['x'])
+        self.assertTrue(errores)
+
+
+@override_settings(PAYZEN_CONCILIACION_BASE=60, PAYZEN_CONCILIACION_MAX=3600, PAYZEN_HORAS_EXPIRACION=24)
+class ConciliacionTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x')
+
+    def _link(self, nombre, edad, consultado_hace=None, **campos):
+        link = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id=f'PAY-{nombre}',
+                                       link=f'https://payzen.test/{nombre}', **campos)
+        ahora = timezone.now()
+        LinkPago.objects.filter(pk=link.pk).update(
+            created_at=ahora - edad,
+            expires_at=ahora - edad + timedelta(hours=24),
+            estado_actualizado_en=ahora - consultado_hace if consultado_hace is not None else None,
+        )
+        return link
+
+    def test_intervalo_crece_con_la_edad(self):
+        self.assertEqual(crud.intervalo_conciliacion(timedelta(seconds=30)), timedelta(seconds=60))
+        self.assertEqual(crud.intervalo_conciliacion(timedelta(minutes=5)), timedelta(minutes=4))
+        self.assertEqual(crud.intervalo_conciliacion(timedelta(minutes=40)), timedelta(minutes=32))
+        self.assertEqual(crud.intervalo_conciliacion(timedelta(hours=20)), timedelta(hours=1))
+
+    def test_pasada_de_conciliacion(self):
+        self._link('vencido', timedelta(hours=30), consultado_hace=timedelta(hours=2))
+        sin_expires = self._link('sin_expires', timedelta(hours=30), consultado_hace=timedelta(hours=2))
+        LinkPago.objects.filter(pk=sin_expires.pk).update(expires_at=None, status_detalle='PENDING')
+        sin_abrir = self._link('sin_abrir', timedelta(hours=1), consultado_hace=timedelta(minutes=40))
+        pagado = self._link('pagado', timedelta(minutes=3))
+        reciente = self._link('reciente', timedelta(minutes=40), consultado_hace=timedelta(minutes=5))
+        self._link('rechazado', timedelta(hours=1), status_detalle='REFUSED')
+
+        def consultar(order_id):
+            if order_id == pagado.order_id:
+                return {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', order_id)}
+            return {'status': 'ERROR', 'answer': {'errorCode': 'PSP_010'}}
+
+        with mock.patch('app1.payzen.consultar_orden', side_effect=consultar) as consultar_orden, \
+                mock.patch('app1.crud.time.sleep') as sleep, mock.patch('utils.email_utils.mail'):
+            resumen = crud.conciliar_pagos_pendientes(limite=10, por_segundo=2)
+
+        # Los vencidos se expiran solo con la confirmación de PayZen (PSP_010), en un UPDATE
+        self.assertEqual(sorted(c.args[0] for c in consultar_orden.call_args_list),
+                         ['PAY-pagado', 'PAY-sin_abrir', 'PAY-sin_expires', 'PAY-vencido'])
+        self.assertEqual((resumen['pagados'], resumen['sin_abrir'], resumen['expirados']), (1, 1, 2))
+        self.assertEqual(sleep.call_count, 3)
+        self.assertTrue(all(0 < c.args[0] <= 0.5 for c in sleep.call_args_list))
+
+        estados = dict(LinkPago.objects.values_list('order_id', 'status_detalle'))
+        self.assertEqual(estados['PAY-vencido'], 'EXPIRED')
+        self.assertEqual(estados['PAY-sin_expires'], 'EXPIRED')
+        self.assertEqual(estados['PAY-sin_abrir'], 'INITIAL')
+        self.assertEqual(estados['PAY-pagado'], 'AUTHORISED')
+        reciente.refresh_from_db()
+        self.assertLess(reciente.estado_actualizado_en, timezone.now() - timedelta(minutes=4))
+
+    @override_settings(PAYZEN_CONCILIADOR_ACTIVO=True)
+    def test_con_conciliador_el_polling_lee_la_base(self):
+        link = self._link('abierto', timedelta(hours=1))
+        with mock.patch('app1.payzen.consultar_orden') as consultar_orden:
+            estado = crud.verificar_estado_pago(link.pk)
+        consultar_orden.assert_not_called()
+        self.assertEqual(estado['status'], 'Esperando Pago...')
+
+
+@override_settings(PAYZEN_ESTADO_TTL=10, PAYZEN_IPN_ACTIVO=False, PAYZEN_CONCILIADOR_ACTIVO=False)
+class CacheEstadoTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', email='c@example.com')
+        self.link = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id='PAY-CACHE',
+                                            link='https://payzen.test/cache')
+
+    def test_single_flight_y_ttl(self):
+        liberar = threading.Event()
+        llamadas = []
+
+        def consultar(order_id):
+            llamadas.append(order_id)
+            liberar.wait(5)
+            return {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('en_proceso', order_id)}
+
+        resultados = []
+        with mock.patch('app1.payzen.consultar_orden', side_effect=consultar):
+            hilos = [threading.Thread(target=lambda: resultados.append(payzen.consultar_orden_cacheada('PAY-CACHE')))
+                     for _ in range(5)]
+            for hilo in hilos:
+                hilo.start()
+            time.sleep(0.2)
+            liberar.set()
+            for hilo in hilos:
+                hilo.join(5)
+            # Dentro del TTL la respuesta sale del cache
+            payzen.consultar_orden_cacheada('PAY-CACHE')
+
+        self.assertEqual(llamadas, ['PAY-CACHE'])
+        self.assertEqual(len(resultados), 5)
+        self.assertTrue(all(r == resultados[0] for r in resultados))
+
+        payzen.olvidar_orden('PAY-CACHE')
+        with mock.patch('app1.payzen.consultar_orden', side_effect=consultar):
+            payzen.consultar_orden_cacheada('PAY-CACHE')
+        self.assertEqual(len(llamadas), 2)
+
+    def test_pago_concurrente_no_duplica_email(self):
+        """Una instancia vieja (leída antes de que otra consulta marcara el pago) no vuelve a pagar."""
+        viejo = LinkPago.objects.get(pk=self.link.pk)
+        respuesta = {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', self.link.order_id)}
+        with mock.patch('utils.email_utils.mail') as enviar, self.captureOnCommitCallbacks(execute=True):
+            crud._aplicar_consulta(self.link, respuesta)
+            estado = crud._aplicar_consulta(viejo, respuesta)
+            crud._aplicar_consulta(viejo, {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('rechazado', 'x')})
+
+        self.assertEqual(enviar.call_count, 1)
+        self.assertTrue(estado['pagado'])
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.pagado)
+        self.assertEqual(self.link.status_detalle, 'AUTHORISED')
+
+
+class VistasAsyncTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+
+    def test_generar_link_async(self):
+        stub = PayZenStubAsync(rechazar_montos={77700})
+        with mock.patch('app1.payzen.get_cliente_async', return_value=stub):
+            respuesta = self.client.post(reverse('generar_link_async'), {
+                'monto': '1000', 'cuotas': '1', 'tipo_tarjeta': 'debito', 'descripcion': 'Async', 'confirm': '1',
+            })
+            rechazada = self.client.post(reverse('generar_link_async'), {
+                'monto': '777', 'cuotas': '1', 'tipo_tarjeta': 'debito', 'confirm': '1',
+            })
+
+        self.assertRedirects(respuesta, reverse('crear_link'), fetch_redirect_response=False)
+        self.assertEqual(rechazada.status_code, 302)
+        link = LinkPago.objects.get(cliente=self.cliente)
+        self.assertEqual(link.descripcion, 'Async')
+        self.assertEqual(link.link, f"https://payzen.test/{link.order_id}")
+        self.assertEqual(len(stub.pedidos), 2)
+        self.assertEqual(self.client.session['link_recien_creado'], {'url': link.link})
+
+    def test_estados_async(self):
+        pagado = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id='PAY-async-1',
+                                         link='https://payzen.test/1', pagado=True, status_detalle='CAPTURED')
+        abierto = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id='PAY-async-2',
+                                          link='https://payzen.test/2')
+
+        async def consultar(order_id):
+            return {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', order_id)}
+
+        with mock.patch('app1.payzen.consultar_orden_async', side_effect=consultar) as consultar_orden, \
+                mock.patch('utils.email_utils.mail'):
+            respuesta = self.client.get(reverse('verificar_pagos_async'), {'id': [pagado.pk, abierto.pk]})
+            individual = self.client.get(reverse('verificar_pago_async', args=[abierto.pk]))
+
+        self.assertEqual(respuesta.status_code, 200)
+        estados = respuesta.json()['estados']
+        self.assertTrue(estados[str(pagado.pk)]['pagado'])
+        self.assertTrue(estados[str(abierto.pk)]['pagado'])
+        self.assertTrue(individual.json()['pagado'])
+        self.assertEqual(consultar_orden.call_count, 1)
+        abierto.refresh_from_db()
+        self.assertTrue(abierto.pagado)
+
+
+class SimuladorPayZenTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+
+    def _servidor(self, simulador):
+        servidor = simulador_payzen.crear_servidor(simulador, puerto=0)
+        hilo = threading.Thread(target=servidor.serve_forever, daemon=True)
+        hilo.start()
+        self.addCleanup(servidor.server_close)
+        self.addCleanup(servidor.shutdown)
+        payzen.cerrar_sesion()
+        self.addCleanup(payzen.cerrar_sesion)
+        return override_settings(**simulador_payzen.urls('127.0.0.1', servidor.server_port))
+
+    def test_flujo_completo_por_http(self):
+        simulador = simulador_payzen.SimuladorPayZen(pesos={'pagado': 1}, apertura=0.3, semilla=1)
+        with self._servidor(simulador), mock.patch('utils.email_utils.mail'), \
+                self.captureOnCommitCallbacks(execute=True):
+            link, errores = crud.create_link(self.cliente.pk, '1500', 1, 'credito', 'Simulado')
+            self.assertEqual(errores, [])
+            self.assertTrue(link.link.endswith(link.order_id))
+
+            # Recién creada: PSP_010, el link sigue esperando
+            self.assertEqual(crud.verificar_estado_pago(link.pk)['status'], 'Esperando Pago...')
+            time.sleep(0.35)
+            cache.clear()
+            estado = crud.verificar_estado_pago(link.pk)
+
+        self.assertTrue(estado['pagado'])
+        link.refresh_from_db()
+        self.assertEqual(link.cuotas_elegidas, 1)  # las cuotas de la orden, no las de la IPN grabada
+        self.assertEqual(simulador.contadores['crear'], 1)
+
+    def test_desenlaces_y_errores(self):
+        simulador = simulador_payzen.SimuladorPayZen(pesos=simulador_payzen.parsear_pesos('expirado=1'))
+        simulador.crear_orden({'orderId': 'PAY-E', 'amount': 1000})
+        codigo, cuerpo = simulador.consultar_orden('PAY-E')
+        self.assertEqual(codigo, 200)
+        self.assertEqual(cuerpo['answer']['transactions'][0]['detailedStatus'], 'EXPIRED')
+        self.assertEqual(cuerpo['answer']['transactions'][0]['amount'], 1000)
+        self.assertEqual(simulador.consultar_orden('PAY-NO')[1]['answer']['errorCode'], 'PSP_010')
+
+        simulador.error_http = 1.0
+        self.assertEqual(simulador.consultar_orden('PAY-E')[0], 503)
+        with self.assertRaises(ValueError):
+            simulador_payzen.parsear_pesos('aprobado=1')
+
+    def test_resumen_de_carga(self):
+        self.assertEqual(carga.percentil(list(range(1, 101)), 99), 99)
+        self.assertEqual(carga.percentil([5.0], 50), 5.0)
+        muestras = [{'operacion': 'estado', 'ms': float(ms), 'ok': ms != 100} for ms in range(1, 101)]
+        muestras.append({'operacion': 'ticket', 'ms': 300.0, 'ok': True})
+        resumen = carga.resumir(muestras, duracion=10)
+        self.assertEqual(resumen['estado']['p50_ms'], 50.0)
+        self.assertEqual(resumen['estado']['p95_ms'], 95.0)
+        self.assertEqual(resumen['estado']['errores'], 1)
+        self.assertEqual(resumen['total']['requests'], 101)
+        self.assertEqual(resumen['total']['max_ms'], 300.0)
+        self.assertEqual(resumen['ticket']['rps'], 0.1)
+
+
+@override_settings(PAYZEN_CIRCUITO_ACTIVO=True, PAYZEN_CIRCUITO_MIN_LLAMADAS=4, PAYZEN_CIRCUITO_TASA_ERROR=0.5,
+                   PAYZEN_CIRCUITO_LATENCIA=1.0, PAYZEN_CIRCUITO_TASA_LENTAS=0.5, PAYZEN_CIRCUITO_PAUSA=30,
+                   PAYZEN_REINTENTOS=0, PAYZEN_IPN_ACTIVO=False, PAYZEN_CONCILIADOR_ACTIVO=False,
+                   METRICAS_TOKEN='secreto')
+class CircuitoPayZenTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        self.link = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id='PAY-CIRC',
+                                            link='https://payzen.test/circ', status_detalle='WAITING_AUTHORISATION')
+
+    def _abrir(self):
+        sesion = mock.Mock()
+        sesion.post.side_effect = requests.exceptions.ConnectTimeout('sin respuesta')
+        with mock.patch('app1.payzen.get_sesion', return_value=sesion):
+            for _ in range(4):
+                with self.assertRaises(requests.exceptions.Timeout):
+                    payzen.consultar_orden('PAY-X')
+        return sesion
+
+    def test_abre_y_falla_rapido(self):
+        sesion = self._abrir()
+        self.assertEqual(payzen.circuito.estado, payzen.Circuito.ABIERTO)
+
+        with mock.patch('app1.payzen.get_sesion', return_value=sesion):
+            with self.assertRaises(payzen.CircuitoAbierto):
+                payzen.consultar_orden('PAY-X')
+            estado = crud.verificar_estado_pago(self.link.pk)
+            link, errores = crud.create_link(self.cliente.pk, '1000', 1, 'debito', 'x')
+
+        self.assertEqual(sesion.post.call_count, 4)  # las rechazadas no salen a la red
+        self.assertTrue(estado['degradado'])
+        self.assertEqual(estado['status'], 'WAITING_AUTHORISATION')
+        self.assertIsNone(link)
+        self.assertEqual(errores, [crud.MENSAJE_PASARELA_DEGRADADA])
+        self.assertEqual(payzen.circuito.metricas()['rechazadas_total'], 3)
+
+    def test_sonda_semiabierta(self):
+        self._abrir()
+        with override_settings(PAYZEN_CIRCUITO_PAUSA=0):
+            payzen.circuito._abierto_hasta = 0
+            self.assertTrue(payzen.circuito.permitir())   # la sonda
+            self.assertFalse(payzen.circuito.permitir())  # una sola a la vez
+            payzen.circuito.registrar(True, 0.1)
+        self.assertEqual(payzen.circuito.estado, payzen.Circuito.CERRADO)
+        self.assertTrue(payzen.circuito.permitir())
+
+    def test_abre_por_latencia(self):
+        for _ in range(4):
+            payzen.circuito.registrar(True, 2.5)
+        self.assertEqual(payzen.circuito.estado, payzen.Circuito.ABIERTO)
+        self.assertFalse(payzen.circuito.disponible())
+
+    def test_metricas(self):
+        self.assertEqual(self.client.get(reverse('circuito_payzen')).status_code, 401)
+        self._abrir()
+        respuesta = self.client.get(reverse('circuito_payzen'), {'formato': 'prometheus'},
+                                    HTTP_AUTHORIZATION='Bearer secreto')
+        self.assertEqual(respuesta.status_code, 200)
+        proceso = f'{{host="{socket.gethostname()}",pid="{os.getpid()}"}}'
+        self.assertIn(f'payzen_circuito_estado{proceso} 2', respuesta.content.decode())
+        self.assertIn(f'payzen_circuito_aperturas_total{proceso} 1', respuesta.content.decode())
+
+        datos = self.client.get(reverse('circuito_payzen'), HTTP_AUTHORIZATION='Bearer secreto').json()
+        self.assertEqual((datos['alcance'], datos['pid'], datos['estado']), ('proceso', os.getpid(), 'abierto'))
+
+
+class IdempotenciaTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        self.stub = PayZenStub()
+
+    def _crear(self, clave, monto='1000'):
+        with mock.patch('app1.payzen.get_sesion', return_value=self.stub):
+            return crud.create_link(self.cliente.pk, monto, 1, 'debito', 'Remera', clave)
+
+    def test_reenvio_devuelve_el_mismo_link(self):
+        primero, errores = self._crear('clave-1')
+        self.assertEqual(errores, [])
+        segundo, errores = self._crear('clave-1')
+        self.assertEqual(errores, [])
+        self.assertEqual(segundo.pk, primero.pk)
+        self.assertEqual(len(self.stub.pedidos), 1)
+
+        otro, _ = self._crear('clave-2')
+        self.assertNotEqual(otro.pk, primero.pk)
+        sin_clave, _ = self._crear(None)
+        self.assertIsNone(sin_clave.clave_idempotencia)
+        self.assertEqual(len(self.stub.pedidos), 3)
+
+        self.assertEqual(self._crear('clave-1', monto='1500'), (None, [crud.MENSAJE_CLAVE_REUSADA]))
+        self.assertEqual(len(self.stub.pedidos), 3)
+        self.assertEqual(self._crear('x' * 65), (None, ['Clave de idempotencia inválida.']))
+
+    def test_la_base_frena_la_carrera_entre_workers(self):
+        # Otro worker pasó por el mismo lock (cache no compartido) y guardó primero
+        otro = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('1000'), order_id='PAY-OTRO',
+                                       link='https://payzen.test/otro', clave_idempotencia='clave-1',
+                                       tipo_tarjeta='debito')
+        consultas = []
+
+        def link_por_clave(cliente_pk, clave):
+            consultas.append(clave)
+            return None if len(consultas) <= 2 else LinkPago.objects.get(pk=otro.pk)
+
+        with mock.patch('app1.crud._link_por_clave', side_effect=link_por_clave):
+            link, errores = self._crear('clave-1')
+        self.assertEqual((link.pk, errores), (otro.pk, []))
+        self.assertEqual(LinkPago.objects.filter(clave_idempotencia='clave-1').count(), 1)
+
+        consultas.clear()
+        with mock.patch('app1.crud._link_por_clave', side_effect=link_por_clave):
+            self.assertEqual(self._crear('clave-1', monto='900'), (None, [crud.MENSAJE_CLAVE_REUSADA]))
+
+    def test_envio_simultaneo_espera_al_primero(self):
+        # Otro request con la misma clave tiene el lock y guarda su link mientras este espera
+        cache.add(crud._clave_cache_idempotencia(self.cliente.pk, 'clave-1'), 1)
+
+        def termina_el_otro(_):
+            LinkPago.objects.create(cliente=self.cliente, monto=Decimal('1000'), order_id='PAY-OTRO',
+                                    link='https://payzen.test/otro', clave_idempotencia='clave-1',
+                                    tipo_tarjeta='debito')
+
+        with mock.patch('app1.crud.time.sleep', side_effect=termina_el_otro):
+            link, errores = self._crear('clave-1')
+        self.assertEqual((link.order_id, errores), ('PAY-OTRO', []))
+        self.assertEqual(self.stub.pedidos, [])
+
+        cache.add(crud._clave_cache_idempotencia(self.cliente.pk, 'clave-2'), 1)
+        with mock.patch('app1.crud._espera_idempotencia', return_value=0):
+            self.assertEqual(self._crear('clave-2'), (None, [crud.MENSAJE_CREACION_EN_CURSO]))
+        self.assertEqual(self.stub.pedidos, [])
+
+    def test_doble_envio_del_formulario(self):
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+        datos = {'monto': '1000', 'cuotas': '1', 'tipo_tarjeta': 'debito', 'confirm': '1',
+                 'clave_idempotencia': 'form-1'}
+        with mock.patch('app1.payzen.get_sesion', return_value=self.stub):
+            self.client.post(reverse('crear_link'), datos)
+            self.client.post(reverse('crear_link'), datos)
+        with mock.patch('app1.payzen.get_cliente_async', return_value=PayZenStubAsync()) as cliente_async:
+            self.client.post(reverse('generar_link_async'), datos)
+
+        self.assertEqual(LinkPago.objects.filter(cliente=self.cliente).count(), 1)
+        self.assertEqual(len(self.stub.pedidos), 1)
+        self.assertEqual(cliente_async.return_value.pedidos, [])
+
+
+class ExpiracionTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+
+    def _link(self, nombre, vence_en, **campos):
+        return LinkPago.objects.create(cliente=self.cliente, monto=Decimal('100'), order_id=f'PAY-{nombre}',
+                                       link=f'https://payzen.test/{nombre}',
+                                       expires_at=timezone.now() + vence_en, **campos)
+
+    @override_settings(PAYZEN_HORAS_EXPIRACION=24, PAYZEN_HORAS_EXPIRACION_POR_TARJETA={'debito': 2})
+    def test_vencimiento_por_tipo_de_tarjeta(self):
+        stub = PayZenStub()
+        with mock.patch('app1.payzen.get_sesion', return_value=stub):
+            link, errores = crud.create_link(self.cliente.pk, '1000', 1, 'debito', 'Remera')
+        self.assertEqual(errores, [])
+        self.assertAlmostEqual(link.expires_at, timezone.now() + timedelta(hours=2), delta=timedelta(minutes=1))
+        self.assertEqual(stub.pedidos[0]['expirationDate'], link.expires_at.isoformat(timespec='seconds'))
+        self.assertEqual(crud.horas_expiracion('credito'), 24)
+
+    def test_barrido_confirma_con_payzen_antes_de_expirar(self):
+        vencido = self._link('vencido', -timedelta(minutes=1))
+        otro = self._link('otro', -timedelta(minutes=5))
+        pagado_a_tiempo = self._link('a_tiempo', -timedelta(minutes=2))
+        vigente = self._link('vigente', timedelta(hours=1))
+        pagado = self._link('pagado', -timedelta(hours=1), pagado=True, status_detalle='CAPTURED')
+        abierto = self._link('abierto', -timedelta(hours=1), status_detalle='PENDING')
+
+        def consultar(order_id):
+            if order_id == pagado_a_tiempo.order_id:
+                return {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', order_id)}
+            return {'status': 'ERROR', 'answer': {'errorCode': 'PSP_010'}}
+
+        with mock.patch('app1.payzen.consultar_orden', side_effect=consultar) as consultar_orden, \
+                mock.patch('app1.crud.time.sleep'), mock.patch('utils.email_utils.mail'):
+            resumen = crud.expirar_vencidos(por_segundo=0)
+
+        self.assertEqual([c.args[0] for c in consultar_orden.call_args_list], ['PAY-otro', 'PAY-a_tiempo', 'PAY-vencido'])
+        self.assertEqual((resumen['expirados'], resumen['pagados']), (2, 1))
+        estados = dict(LinkPago.objects.values_list('pk', 'status_detalle'))
+        self.assertEqual(estados[vencido.pk], 'EXPIRED')
+        self.assertEqual(estados[otro.pk], 'EXPIRED')
+        self.assertEqual(estados[pagado_a_tiempo.pk], 'AUTHORISED')
+        self.assertEqual(estados[vigente.pk], 'INITIAL')
+        self.assertEqual(estados[pagado.pk], 'CAPTURED')
+        self.assertEqual(estados[abierto.pk], 'PENDING')
+
+    @override_settings(PAYZEN_IPN_ACTIVO=False, PAYZEN_CONCILIADOR_ACTIVO=False)
+    def test_polling_de_vencido_consulta_payzen(self):
+        vencido = self._link('vencido', -timedelta(minutes=1))
+        vigente = self._link('vigente', timedelta(hours=1))
+        with mock.patch('app1.payzen.consultar_orden',
+                        return_value={'status': 'ERROR', 'answer': {'errorCode': 'PSP_010'}}) as consultar_orden:
+            self.assertEqual(LinkPago.objects.get(pk=vencido.pk).status_detalle, 'INITIAL')
+            estados, _ = crud.verificar_estados_pago(self.cliente.pk, [vencido.pk, vigente.pk])
+            self.assertEqual(sorted(c.args[0] for c in consultar_orden.call_args_list), ['PAY-vencido', 'PAY-vigente'])
+        self.assertTrue(estados[vencido.pk]['anulado'])
+        self.assertFalse(estados[vigente.pk]['anulado'])
+        self.assertEqual(LinkPago.objects.get(pk=vencido.pk).status_detalle, 'EXPIRED')
+
+    @override_settings(PAYZEN_IPN_ACTIVO=False, PAYZEN_CONCILIADOR_ACTIVO=False)
+    def test_vencido_pagado_sobre_la_hora_no_se_expira(self):
+        vencido = self._link('vencido', -timedelta(minutes=1))
+        with mock.patch('app1.payzen.consultar_orden',
+                        return_value={'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', vencido.order_id)}) as consultar_orden, \
+                mock.patch('utils.email_utils.mail'):
+            self.assertTrue(crud.verificar_estado_pago(vencido.pk)['pagado'])
+        consultar_orden.assert_called_once_with('PAY-vencido')
+
+    @override_settings(PAYZEN_HORAS_GRACIA_EXPIRADOS=48)
+    def test_conciliacion_sigue_mirando_expirados_durante_la_gracia(self):
+        reciente = self._link('reciente', -timedelta(hours=3), status_detalle='EXPIRED')
+        self._link('viejo', -timedelta(hours=50), status_detalle='EXPIRED')
+        self._link('rechazado', -timedelta(hours=3), status_detalle='REFUSED')
+
+        ahora = timezone.now()
+        self.assertEqual([l.order_id for l in crud.links_a_conciliar(ahora, 10)], ['PAY-reciente'])
+
+        with mock.patch('app1.payzen.consultar_orden',
+                        return_value={'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', reciente.order_id)}), \
+                mock.patch('app1.crud.time.sleep'), mock.patch('utils.email_utils.mail'):
+            resumen = crud.conciliar_pagos_pendientes(limite=10, por_segundo=0)
+        self.assertEqual(resumen['pagados'], 1)
+        reciente.refresh_from_db()
+        self.assertTrue(reciente.pagado)
+
+
+class PdfTicketTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True, email='c@example.com')
+        self.link = LinkPago.objects.create(cliente=self.cliente, monto=Decimal('1000'), order_id='PAY-PDF',
+                                            link='https://payzen.test/pdf', pagado=True,
+                                            desglose_arancel=Decimal('30'), desglose_comision=Decimal('20'))
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+
+    def test_se_renderiza_una_vez_y_revalida_con_304(self):
+        url = reverse('ticket_pdf', args=[self.link.pk])
+        primera = self.client.get(url)
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(b''.join(primera.streaming_content), b'%PDF-1.7 ticket')
+        self.assertIn('Last-Modified', primera)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=primera['ETag']).status_code, 304)
+        self.assertEqual(self.client.get(url).status_code, 200)
+        nombre, datos, errores = crud.generate_pdf_for_link(self.link.pk, self.cliente.pk)
+        self.assertEqual((datos, errores), (b'%PDF-1.7 ticket', []))
+        self.assertEqual(self.renderizar.call_count, 1)
+
+    def test_cambio_de_contenido_genera_otra_version(self):
+        ruta, clave = crud.pdf_ticket(self.link)
+        self.link.auth_code = 'AUT-123'
+        self.link.save()
+        nueva, otra_clave = crud.pdf_ticket(self.link)
+
+        self.assertNotEqual(clave, otra_clave)
+        self.assertEqual(self.renderizar.call_count, 2)
+        # La versión anterior queda en disco: una descarga o un zip puede estar leyéndola
+        self.assertTrue(os.path.exists(ruta))
+
+        hace_dos_horas = time.time() - 7200
+        os.utime(ruta, (hace_dos_horas, hace_dos_horas))
+        self.assertEqual(pdfs.limpiar(3 * 3600), 0)
+        self.assertEqual(pdfs.limpiar(3600), 1)
+        self.assertEqual(os.listdir(os.path.dirname(nueva)), [os.path.basename(nueva)])
+
+    def test_limpieza_conserva_la_version_usada_mas_recientemente(self):
+        ruta, _ = crud.pdf_ticket(self.link)
+        self.link.auth_code = 'AUT-123'
+        self.link.save()
+        nueva, _ = crud.pdf_ticket(self.link)
+        hace_un_dia = time.time() - 86400
+        for archivo in (ruta, nueva):
+            os.utime(archivo, (hace_un_dia, hace_un_dia))
+
+        # El contenido vuelve al anterior: esa versión pasa a ser la vigente
+        self.link.auth_code = ''
+        self.link.save()
+        self.assertEqual(crud.pdf_ticket(self.link)[0], ruta)
+        self.assertEqual(os.path.getmtime(ruta), hace_un_dia)  # Last-Modified sin cambios
+        self.assertEqual(pdfs.limpiar(0), 1)
+        self.assertTrue(os.path.exists(ruta))
+        self.assertFalse(os.path.exists(nueva))
+        self.assertEqual(self.renderizar.call_count, 2)
+
+    def test_otro_comercio_no_ve_el_ticket(self):
+        otro = Cliente.objects.create(nombre='Otro', password='x', aprobado=True)
+        session = self.client.session
+        session['user_id'] = otro.pk
+        session.save()
+        self.assertEqual(self.client.get(reverse('ticket_pdf', args=[self.link.pk])).status_code, 404)
+        self.renderizar.assert_not_called()
+
+    def _confirmar_pago(self):
+        self.link.pagado = False
+        self.link.save()
+        respuesta = {'status': 'SUCCESS', 'answer': payzen.ipn_grabada('pagado', self.link.order_id)}
+        with self.captureOnCommitCallbacks(execute=True):
+            crud._aplicar_consulta(self.link, respuesta)
+
+    def test_pago_confirmado_envia_el_email_y_encola_solo_el_render(self):
+        with mock.patch('app1.pdfs.encolar') as encolar:
+            self._confirmar_pago()
+
+        # El email sale en el request aunque el trabajo de fondo no llegue a correr
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments, [])
+        self.renderizar.assert_not_called()
+        encolar.assert_called_once_with(crud._prerenderizar_ticket, self.link.pk)
+
+        crud._prerenderizar_ticket(self.link.pk)
+        respuesta = self.client.get(reverse('ticket_pdf', args=[self.link.pk]))
+        self.assertEqual(b''.join(respuesta.streaming_content), b'%PDF-1.7 ticket')
+        self.assertEqual(self.renderizar.call_count, 1)
+
+    def test_falla_del_render_no_afecta_el_email(self):
+        self.renderizar.side_effect = OSError('sin WeasyPrint')
+        with mock.patch('app1.pdfs.encolar', side_effect=lambda fn, *args: pdfs._en_fondo(fn, *args)):
+            self._confirmar_pago()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].attachments, [])
+
+
+class PoolRenderTests(SimpleTestCase):
+
+    def setUp(self):
+        self.addCleanup(pdfs._pool_web.cerrar)
+
+    @override_settings(PDF_PROCESOS=0)
+    def test_sin_procesos_renderiza_en_linea(self):
+        with mock.patch('app1.pdfs._renderizar_local', return_value=b'%PDF') as local, \
+                mock.patch('app1.pdfs.ProcessPoolExecutor') as crear:
+            self.assertEqual(pdfs.renderizar('<p>x</p>'), b'%PDF')
+        local.assert_called_once_with('<p>x</p>')
+        crear.assert_not_called()
+
+    @override_settings(PDF_PROCESOS=2, PDF_TIMEOUT=5)
+    def test_pool_roto_se_reemplaza(self):
+        roto = mock.Mock()
+        roto.submit.return_value.result.side_effect = BrokenProcessPool()
+        with mock.patch('app1.pdfs.ProcessPoolExecutor', return_value=roto) as crear:
+            with self.assertRaises(BrokenProcessPool):
+                pdfs.renderizar('<p>x</p>')
+            self.assertIsNone(pdfs._pool_web._ejecutor)
+            roto.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+            sano = mock.Mock()
+            sano.submit.return_value.result.return_value = b'%PDF'
+            crear.return_value = sano
+            self.assertEqual(pdfs.renderizar('<p>x</p>'), b'%PDF')
+
+        self.assertEqual(crear.call_args.kwargs['max_workers'], 2)
+        sano.submit.assert_any_call(pdfs._renderizar_local, '<p>x</p>')
+        sano.submit.return_value.result.assert_called_with(timeout=5)
+
+    @override_settings(PDF_PROCESOS=1, PDF_ZIP_PROCESOS=3)
+    def test_pool_propio_aparte_del_de_los_requests(self):
+        with mock.patch('app1.pdfs.ProcessPoolExecutor') as crear:
+            crear.return_value.submit.return_value.result.return_value = b'%PDF'
+            with pdfs.PoolDeRender('PDF_ZIP_PROCESOS') as pool:
+                self.assertEqual(pdfs.renderizar('<p>x</p>', pool=pool), b'%PDF')
+                propio = pool._ejecutor
+            self.assertIsNone(pdfs._pool_web._ejecutor)
+        self.assertEqual(crear.call_args.kwargs['max_workers'], 3)
+        propio.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        self.assertIsNone(pool._ejecutor)
+
+
+@override_settings(PDF_PROCESOS=2)
+class ExportacionZipTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        admin = User_admin.objects.create(nombre='admin', password='x')
+        session = self.client.session
+        session['user_admin_id'] = admin.pk
+        session.save()
+        self.ana = Cliente.objects.create(nombre='Ana Pérez', password='x', aprobado=True)
+        self.beto = Cliente.objects.create(nombre='Beto', password='x', aprobado=True)
+
+    def _link(self, cliente, order_id, **campos):
+        return LinkPago.objects.create(cliente=cliente, monto=Decimal('1000'), order_id=order_id,
+                                       link=f'https://payzen.test/{order_id}', **{'pagado': True, **campos})
+
+    def _zip(self, **filtros):
+        respuesta = self.client.get(reverse('liquidaciones'), {'exportar': 'zip', **filtros})
+        self.assertEqual(respuesta['Content-Type'], 'application/zip')
+        return zipfile.ZipFile(io.BytesIO(b''.join(respuesta.streaming_content)))
+
+    def test_zip_con_los_tickets_filtrados(self):
+        cacheado = self._link(self.ana, 'PAY-A1')
+        self._link(self.ana, 'PAY-A2')
+        self._link(self.beto, 'PAY-B1', auth_code='FALLA')
+        self._link(self.beto, 'PAY-B2', pagado=False)
+        cacheado.refresh_from_db()  # el HTML sale de los valores guardados (monto 1000.00)
+        crud.pdf_ticket(cacheado)
+        self.renderizar.reset_mock()
+
+        def renderizar(html, pool=None):
+            if 'FALLA' in html:
+                raise OSError('falla de render')
+            return b'%PDF-1.7 ticket'
+        self.renderizar.side_effect = renderizar
+
+        archivo = self._zip()
+        fecha = f"{cacheado.created_at:%Y-%m-%d}"
+        self.assertEqual(sorted(archivo.namelist()),
+                         [f'ana-perez/{fecha}_PAY-A1.pdf', f'ana-perez/{fecha}_PAY-A2.pdf', 'errores.txt'])
+        self.assertEqual(archivo.read(f'ana-perez/{fecha}_PAY-A2.pdf'), b'%PDF-1.7 ticket')
+        self.assertIn('PAY-B1', archivo.read('errores.txt').decode())
+        self.assertEqual(self.renderizar.call_count, 2)  # el cacheado no se vuelve a renderizar
+
+        self.assertEqual(sorted(self._zip(cliente_id=self.ana.pk).namelist()),
+                         [f'ana-perez/{fecha}_PAY-A1.pdf', f'ana-perez/{fecha}_PAY-A2.pdf'])
+
+    @override_settings(PDF_PROCESOS=1, PDF_ZIP_PROCESOS=3)
+    def test_renderiza_varios_tickets_a_la_vez_en_su_propio_pool(self):
+        for i in range(6):
+            self._link(self.ana, f'PAY-{i}')
+        lock = threading.Lock()
+        en_vuelo = {'ahora': 0, 'maximo': 0}
+        # Los tres primeros renders esperan a estar los tres en curso: de a uno se cortaría por timeout
+        juntos = threading.Barrier(3, timeout=5)
+        pools = set()
+
+        def renderizar(html, pool=None):
+            with lock:
+                en_vuelo['ahora'] += 1
+                en_vuelo['maximo'] = max(en_vuelo['maximo'], en_vuelo['ahora'])
+                en_vuelo['orden'] = orden = en_vuelo.get('orden', 0) + 1
+                pools.add(pool)
+            try:
+                if orden <= 3:
+                    juntos.wait()
+                return b'%PDF-1.7 ticket'
+            finally:
+                with lock:
+                    en_vuelo['ahora'] -= 1
+        self.renderizar.side_effect = renderizar
+
+        archivo = self._zip()
+
+        self.assertEqual(len(archivo.namelist()), 6)
+        self.assertNotIn('errores.txt', archivo.namelist())
+        self.assertEqual(en_vuelo['maximo'], 3)
+        [pool] = pools
+        self.assertEqual(pool.ajuste, 'PDF_ZIP_PROCESOS')
+        self.assertIsNot(pool, pdfs._pool_web)
+
+
+class ResumenMensualTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        marzo, abril = timezone.make_aware(timezone.datetime(2026, 3, 10)), timezone.make_aware(timezone.datetime(2026, 4, 2))
+        for order_id, monto, fecha, pagado in (('PAY-M1', '1000', marzo, True), ('PAY-M2', '500', marzo, True),
+                                               ('PAY-M3', '700', marzo, False), ('PAY-A1', '900', abril, True)):
+            link = LinkPago.objects.create(cliente=self.cliente, monto=Decimal(monto), order_id=order_id,
+                                           link=f'https://payzen.test/{order_id}', pagado=pagado,
+                                           commission_amount=Decimal('100'), receiver_amount=Decimal(monto) - 100,
+                                           desglose_arancel=Decimal('60'), desglose_comision=Decimal('40'))
+            LinkPago.objects.filter(pk=link.pk).update(created_at=fecha)
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+        self.url = reverse('resumen_mensual') + '?periodo=2026-03'
+
+    def test_un_pdf_con_filas_y_totales_del_mes(self):
+        primera = self.client.get(self.url)
+        self.assertEqual(primera.status_code, 200)
+        self.assertEqual(b''.join(primera.streaming_content), b'%PDF-1.7 ticket')
+        self.assertIn(f'Resumen_2026-03_{self.cliente.pk:05d}.pdf', primera['Content-Disposition'])
+
+        html = self.renderizar.call_args[0][0]
+        self.assertIn('$ 900.00', html)    # fila del primer pago
+        self.assertNotIn('$ 700.00', html)  # el impago no entra
+        self.assertIn('$ 1500.00', html)   # bruto del mes, sin el impago ni abril
+        self.assertIn('$ 1300.00', html)   # neto
+        self.assertIn('$ 120.00', html)    # arancel sumado
+        self.assertIn('2 operaciones', html)
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=primera['ETag']).status_code, 304)
+        self.assertEqual(self.renderizar.call_count, 1)
+
+    def test_se_regenera_solo_si_cambia_un_pago_del_periodo(self):
+        ruta, clave, _ = crud.resumen_mensual(self.cliente.pk, '2026-03')[0]
+        crud.resumen_mensual(self.cliente.pk, '2026-03')
+        LinkPago.objects.filter(order_id='PAY-A1').update(auth_code='AUT-ABRIL')
+        self.assertEqual(crud.resumen_mensual(self.cliente.pk, '2026-03')[0][1], clave)
+        self.assertEqual(self.renderizar.call_count, 1)
+
+        LinkPago.objects.filter(order_id='PAY-M2').update(auth_code='AUT-MARZO')
+        nueva, otra_clave, _ = crud.resumen_mensual(self.cliente.pk, '2026-03')[0]
+        self.assertNotEqual(otra_clave, clave)
+        self.assertEqual(self.renderizar.call_count, 2)
+        self.assertTrue(os.path.exists(ruta))
+        hace_un_dia = time.time() - 86400
+        os.utime(ruta, (hace_un_dia, hace_un_dia))
+        self.assertEqual(pdfs.limpiar(3600), 1)
+        self.assertEqual(os.listdir(os.path.dirname(nueva)), [os.path.basename(nueva)])
+
+    def test_periodos_invalidos_o_vacios_y_otro_comercio(self):
+        self.assertEqual(crud.resumen_mensual(self.cliente.pk, '2026-13'), (None, ['Período inválido, use el formato AAAA-MM.']))
+        self.assertEqual(self.client.get(reverse('resumen_mensual') + '?periodo=2026-05').status_code, 404)
+
+        otro = Cliente.objects.create(nombre='Otro', password='x', aprobado=True)
+        session = self.client.session
+        session['user_id'] = otro.pk
+        session.save()
+        self.assertEqual(self.client.get(self.url + f'&cliente_id={self.cliente.pk}').status_code, 404)
+        self.renderizar.assert_not_called()
+
+
+class SellosVersionTests(TestCase):
+    """Copias en memoria de app2 (tarifario, parámetros) frente a cambios hechos por otro worker."""
+
+    def setUp(self):
+        get_or_create_config()  # crearla renueva el sello: las pruebas parten de la fila ya creada
+
+    def _guardado_en_otro_worker(self, *nombres):
+        # Lo que ve este proceso cuando otro guarda: fila cambiada y sello renovado, sin señales acá
+        for nombre in nombres:
+            SelloVersion.objects.update_or_create(nombre=nombre, defaults={'version': uuid.uuid4().hex})
+
+    def test_tarifario_se_reconstruye_con_el_sello_de_la_base(self):
+        anterior = get_tarifario()
+        self.assertIs(get_tarifario(), anterior)
+
+        ParametroFinanciero.objects.update(comision_pago_tech_debito=Decimal('5.00'))
+        self._guardado_en_otro_worker(VERSION_CONFIG, VERSION_TARIFARIO)
+
+        actual = get_tarifario()
+        self.assertIsNot(actual, anterior)
+        self.assertGreater(actual.debito.total_pct, anterior.debito.total_pct)
+
+    def test_config_se_invalida_al_guardar(self):
+        config = get_or_create_config()
+        self.assertIs(get_or_create_config(), config)
+        config.arancel_plataforma = Decimal('2.50')
+        config.save()
+        self.assertIsNot(get_or_create_config(), config)
+        self.assertEqual(get_or_create_config().arancel_plataforma, Decimal('2.50'))
+
+    def test_config_ve_lo_guardado_por_otro_worker(self):
+        anterior = get_or_create_config()
+        ParametroFinanciero.objects.update(arancel_plataforma=Decimal('3.10'))
+        self.assertIs(get_or_create_config(), anterior)
+
+        self._guardado_en_otro_worker(VERSION_CONFIG)
+        self.assertEqual(get_or_create_config().arancel_plataforma, Decimal('3.10'))
+
+    def test_sello_se_lee_una_vez_por_request(self):
+        versionado.get_version(VERSION_TARIFARIO)
+        request_started.send(sender=self.__class__)
+        try:
+            with self.assertNumQueries(1):
+                primera = versionado.get_version(VERSION_TARIFARIO)
+                self.assertEqual(versionado.get_version(VERSION_TARIFARIO), primera)
+        finally:
+            request_finished.send(sender=self.__class__)
+        self._guardado_en_otro_worker(VERSION_TARIFARIO)
+        self.assertNotEqual(versionado.get_version(VERSION_TARIFARIO), primera)
+
+
+def guardar_tarifario_golden():
+    """Carga en la base la configuración de app2/benchmark_golden.json y devuelve los datos."""
+    datos = benchmark.cargar_golden()
+    CuotaConfig.objects.all().delete()
+    TarjetaCustom.objects.all().delete()
+    ParametroFinanciero.objects.all().delete()
+    ParametroFinanciero.objects.create(**datos['config'])
+    tarjetas = {valores['slug']: TarjetaCustom.objects.create(**valores) for valores in datos['tarjetas']}
+    for valores in datos['planes']:
+        valores = dict(valores)
+        slug = valores.pop('tarjeta', None)
+        CuotaConfig.objects.create(tarjeta_custom=tarjetas.get(slug), **valores)
+    return datos
+
+
+class TarifarioTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.datos = guardar_tarifario_golden()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+
+    def test_create_link_igual_a_la_formula_previa(self):
+        referencia = benchmark.importes_referencia(self.datos)
+        montos = ('0.05', '99.99', '1234.56', '9999999.99')
+        stub = PayZenStub()
+        with mock.patch('app1.payzen.get_sesion', return_value=stub):
+            for nombre, escenario in self.datos['escenarios'].items():
+                for monto in montos:
+                    link, errores = crud.create_link(
+                        self.cliente.pk, monto, escenario['cuotas'], escenario['tipo_tarjeta'], nombre
+                    )
+                    self.assertEqual(errores, [], nombre)
+                    link.refresh_from_db()
+                    esperado = referencia[nombre][monto]
+                    for campo in ('monto', 'commission_amount', 'receiver_amount', 'desglose_arancel',
+                                  'desglose_comision', 'desglose_tasa', 'desglose_iva_21',
+                                  'desglose_iva_105', 'desglose_cuota_valor'):
+                        self.assertEqual(getattr(link, campo), Decimal(esperado[campo]), f"{nombre} {monto} {campo}")
+                    self.assertEqual(stub.pedidos[-1]['amount'], int(Decimal(monto) * 100))
+
+    def test_mismos_errores_que_la_formula_previa(self):
+        with mock.patch('app1.payzen.get_sesion', return_value=PayZenStub()):
+            self.assertEqual(crud.create_link(self.cliente.pk, '100', 12, 'credito')[1],
+                             ['El plan de 12 cuotas no está habilitado actualmente.'])
+            self.assertEqual(crud.create_link(self.cliente.pk, '100', 6, 'custom_naranja_x')[1],
+                             ['No hay plan de 6 cuotas configurado para Naranja X.'])
+            self.assertEqual(crud.create_link(self.cliente.pk, '100', 1, 'custom_inexistente')[1],
+                             ['La tarjeta seleccionada no esta disponible.'])
+
+
+class CotizacionTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.datos = guardar_tarifario_golden()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+
+    def test_cotiza_cada_monto_contra_todos_los_planes_visibles(self):
+        respuesta = self.client.get(reverse('cotizar'), {'monto': ['1234.56', '15000']})
+        self.assertEqual(respuesta.status_code, 200)
+        cotizaciones = respuesta.json()['cotizaciones']
+        self.assertEqual([c['monto'] for c in cotizaciones], [1234.56, 15000.0])
+
+        referencia = benchmark.importes_referencia(self.datos)
+        escenarios = {(e['tipo_tarjeta'], e['cuotas']): nombre for nombre, e in self.datos['escenarios'].items()}
+        for cotizacion in cotizaciones:
+            planes = {(p['tipo_tarjeta'], p['cuotas']): p for p in cotizacion['planes']}
+            self.assertLessEqual(set(escenarios), set(planes))
+            monto = '1234.56' if cotizacion['monto'] == 1234.56 else '15000'
+            for clave, nombre in escenarios.items():
+                esperado = referencia[nombre][monto]
+                self.assertEqual(planes[clave]['comision'], float(esperado['commission_amount']), nombre)
+                self.assertEqual(planes[clave]['neto'], float(esperado['receiver_amount']), nombre)
+                self.assertEqual(planes[clave]['valor_cuota'], float(esperado['desglose_cuota_valor']), nombre)
+
+        # POST con JSON: mismo resultado que por GET
+        respuesta = self.client.post(reverse('cotizar'), json.dumps({'montos': ['1234.56', '15000']}),
+                                     content_type='application/json')
+        self.assertEqual(respuesta.json()['cotizaciones'], cotizaciones)
+
+    def test_plan_personalizado_solo_para_sus_usuarios(self):
+        otro = Cliente.objects.create(nombre='Otro', password='x', aprobado=True)
+        plan = CuotaConfig.objects.create(numero_cuota=12, nombre='12 cuotas', tasa_base=Decimal('30'),
+                                          alcance=CuotaConfig.ALCANCE_USUARIOS)
+        plan.usuarios_asignados.add(otro)
+
+        cuotas = [p['cuotas'] for p in self.client.get(reverse('cotizar'), {'monto': '100'}).json()['cotizaciones'][0]['planes']]
+        self.assertNotIn(12, cuotas)
+        plan.usuarios_asignados.add(self.cliente)
+        cuotas = [p['cuotas'] for p in self.client.get(reverse('cotizar'), {'monto': '100'}).json()['cotizaciones'][0]['planes']]
+        self.assertIn(12, cuotas)
+
+    def test_errores(self):
+        self.assertEqual(self.client.get(reverse('cotizar')).status_code, 400)
+        self.assertEqual(self.client.get(reverse('cotizar'), {'monto': 'abc'}).json()['errors'], ['Monto inválido.'])
+        self.assertEqual(self.client.get(reverse('cotizar'), {'monto': '-1'}).status_code, 400)
+        demasiados = {'monto': ['1'] * (crud.MAX_MONTOS_COTIZACION + 1)}
+        self.assertEqual(self.client.get(reverse('cotizar'), demasiados).status_code, 400)
+        respuesta = self.client.post(reverse('cotizar'), '{', content_type='application/json')
+        self.assertEqual(respuesta.json()['errors'], ['JSON inválido'])
+
+        self.client.session.flush()
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(reverse('cotizar'), {'monto': '100'}).status_code, 401)
+
+
+class MatrizTarifasTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.datos = guardar_tarifario_golden()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        session = self.client.session
+        session['user_id'] = self.cliente.pk
+        session.save()
+
+    def test_porcentajes_reproducen_create_link(self):
+        respuesta = self.client.get(reverse('matriz_tarifas'))
+        self.assertEqual(respuesta.status_code, 200)
+        planes = {(p['tipo_tarjeta'], p['cuotas']): p for p in respuesta.json()['planes']}
+
+        # Lo que hace la vista previa en el navegador: monto × porcentaje / 100, half-up al centavo
+        referencia = benchmark.importes_referencia(self.datos)
+        for nombre, escenario in self.datos['escenarios'].items():
+            porcentaje = Decimal(planes[(escenario['tipo_tarjeta'], escenario['cuotas'])]['porcentaje'])
+            for monto, esperado in referencia[nombre].items():
+                comision = (Decimal(monto) * porcentaje / 100).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                self.assertEqual(comision, Decimal(esperado['commission_amount']), f"{nombre} {monto}")
+
+    def test_etag_revalida_con_304_hasta_que_cambia_la_configuracion(self):
+        respuesta = self.client.get(reverse('matriz_tarifas'))
+        etag = respuesta['ETag']
+        self.assertEqual(etag, f'"{respuesta.json()["version"]}"')
+        self.assertIn('Last-Modified', respuesta)
+        self.assertIn('private', respuesta['Cache-Control'])
+        self.assertIn('no-cache', respuesta['Cache-Control'])
+        self.assertIn('Cookie', respuesta['Vary'])
+
+        respuesta = self.client.get(reverse('matriz_tarifas'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+        self.assertEqual(respuesta.content, b'')
+        self.assertEqual(respuesta['ETag'], etag)
+
+        config = ParametroFinanciero.objects.get()
+        config.comision_pago_tech = Decimal('4.50')
+        config.save()
+
+        respuesta = self.client.get(reverse('matriz_tarifas'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertNotEqual(respuesta['ETag'], etag)
+
+    def test_sin_sesion(self):
+        self.client.session.flush()
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(reverse('matriz_tarifas')).status_code, 401)
+
+
+class VisibilidadPlanTests(TestCase):
+
+    def setUp(self):
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        self.otro = Cliente.objects.create(nombre='Otro', password='x', aprobado=True)
+
+    def _visibles(self, cliente):
+        return admin_crud.ids_cuotas_visibles(cliente.pk)
+
+    def test_plan_global_activo_e_inactivo(self):
+        plan = CuotaConfig.objects.create(numero_cuota=3, nombre='3 cuotas', tasa_base=Decimal('8'))
+        self.assertIn(plan.pk, self._visibles(self.cliente))
+        nuevo = Cliente.objects.create(nombre='Nuevo', password='x')
+        self.assertIn(plan.pk, self._visibles(nuevo))
+
+        plan.activa = False
+        plan.save()
+        self.assertNotIn(plan.pk, self._visibles(self.cliente))
+        plan.activa = True
+        plan.save()
+        self.assertIn(plan.pk, self._visibles(self.cliente))
+
+    def test_asignaciones_desde_el_plan_y_desde_el_cliente(self):
+        plan = CuotaConfig.objects.create(numero_cuota=6, nombre='6 cuotas', tasa_base=Decimal('15'),
+                                          alcance=CuotaConfig.ALCANCE_USUARIOS)
+        self.assertEqual(self._visibles(self.cliente), set())
+
+        plan.usuarios_asignados.add(self.cliente)
+        self.assertEqual(self._visibles(self.cliente), {plan.pk})
+        self.assertEqual(self._visibles(self.otro), set())
+
+        self.otro.planes_personalizados.add(plan)
+        self.assertEqual(self._visibles(self.otro), {plan.pk})
+
+        plan.usuarios_asignados.remove(self.cliente)
+        self.assertEqual(self._visibles(self.cliente), set())
+        self.otro.planes_personalizados.clear()
+        self.assertEqual(self._visibles(self.otro), set())
+
+        plan.usuarios_asignados.add(self.cliente)
+        plan.alcance = CuotaConfig.ALCANCE_GLOBAL
+        plan.save()
+        self.assertEqual(self._visibles(self.otro), {plan.pk})
+
+    def test_slug_de_tarjeta_custom(self):
+        tarjeta = TarjetaCustom.objects.create(nombre='Naranja X', slug='naranja_x', acepta_cuotas=True)
+        plan = CuotaConfig.objects.create(numero_cuota=3, nombre='Naranja 3', tasa_base=Decimal('6'),
+                                          tarjeta_custom=tarjeta)
+        self.assertEqual(list(admin_crud.list_cuotas_para_tarjeta_custom(self.cliente.pk, 'naranja_x')), [plan])
+        self.assertEqual(list(admin_crud.list_cuotas_para_usuario(self.cliente.pk)), [])
+
+        tarjeta.slug = 'naranja'
+        tarjeta.save()
+        self.assertEqual(list(admin_crud.list_cuotas_para_tarjeta_custom(self.cliente.pk, 'naranja')), [plan])
+
+        tarjeta.delete()
+        self.assertEqual(list(admin_crud.list_cuotas_para_usuario(self.cliente.pk)), [plan])
+
+
+class ConfiguracionFinancieraTests(TestCase):
+
+    def setUp(self):
+        admin = User_admin.objects.create(nombre='admin', password='x')
+        session = self.client.session
+        session['user_admin_id'] = admin.pk
+        session.save()
+
+    def _agregar_planes(self, cantidad):
+        inicio = CuotaConfig.objects.count()
+        for i in range(inicio, inicio + cantidad):
+            cliente = Cliente.objects.create(nombre=f'Comercio {i}', password='x', aprobado=True)
+            tarjeta = TarjetaCustom.objects.create(nombre=f'Tarjeta {i}', slug=f'tarjeta_{i}', acepta_cuotas=True)
+            plan = CuotaConfig.objects.create(
+                numero_cuota=i + 2, nombre=f'Plan {i}', tasa_base=Decimal('5'),
+                alcance=CuotaConfig.ALCANCE_USUARIOS, tarjeta_custom=tarjeta if i % 2 else None,
+            )
+            plan.usuarios_asignados.add(cliente)
+
+    def test_consultas_constantes(self):
+        # sesión, admin, dos sellos de versión, asignaciones, planes, tarjetas, clientes y guardado de la sesión
+        self._agregar_planes(1)
+        self.client.get(reverse('configuracion_financiera'))
+        with self.assertNumQueries(11):
+            respuesta = self.client.get(reverse('configuracion_financiera'))
+        self.assertEqual(respuesta.status_code, 200)
+
+        self._agregar_planes(6)
+        self.client.get(reverse('configuracion_financiera'))
+        with self.assertNumQueries(11):
+            respuesta = self.client.get(reverse('configuracion_financiera'))
+        self.assertContains(respuesta, 'Plan 6')
+        self.assertContains(respuesta, 'Comercio 6')
+
+
+class TarifaCongeladaTests(PayZenTestCase):
+
+    def setUp(self):
+        super().setUp()
+        guardar_tarifario_golden()
+        self.cliente = Cliente.objects.create(nombre='Comercio', password='x', aprobado=True)
+        self.stub = PayZenStub()
+
+    def _crear(self, monto, cuotas=1, tipo='credito'):
+        with mock.patch('app1.payzen.get_sesion', return_value=self.stub):
+            link, errores = crud.create_link(self.cliente.pk, monto, cuotas, tipo, 'x')
+        self.assertEqual(errores, [])
+        return LinkPago.objects.get(pk=link.pk)
+
+    def test_links_con_la_misma_tarifa_comparten_la_fila(self):
+        primero = self._crear('1000')
+        segundo = self._crear('2500')
+        en_cuotas = self._crear('1000', cuotas=3)
+        self.assertEqual(primero.tarifa_id, segundo.tarifa_id)
+        self.assertNotEqual(primero.tarifa_id, en_cuotas.tarifa_id)
+        self.assertEqual(TarifaCongelada.objects.count(), 2)
+
+    def test_cambiar_la_configuracion_no_toca_la_tarifa_de_links_previos(self):
+        anterior = self._crear('1000')
+        congelada = anterior.tarifa
+        valores = model_to_dict(congelada)
+
+        config = ParametroFinanciero.objects.get()
+        config.comision_pago_tech = Decimal('5.00')
+        config.save()
+        nuevo = self._crear('1000')
+
+        self.assertNotEqual(nuevo.tarifa_id, anterior.tarifa_id)
+        self.assertGreater(nuevo.commission_amount, anterior.commission_amount)
+        congelada.refresh_from_db()
+        self.assertEqual(model_to_dict(congelada), valores)
+        # La tarifa congelada reproduce los importes del link sin leer la configuración actual
+        calculo = congelada.como_tarifa().calcular(anterior.monto)
+        self.assertEqual(calculo['commission_amount'], anterior.commission_amount)
+        self.assertEqual(calculo['receiver_amount'], anterior.receiver_amount)
+
+    def test_es_inmutable(self):
+        congelada = self._crear('1000').tarifa
+        congelada.total_pct = Decimal('1')
+        with self.assertRaises(ValueError):
+            congelada.save()
+        congelada.refresh_from_db()
+        self.assertNotEqual(congelada.total_pct, Decimal('1'))
+
+    def test_auditar_liquidaciones_recalcula_con_la_tarifa_congelada(self):
+        links = [self._crear(monto, cuotas) for monto, cuotas in (('1000', 1), ('2500.55', 3), ('0.99', 6))]
+        LinkPago.objects.filter(pk__in=[l.pk for l in links]).update(pagado=True)
+        # Un cambio de configuración posterior no afecta la auditoría
+        config = ParametroFinanciero.objects.get()
+        config.comision_pago_tech = Decimal('5.00')
+        config.save()
+        LinkPago.objects.filter(pk=links[1].pk).update(commission_amount=F('commission_amount') + Decimal('0.01'))
+
+        reporte, errores = crud.auditar_liquidaciones(f"{timezone.now():%Y-%m}", self.cliente.pk)
+
+        self.assertEqual(errores, [])
+        self.assertEqual((reporte['revisados'], reporte['con_diferencias'], reporte['sin_tarifa']), (3, 1, 0))
+        [diferencia] = reporte['diferencias']
+        self.assertEqual((diferencia['link_id'], diferencia['campo']), (links[1].pk, 'commission_amount'))
+        self.assertEqual(diferencia['recalculado'], links[1].commission_amount)
+        for campo in crud.CAMPOS_LIQUIDACION:
+            self.assertEqual(reporte['totales'][campo], sum(getattr(l, campo) for l in links), campo)
+
+    def test_auditar_liquidaciones_periodo_invalido(self):
+        self.assertEqual(crud.auditar_liquidaciones('2026-13'), (None, ['Período inválido, use el formato AAAA-MM.']))
@@ -11,7 +11,16 @@ urlpatterns = [
     path('logout/cliente', views.logout_cliente, name='logout_cliente'),
     path('descargar-ticket/<int:link_id>/', views.download_ticket, name='download_ticket'),
     path('ticket_pdf/<int:link_id>/', views.ticket_pdf, name='ticket_pdf'),
+    path('resumen-mensual/', views.resumen_mensual_pdf, name='resumen_mensual'),
+    path('api/cotizar/', views.cotizar_ajax, name='cotizar'),
+    path('api/tarifas/', views.matriz_tarifas_ajax, name='matriz_tarifas'),
+    path('api/links/masivo/', views.crear_links_masivo_ajax, name='crear_links_masivo'),
     path('verificar-pago-ajax/<int:link_id>/', views.verificar_estado_pago_ajax, name='verificar_pago_ajax'),
+    path('verificar-pagos-ajax/', views.verificar_estados_pago_ajax, name='verificar_pagos_ajax'),
+    path('crear-link/generar/', views.generar_link_async, name='generar_link_async'),
+    path('verificar-pago-async/<int:link_id>/', views.verificar_estado_pago_async_ajax, name='verificar_pago_async'),
+    path('verificar-pagos-async/', views.verificar_estados_pago_async_ajax, name='verificar_pagos_async'),
+    path('payzen/ipn/', views.ipn_payzen, name='ipn_payzen'),
     path('perfil/', views.gestion_perfil, name='perfil'),
     path('api/enviar-correo/', enviar_correo_vista, name='enviar_correo'),
     path('tyc/', views.tyc, name='tyc'),
@@ -3,16 +3,16 @@ from django.urls import reverse
 import django.contrib.messages as messages
 from django.contrib.auth.hashers import check_password  
 from .models import Cliente, LinkPago
-from . import crud
+from . import crud, payzen, pdfs
 from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
-from django.http import HttpResponse, Http404, JsonResponse
+from django.http import FileResponse, HttpResponse, Http404, JsonResponse
 from django.core.paginator import Paginator
 from django.template.loader import get_template
 from django.conf import settings
 from django.template.loader import render_to_string
-from weasyprint import HTML
 import tempfile
-from app2.models import ParametroFinanciero, CuotaConfig
+import uuid
+from app2.tarifario import get_tarifario
 import os
 import logging
 from app2 import crud as app2_crud
@@ -23,6 +23,8 @@ import json
 from utils.email_utils import mail
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 import re
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
@@ -265,14 +267,6 @@ def creacion_link(request):
 
     cliente = crud.get_cliente(user_id)
 
-    config = ParametroFinanciero.objects.first()
-    if not config:
-        logger.warning("Creación link — ParametroFinanciero no configurado, usando fallback")
-        config = ParametroFinanciero.objects.create()
-
-    planes_activos = app2_crud.list_cuotas_para_usuario(user_id)
-    logger.debug(f"Creación link — usuario={cliente.nombre} id={user_id} planes_activos={planes_activos.count()}")
-
     if request.method == 'POST':
 
         # --- CASO A: AJAX Preview ---
@@ -283,56 +277,19 @@ def creacion_link(request):
                 cuotas_num    = int(request.POST.get('cuotas', '1'))
                 tipo          = request.POST.get('tipo_tarjeta', 'credito')
 
-                if tipo == 'debito':
-                    cuotas_num = 1
-                    iva_f    = Decimal(str(config.iva)) / 100
-                    pt_eff   = Decimal(str(config.comision_pago_tech_debito)) * (1 + iva_f)
-                    ar_eff   = Decimal(str(config.arancel_plataforma_debito)) * (1 + iva_f)
-                    tasa_eff = Decimal('0')
-                else:
-                    # Buscar plan según tipo de tarjeta
-                    if tipo.startswith('custom_'):
-                        slug = tipo.replace('custom_', '')
-                        plan = app2_crud.list_cuotas_para_tarjeta_custom(
-                            user_id, slug
-                        ).filter(numero_cuota=cuotas_num).first()
-                    else:
-                        plan = app2_crud.list_cuotas_para_usuario(user_id).filter(
-                            numero_cuota=cuotas_num
-                        ).first()
-
-                    if plan and cuotas_num > 1:
-                        iva_val     = plan.iva_override              if plan.iva_override is not None              else config.iva
-                        iva_fin_val = plan.iva_financiacion_override if plan.iva_financiacion_override is not None else config.iva_financiacion
-                        com_val     = plan.com_credito_override      if plan.com_credito_override is not None      else config.comision_pago_tech
-                        ar_val      = plan.arancel_credito_override  if plan.arancel_credito_override is not None  else config.arancel_plataforma
-
-                        iva_f     = Decimal(str(iva_val))     / 100
-                        iva_fin_f = Decimal(str(iva_fin_val)) / 100
-
-                        tasa_eff = Decimal(str(plan.tasa_base)) * (1 + iva_fin_f) if plan.tasa_aplica_iva_fin else Decimal(str(plan.tasa_base))
-                        pt_eff   = Decimal(str(com_val))        * (1 + iva_f)     if plan.comision_aplica_iva  else Decimal(str(com_val))
-                        ar_eff   = Decimal(str(ar_val))         * (1 + iva_f)     if plan.comision_aplica_iva  else Decimal(str(ar_val))
-                    else:
-                        # Contado o fallback global
-                        iva_f    = Decimal(str(config.iva)) / 100
-                        pt_eff   = Decimal(str(config.comision_pago_tech)) * (1 + iva_f)
-                        ar_eff   = Decimal(str(config.arancel_plataforma)) * (1 + iva_f)
-                        tasa_eff = Decimal('0')
-
-                total_desc    = tasa_eff + pt_eff + ar_eff
-                descuento_pesos = (monto_cobrado * (total_desc / 100)).quantize(
-                    Decimal('0.01'), rounding=ROUND_HALF_UP
-                )
-                neto_vendedor = (monto_cobrado - descuento_pesos).quantize(
-                    Decimal('0.01'), rounding=ROUND_HALF_UP
+                tarifa, errores = get_tarifario().resolver(
+                    tipo, cuotas_num, app2_crud.ids_cuotas_visibles(user_id)
                 )
+                if errores or not tarifa.valida:
+                    return JsonResponse({'success': False, 'errors': errores})
+
+                calculo = tarifa.calcular(monto_cobrado)
 
                 return JsonResponse({
                     'success':     True,
-                    'monto_venta': float(monto_cobrado),    # lo que paga el cliente
-                    'comision':    float(descuento_pesos),  # descuento Payway
-                    'neto':        float(neto_vendedor)     # lo que recibe el vendedor
+                    'monto_venta': float(monto_cobrado),                  # lo que paga el cliente
+                    'comision':    float(calculo['commission_amount']),   # descuento Payway
+                    'neto':        float(calculo['receiver_amount'])      # lo que recibe el vendedor
                 })
             except Exception as e:
                 logger.error(f"Error en preview — usuario={user_id}: {e}")
@@ -349,7 +306,8 @@ def creacion_link(request):
                 f"tipo={tipo} cuotas={cuotas} descripcion='{desc}'"
             )
 
-            link_obj, errors = crud.create_link(user_id, monto_contado, int(cuotas), tipo, desc)
+            link_obj, errors = crud.create_link(user_id, monto_contado, int(cuotas), tipo, desc,
+                                                _clave_idempotencia(request))
 
             if not errors:
                 logger.info(
@@ -370,20 +328,21 @@ def creacion_link(request):
     paginator = Paginator(all_links, 10)
     page_obj = paginator.get_page(request.GET.get('page'))
     link_creado = request.session.pop('link_recien_creado', None)
-    tarjetas_custom = TarjetaCustom.objects.filter(activa=True).order_by('orden', 'nombre')
+    config = get_tarifario().config
 
     logger.debug(f"Creación link GET — usuario={user_id} total_links={all_links.count()}")
     
     from app2 import crud as admin_crud
     import json
-    planes_credito = admin_crud.list_cuotas_para_usuario(cliente.id)
+    planes_visibles = admin_crud.planes_visibles_por_tarjeta(cliente.id)
+    planes_credito = planes_visibles.get('', [])
 
     tarjetas_custom = TarjetaCustom.objects.filter(activa=True).order_by('orden', 'nombre')
 
     planes_por_tarjeta = {}
     for tc in tarjetas_custom:
         if tc.acepta_cuotas:
-            planes = admin_crud.list_cuotas_para_tarjeta_custom(cliente.id, tc.slug)
+            planes = planes_visibles.get(tc.slug, [])
             planes_por_tarjeta[tc.slug] = [
                 {'numero_cuota': p.numero_cuota, 'nombre': p.nombre}
                 for p in planes
@@ -392,16 +351,144 @@ def creacion_link(request):
     return render(request, 'creacion_link.html', {
         'user': cliente,
         'links': page_obj,
-        'planes': planes_activos,
         'link_creado': link_creado,
         'tarjetas_custom': tarjetas_custom,
         'config': config,
         'planes':            planes_credito,       # compatibilidad con el template actual
         'planes_por_tarjeta': json.dumps(planes_por_tarjeta),
-        'tarjetas_custom':   tarjetas_custom
+        'tarjetas_custom':   tarjetas_custom,
+        'payzen_async':      settings.PAYZEN_ASYNC,  # confirmación y polling por las vistas async
+        'clave_idempotencia': uuid.uuid4().hex,      # una por formulario: el doble envío no duplica el link
     })
 
 
+def _clave_idempotencia(request):
+    """Clave del formulario (campo oculto) o del header Idempotency-Key en llamadas por API."""
+    return request.POST.get('clave_idempotencia') or request.headers.get('Idempotency-Key') or None
+
+
+def cotizar_ajax(request):
+    """
+    Cotización en lote: GET ?monto=1000&monto=2500 o POST JSON {"montos": [...]}.
+    Devuelve comisión, neto y valor de cuota de cada plan visible para el comercio.
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({'success': False, 'errors': ['No autorizado']}, status=401)
+
+    if request.method == 'POST':
+        try:
+            datos = json.loads(request.body or b'{}')
+        except json.JSONDecodeError:
+            return JsonResponse({'success': False, 'errors': ['JSON inválido']}, status=400)
+        montos = datos.get('montos')
+        if montos is None and 'monto' in datos:
+            montos = [datos['monto']]
+        if not isinstance(montos, list):
+            montos = [montos] if montos is not None else []
+    else:
+        montos = request.GET.getlist('monto')
+
+    cotizaciones, errors = crud.cotizar_montos(user_id, montos)
+    if errors:
+        return JsonResponse({'success': False, 'errors': errors}, status=400)
+
+    return JsonResponse({'success': True, 'cotizaciones': cotizaciones})
+
+
+def matriz_tarifas_ajax(request):
+    """
+    Matriz de tasas del comercio para la vista previa de creacion_link.
+    Se sirve con ETag / Last-Modified y Cache-Control: private, no-cache, así el
+    navegador la revalida con un 304 en vez de descargarla o cotizar cada cambio.
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({'success': False, 'errors': ['No autorizado']}, status=401)
+
+    matriz, errors = crud.matriz_tarifas(user_id)
+    if errors:
+        return JsonResponse({'success': False, 'errors': errors}, status=404)
+
+    etag = f'"{matriz["version"]}"'
+    last_modified = int(matriz['modificado'].timestamp())
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse({
+            'success': True,
+            'version': matriz['version'],
+            'planes':  matriz['planes'],
+        })
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def crear_links_masivo_ajax(request):
+    """
+    Creación masiva de links. Acepta un archivo 'archivo' (.csv o .json) por multipart,
+    o el cuerpo directo como JSON {"filas": [...]} / text/csv.
+    Devuelve el reporte por fila de crud.create_links_masivo.
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({'success': False, 'errors': ['No autorizado']}, status=401)
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'errors': ['Método no permitido']}, status=405)
+
+    archivo = request.FILES.get('archivo')
+    try:
+        if archivo:
+            contenido = archivo.read().decode('utf-8-sig')
+            formato = 'json' if archivo.name.lower().endswith('.json') else 'csv'
+        else:
+            contenido = request.body.decode('utf-8-sig')
+            formato = 'csv' if 'csv' in (request.content_type or '') else 'json'
+    except UnicodeDecodeError:
+        return JsonResponse({'success': False, 'errors': ['El archivo debe estar en UTF-8.']}, status=400)
+
+    filas, errors = crud.parsear_filas_masivas(contenido, formato)
+    if not errors:
+        reporte, errors = crud.create_links_masivo(user_id, filas)
+    if errors:
+        return JsonResponse({'success': False, 'errors': errors}, status=400)
+
+    creados = sum(1 for r in reporte if r['ok'])
+    logger.info(f"Creación masiva — usuario={user_id} filas={len(reporte)} creados={creados}")
+    return JsonResponse({
+        'success':    True,
+        'creados':    creados,
+        'rechazados': len(reporte) - creados,
+        'filas':      reporte,
+    })
+
+
+_MENSAJES_ESTADO = {
+    'AUTHORISED': 'Pago Autorizado',
+    'CAPTURED': 'Pago Exitoso',
+    'REFUSED': 'Pago Rechazado por el Banco',
+    'CANCELLED': 'Pago Cancelado por el Usuario',
+    'EXPIRED': 'El link ha expirado',
+    'PENDING': 'Esperando pago...',
+    'ABANDONED': 'El cliente abandonó el pago'
+}
+
+
+def _estado_json(link_id, resultado_crud):
+    return {
+        'pagado': resultado_crud['pagado'],
+        'anulado': resultado_crud['anulado'],
+        'status_raw': resultado_crud['status'],
+        'status_txt': _MENSAJES_ESTADO.get(resultado_crud['status'], resultado_crud['status']),
+        'cuotas': resultado_crud['cuotas'],
+        'degradado': resultado_crud.get('degradado', False),  # PayZen no disponible: último estado conocido
+        'id': link_id
+    }
+
+
 def verificar_estado_pago_ajax(request, link_id):
     user_id = request.session.get('user_id')
     if not user_id:
@@ -411,7 +498,10 @@ def verificar_estado_pago_ajax(request, link_id):
     logger.debug(f"Verificando estado de pago — link_id={link_id} usuario={user_id}")
 
     resultado_crud = crud.verificar_estado_pago(link_id)
+    return _respuesta_estado(link_id, user_id, resultado_crud)
+
 
+def _respuesta_estado(link_id, user_id, resultado_crud):
     logger.debug(
         f"Resultado verificación — link_id={link_id} "
         f"pagado={resultado_crud['pagado']} anulado={resultado_crud['anulado']} "
@@ -423,28 +513,140 @@ def verificar_estado_pago_ajax(request, link_id):
     elif resultado_crud['anulado']:
         logger.warning(f"Pago anulado/rechazado — link_id={link_id} usuario={user_id} status={resultado_crud['status']}")
 
-    mensajes = {
-        'AUTHORISED': 'Pago Autorizado',
-        'CAPTURED': 'Pago Exitoso',
-        'REFUSED': 'Pago Rechazado por el Banco',
-        'CANCELLED': 'Pago Cancelado por el Usuario',
-        'EXPIRED': 'El link ha expirado',
-        'PENDING': 'Esperando pago...',
-        'ABANDONED': 'El cliente abandonó el pago'
-    }
+    return JsonResponse(_estado_json(link_id, resultado_crud))
+
+
+def verificar_estados_pago_ajax(request):
+    """
+    Estado de varios links en una sola llamada: GET ?id=1&id=2 o POST JSON {"ids": [...]}.
+    Responde {"estados": {id: {...}}} con el mismo formato que verificar_estado_pago_ajax.
+    """
+    user_id = request.session.get('user_id')
+    if not user_id:
+        return JsonResponse({'error': 'No autorizado'}, status=401)
+
+    ids, error = _ids_pedidos(request)
+    if error:
+        return error
 
-    estado_texto = mensajes.get(resultado_crud['status'], resultado_crud['status'])
+    estados, errors = crud.verificar_estados_pago(user_id, ids)
+    return _respuesta_estados(user_id, estados, errors)
 
+
+def _ids_pedidos(request):
+    if request.method == 'POST':
+        try:
+            ids = json.loads(request.body or b'{}').get('ids') or []
+        except (json.JSONDecodeError, AttributeError):
+            return None, JsonResponse({'error': 'JSON inválido'}, status=400)
+        if not isinstance(ids, list):
+            ids = [ids]
+        return ids, None
+    return request.GET.getlist('id'), None
+
+
+def _respuesta_estados(user_id, estados, errors):
+    if errors:
+        return JsonResponse({'error': errors[0]}, status=400)
+
+    logger.debug(f"Verificación en lote — usuario={user_id} links={len(estados)}")
     return JsonResponse({
-        'pagado': resultado_crud['pagado'],
-        'anulado': resultado_crud['anulado'],
-        'status_raw': resultado_crud['status'],
-        'status_txt': estado_texto,
-        'cuotas': resultado_crud['cuotas'],
-        'id': link_id
+        'estados': {str(link_id): _estado_json(link_id, r) for link_id, r in estados.items()}
     })
 
 
+# ── Vistas async (ASGI, PAYZEN_ASYNC) ─────────────────────────────────────────
+# Mismo contrato que las vistas de arriba, pero la espera a PayZen no ocupa un
+# worker. La sesión se lee con aget(); el ORM corre en crud vía sync_to_async.
+
+async def generar_link_async(request):
+    """Confirmación del formulario de creacion_link (campo 'confirm')."""
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        return redirect('login_cliente')
+    if request.method != 'POST':
+        return redirect('crear_link')
+
+    monto_contado = request.POST.get('monto', '').strip()
+    cuotas = request.POST.get('cuotas', '1')
+    tipo = request.POST.get('tipo_tarjeta', 'credito')
+    desc = request.POST.get('descripcion', '').strip()
+
+    logger.info(
+        f"Generando link (async) — usuario={user_id} monto={monto_contado} "
+        f"tipo={tipo} cuotas={cuotas} descripcion='{desc}'"
+    )
+
+    link_obj, errors = await crud.create_link_async(user_id, monto_contado, int(cuotas), tipo, desc,
+                                                    _clave_idempotencia(request))
+
+    if errors:
+        logger.error(f"Error generando link — usuario={user_id} errores={errors}")
+        for e in errors:
+            messages.error(request, e)
+        return redirect('crear_link')
+
+    logger.info(
+        f"Link generado OK — usuario={user_id} order_id={link_obj.order_id} "
+        f"monto_bruto={link_obj.monto} neto={link_obj.receiver_amount} "
+        f"comision={link_obj.commission_amount}"
+    )
+    request.session['link_recien_creado'] = {'url': link_obj.link}
+    messages.success(request, "¡Enlace de pago generado con éxito!")
+    return redirect('crear_link')
+
+
+async def verificar_estado_pago_async_ajax(request, link_id):
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        logger.warning(f"Verificación de pago sin sesión — link_id={link_id}")
+        return JsonResponse({'error': 'No autorizado'}, status=401)
+
+    resultado_crud = await crud.verificar_estado_pago_async(link_id)
+    return _respuesta_estado(link_id, user_id, resultado_crud)
+
+
+async def verificar_estados_pago_async_ajax(request):
+    user_id = await request.session.aget('user_id')
+    if not user_id:
+        return JsonResponse({'error': 'No autorizado'}, status=401)
+
+    ids, error = _ids_pedidos(request)
+    if error:
+        return error
+
+    estados, errors = await crud.verificar_estados_pago_async(user_id, ids)
+    return _respuesta_estados(user_id, estados, errors)
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def ipn_payzen(request):
+    """
+    IPN de PayZen: POST form-urlencoded con kr-answer (JSON V4/Payment) firmado con
+    HMAC-SHA256 (kr-hash). PayZen reintenta mientras no reciba 200; las repetidas
+    no tienen efecto.
+    """
+    kr_answer = request.POST.get('kr-answer', '')
+    firma_ok = payzen.verificar_firma(
+        kr_answer,
+        request.POST.get('kr-hash', ''),
+        request.POST.get('kr-hash-key', ''),
+        request.POST.get('kr-hash-algorithm', ''),
+    )
+    if not firma_ok:
+        logger.warning(f"IPN PayZen con firma inválida — ip={request.META.get('REMOTE_ADDR')}")
+        return HttpResponse('Firma inválida', status=400, content_type='text/plain')
+
+    resultado, errors = crud.procesar_ipn(kr_answer)
+    if errors:
+        # Firmada por PayZen pero sin nada que aplicar (p. ej. una orden de otro entorno):
+        # un 400 solo haría que la reintente. Se registra y se responde 200.
+        logger.warning(f"IPN PayZen ignorada — {errors[0]}")
+        return HttpResponse(f"IGNORADA {errors[0]}", content_type='text/plain')
+
+    return HttpResponse(f"OK {resultado['status']}", content_type='text/plain')
+
+
 def logout_cliente(request):
     user_id = request.session.get('user_id')
     logger.info(f"Logout — usuario id={user_id}")
@@ -453,6 +655,11 @@ def logout_cliente(request):
 
 
 def ticket_pdf(request, link_id):
+    """
+    Ticket de liquidación en PDF. Se renderiza una vez por versión del contenido
+    (crud.pdf_ticket) y se sirve del disco con ETag / Last-Modified, así las
+    visitas repetidas responden 304 o el archivo sin pasar por WeasyPrint.
+    """
     user_id       = request.session.get('user_id')
     user_admin_id = request.session.get('user_admin_id')
 
@@ -465,70 +672,24 @@ def ticket_pdf(request, link_id):
     try:
         # Admin puede ver el PDF de cualquier cliente
         # Cliente solo puede ver sus propios PDFs
+        links = LinkPago.objects.select_related('cliente', 'tarifa')
         if user_admin_id:
-            link = LinkPago.objects.get(id=link_id)
-        else:
-            link = LinkPago.objects.get(id=link_id, cliente_id=user_id)
-            
-        config = ParametroFinanciero.objects.first()
-
-        if not config:
-            return HttpResponse("Configuración financiera no encontrada.", status=500)
-
-        monto = Decimal(str(link.monto))
-
-        # ── Leer desglose congelado directamente de la DB ──────────────
-        # Si el link fue creado antes de esta migración, los campos
-        # tendrán valor 0 — en ese caso recalculamos como fallback
-        tiene_desglose = link.desglose_arancel + link.desglose_comision + link.desglose_tasa > 0
-
-        if tiene_desglose:
-            ar_monto    = link.desglose_arancel
-            com_monto   = link.desglose_comision
-            tasa_monto  = link.desglose_tasa
-            iva_21      = link.desglose_iva_21
-            iva_105     = link.desglose_iva_105
-            cuota_valor = link.desglose_cuota_valor
-            logger.debug(f"PDF — usando desglose congelado de DB — link_id={link_id}")
+            link = links.get(id=link_id)
         else:
-            # Fallback para links anteriores a la migración
-            logger.warning(f"PDF — desglose no guardado, recalculando — link_id={link_id}")
-            total_commission = Decimal(str(link.commission_amount))
-            cuota_valor = (monto / link.cuotas_elegidas).quantize(Decimal('0.01'), ROUND_HALF_UP)
-            ar_monto    = (total_commission / 3).quantize(Decimal('0.01'), ROUND_HALF_UP)
-            tasa_monto  = (total_commission / 3).quantize(Decimal('0.01'), ROUND_HALF_UP)
-            com_monto   = total_commission - ar_monto - tasa_monto
-            iva_21      = Decimal('0.00')
-            iva_105     = Decimal('0.00')
-
-        logger.debug(
-            f"PDF — ar={ar_monto} com={com_monto} tasa={tasa_monto} "
-            f"iva_21={iva_21} iva_105={iva_105}"
-        )
-
-        context = {
-            'link':     link,
-            'cliente':  link.cliente,
-            'config':   config,
-            'desglose': {
-                'arancel':     ar_monto,
-                'servicio':    com_monto,
-                'costo_finan': tasa_monto,
-                'iva_21':      iva_21,
-                'iva_105':     iva_105,
-                'cuota_valor': cuota_valor,
-            },
-            'liq_nro':  link.auth_code if link.auth_code else f"00{link.id}",
-            'lote_nro': link.lote_number if link.lote_number else "001",
-        }
-
-        html_string = render_to_string('ticket_pdf.html', context)
-        html        = HTML(string=html_string, base_url=request.build_absolute_uri())
-        pdf_file    = html.write_pdf()
-
-        response = HttpResponse(pdf_file, content_type='application/pdf')
-        filename  = f"Liquidacion_{link.auth_code if link.auth_code else link.id}.pdf"
-        response['Content-Disposition'] = f'inline; filename="{filename}"'
+            link = links.get(id=link_id, cliente_id=user_id)
+
+        ruta, clave = crud.pdf_ticket(link)
+        etag = f'"{clave}"'
+        last_modified = int(os.path.getmtime(ruta))
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = FileResponse(open(ruta, 'rb'), content_type='application/pdf')
+            response['Content-Disposition'] = f'inline; filename="{crud.nombre_pdf_ticket(link)}"'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
         return response
 
     except LinkPago.DoesNotExist:
@@ -537,6 +698,48 @@ def ticket_pdf(request, link_id):
         logger.exception(f"PDF — error inesperado — link_id={link_id}: {e}")
         return HttpResponse(f"Error interno: {str(e)}", status=500)
 
+def resumen_mensual_pdf(request):
+    """
+    Resumen mensual de liquidaciones en PDF (?periodo=AAAA-MM, por defecto el mes en
+    curso). Se sirve del almacén de PDFs con ETag / Last-Modified como ticket_pdf; el
+    admin elige el comercio con ?cliente_id=.
+    """
+    user_id       = request.session.get('user_id')
+    user_admin_id = request.session.get('user_admin_id')
+
+    if not user_id and not user_admin_id:
+        return redirect('login_cliente')
+
+    periodo    = request.GET.get('periodo') or f"{timezone.localdate():%Y-%m}"
+    cliente_id = request.GET.get('cliente_id') if user_admin_id else user_id
+    if not str(cliente_id or '').isdigit():
+        return HttpResponse("Indique el comercio del resumen.", status=404)
+
+    logger.info(f"Resumen mensual — cliente={cliente_id} período={periodo} admin={user_admin_id}")
+
+    try:
+        resumen, errors = crud.resumen_mensual(int(cliente_id), periodo)
+        if errors:
+            return HttpResponse(errors[0], status=404)
+
+        ruta, clave, nombre = resumen
+        etag = f'"{clave}"'
+        last_modified = int(os.path.getmtime(ruta))
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = FileResponse(open(ruta, 'rb'), content_type='application/pdf')
+            response['Content-Disposition'] = f'inline; filename="{nombre}"'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+        return response
+
+    except Exception as e:
+        logger.exception(f"Resumen mensual — error inesperado — cliente={cliente_id} período={periodo}: {e}")
+        return HttpResponse(f"Error interno: {str(e)}", status=500)
+
 def download_ticket(request, link_id):
     user_id = request.session.get('user_id')
     if not user_id:
@@ -839,7 +1042,6 @@ def finalizar_chat_cliente(request):
         try:
             from utils.email_utils import mail_con_pdf
             from django.template.loader import render_to_string
-            from weasyprint import HTML
 
             # Generar PDF
             html_pdf = render_to_string('emails/resumen_chat_pdf.html', {
@@ -848,7 +1050,7 @@ def finalizar_chat_cliente(request):
                 'total_mensajes': total,
                 'mensajes':       mensajes_lista,
             })
-            pdf_bytes = HTML(string=html_pdf).write_pdf()
+            pdf_bytes = pdfs.renderizar(html_pdf)
             pdf_nombre = f"resumen_chat_{cliente_nombre.replace(' ', '_')}_{fecha_cierre[:10].replace('/', '-')}.pdf"
 
             # Contexto para el email
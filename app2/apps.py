@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class App2Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app2'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,298 @@
+"""
+Micro-benchmark del tarifario con valores de referencia (golden).
+
+Arma un Tarifario en memoria a partir de benchmark_golden.json — sin base de
+datos — y mide cada rama de create_link: débito, crédito en 1 pago, crédito en
+cuotas con overrides y tarjeta custom con y sin cuotas. Antes de medir se
+comparan los importes contra los valores guardados en el mismo archivo, así
+una optimización no puede cambiar montos sin que se note. Esos valores salen
+de importes_referencia(), una copia congelada de la fórmula previa al Tarifario.
+
+Se corre con `python manage.py benchmark_tarifario` (ver app2/management).
+"""
+import json
+import platform
+import random
+import statistics
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import django
+from django.utils import timezone
+
+from .models import CuotaConfig, ParametroFinanciero, TarjetaCustom
+from .punto_fijo import centavos_a_decimal, decimal_a_centavos
+from .tarifario import Tarifario
+
+RUTA_GOLDEN = Path(__file__).with_name('benchmark_golden.json')
+FORMATO = 1  # versión del JSON de resultados
+
+CAMPOS = (
+    'commission_amount', 'receiver_amount',
+    'desglose_arancel', 'desglose_comision', 'desglose_tasa',
+    'desglose_iva_21', 'desglose_iva_105', 'desglose_cuota_valor',
+)
+
+
+def cargar_golden(ruta=RUTA_GOLDEN) -> Dict[str, Any]:
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
+
+
+def construir_tarifario(datos: Dict[str, Any]) -> Tarifario:
+    """Tarifario a partir de instancias sin guardar de los modelos."""
+    config = ParametroFinanciero(**datos['config'])
+    tarjetas = {}
+    for valores in datos['tarjetas']:
+        tarjetas[valores['slug']] = TarjetaCustom(**valores)
+
+    planes = []
+    for valores in datos['planes']:
+        valores = dict(valores)
+        slug = valores.pop('tarjeta', None)
+        plan = CuotaConfig(**valores)
+        plan.tarjeta_custom = tarjetas[slug] if slug else None
+        planes.append(plan)
+    return Tarifario(config, planes, list(tarjetas.values()), version='benchmark')
+
+
+def calcular_escenarios(datos: Dict[str, Any], tarifario: Optional[Tarifario] = None) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """{escenario: {monto: {campo: importe}}} con los montos de referencia."""
+    tarifario = tarifario or construir_tarifario(datos)
+    resultado = {}
+    for nombre, escenario in datos['escenarios'].items():
+        tarifa, errores = tarifario.resolver(escenario['tipo_tarjeta'], escenario['cuotas'])
+        if errores:
+            raise ValueError(f"escenario {nombre}: {errores}")
+        resultado[nombre] = {
+            monto: {campo: str(valor) for campo, valor in tarifa.calcular(Decimal(monto)).items()}
+            for monto in datos['montos']
+        }
+    return resultado
+
+
+def _override(plan: Dict[str, Any], campo: str, defecto):
+    return plan[campo] if plan.get(campo) is not None else defecto
+
+
+def _importes_base(datos: Dict[str, Any], tipo_tarjeta: str, cuotas: int, monto) -> Dict[str, Decimal]:
+    """
+    Copia congelada del cálculo de create_link anterior al Tarifario: misma
+    selección de plan, mismos Decimal(str(...)) y mismos redondeos. No se toca
+    al optimizar; es la referencia contra la que se generan los golden.
+    """
+    config = datos['config']
+    plan = None
+    if tipo_tarjeta == 'debito':
+        cuotas = 1
+        iva_f    = Decimal(str(config['iva'])) / 100
+        pt_eff   = Decimal(str(config['comision_pago_tech_debito'])) * (1 + iva_f)
+        ar_eff   = Decimal(str(config['arancel_plataforma_debito'])) * (1 + iva_f)
+        tasa_eff = Decimal('0')
+    elif tipo_tarjeta.startswith('custom_'):
+        slug = tipo_tarjeta.replace('custom_', '')
+        tc = next(t for t in datos['tarjetas'] if t['slug'] == slug and t['activa'])
+        if tc['acepta_cuotas'] and cuotas > 1:
+            plan = next(p for p in datos['planes']
+                        if p['numero_cuota'] == cuotas and p['activa'] and p.get('tarjeta') == slug)
+            iva_val     = _override(plan, 'iva_override',              tc['iva'])
+            iva_fin_val = _override(plan, 'iva_financiacion_override', tc['iva'])
+            com_val     = _override(plan, 'com_credito_override',      tc['comision'])
+            ar_val      = _override(plan, 'arancel_credito_override',  tc['arancel'])
+        else:
+            cuotas = 1
+            iva_f    = Decimal(str(tc['iva'])) / 100
+            pt_eff   = Decimal(str(tc['comision'])) * (1 + iva_f) if tc['aplica_iva'] else Decimal(str(tc['comision']))
+            ar_eff   = Decimal(str(tc['arancel']))  * (1 + iva_f) if tc['aplica_iva'] else Decimal(str(tc['arancel']))
+            tasa_eff = Decimal('0')
+    elif cuotas > 1:
+        plan = next(p for p in datos['planes']
+                    if p['numero_cuota'] == cuotas and p['activa'] and not p.get('tarjeta'))
+        iva_val     = _override(plan, 'iva_override',              config['iva'])
+        iva_fin_val = _override(plan, 'iva_financiacion_override', config['iva_financiacion'])
+        com_val     = _override(plan, 'com_credito_override',      config['comision_pago_tech'])
+        ar_val      = _override(plan, 'arancel_credito_override',  config['arancel_plataforma'])
+    else:
+        iva_f    = Decimal(str(config['iva'])) / 100
+        pt_eff   = Decimal(str(config['comision_pago_tech'])) * (1 + iva_f)
+        ar_eff   = Decimal(str(config['arancel_plataforma'])) * (1 + iva_f)
+        tasa_eff = Decimal('0')
+
+    if plan:
+        # Valores por defecto del modelo CuotaConfig para los toggles
+        comision_aplica_iva = plan.get('comision_aplica_iva', True)
+        tasa_aplica_iva_fin = plan.get('tasa_aplica_iva_fin', True)
+        iva_f     = Decimal(str(iva_val))     / 100
+        iva_fin_f = Decimal(str(iva_fin_val)) / 100
+        tasa_eff = Decimal(str(plan['tasa_base'])) * (1 + iva_fin_f) if tasa_aplica_iva_fin else Decimal(str(plan['tasa_base']))
+        pt_eff   = Decimal(str(com_val))           * (1 + iva_f)     if comision_aplica_iva else Decimal(str(com_val))
+        ar_eff   = Decimal(str(ar_val))            * (1 + iva_f)     if comision_aplica_iva else Decimal(str(ar_val))
+
+    monto_cobrado = Decimal(str(monto))
+    total_desc_pct = tasa_eff + pt_eff + ar_eff
+    commission_amount = (monto_cobrado * (total_desc_pct / 100)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    receiver_amount = (monto_cobrado - commission_amount).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    if total_desc_pct > 0:
+        d_ar   = (commission_amount * (ar_eff   / total_desc_pct)).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        d_tasa = (commission_amount * (tasa_eff / total_desc_pct)).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        d_com  = commission_amount - d_ar - d_tasa
+    else:
+        d_ar   = Decimal('0.00')
+        d_tasa = Decimal('0.00')
+        d_com  = commission_amount
+
+    d_iva_21  = Decimal('0.00')
+    d_iva_105 = Decimal('0.00')
+    if tipo_tarjeta == 'debito':
+        base_sin_iva = commission_amount / (1 + Decimal(str(config['iva'])) / 100)
+        d_iva_21 = (commission_amount - base_sin_iva).quantize(Decimal('0.01'), ROUND_HALF_UP)
+    elif cuotas > 1 and plan:
+        if comision_aplica_iva and (d_ar + d_com) > 0:
+            base_com_ar = (d_ar + d_com) / (1 + iva_f)
+            d_iva_21 = (d_ar + d_com - base_com_ar).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        # El desglose toma la financiación del plan o de la config global, también en tarjetas custom
+        iva_fin_f_local = Decimal(str(_override(plan, 'iva_financiacion_override', config['iva_financiacion']))) / 100
+        if tasa_aplica_iva_fin and d_tasa > 0:
+            base_tasa = d_tasa / (1 + iva_fin_f_local)
+            d_iva_105 = (d_tasa - base_tasa).quantize(Decimal('0.01'), ROUND_HALF_UP)
+    elif (d_ar + d_com) > 0:
+        base_sin_iva = (d_ar + d_com) / (1 + iva_f)
+        d_iva_21 = (d_ar + d_com - base_sin_iva).quantize(Decimal('0.01'), ROUND_HALF_UP)
+
+    return {
+        'monto':             monto_cobrado,
+        'cuotas':            cuotas,
+        'commission_percent': total_desc_pct,
+        'commission_amount': commission_amount,
+        'receiver_amount':   receiver_amount,
+        'desglose_arancel':  d_ar,
+        'desglose_comision': d_com,
+        'desglose_tasa':     d_tasa,
+        'desglose_iva_21':   d_iva_21,
+        'desglose_iva_105':  d_iva_105,
+        'desglose_cuota_valor': (monto_cobrado / cuotas).quantize(Decimal('0.01'), ROUND_HALF_UP),
+    }
+
+
+def importes_referencia(datos: Dict[str, Any]) -> Dict[str, Dict[str, Dict[str, str]]]:
+    """Mismo formato que calcular_escenarios(), pero con la fórmula previa al Tarifario."""
+    return {
+        nombre: {
+            monto: {campo: str(valor) for campo, valor in
+                    _importes_base(datos, escenario['tipo_tarjeta'], escenario['cuotas'], monto).items()}
+            for monto in datos['montos']
+        }
+        for nombre, escenario in datos['escenarios'].items()
+    }
+
+
+def verificar_golden(datos: Dict[str, Any]) -> List[str]:
+    """
+    Diferencias contra los valores de referencia; lista vacía = todo coincide.
+    Verifica calcular() y calcular_centavos(), que deben dar lo mismo.
+    """
+    tarifario = construir_tarifario(datos)
+    obtenido = calcular_escenarios(datos, tarifario)
+    diferencias = []
+    for nombre, por_monto in datos['esperado'].items():
+        tarifa, _ = tarifario.resolver(datos['escenarios'][nombre]['tipo_tarjeta'],
+                                       datos['escenarios'][nombre]['cuotas'])
+        for monto, esperado in por_monto.items():
+            actual = obtenido.get(nombre, {}).get(monto, {})
+            centavos = tarifa.calcular_centavos(decimal_a_centavos(Decimal(monto)))
+            for campo, valor in esperado.items():
+                if actual.get(campo) != valor:
+                    diferencias.append(f"{nombre} monto={monto} {campo}: esperado {valor}, calcular {actual.get(campo)}")
+            for campo in CAMPOS:
+                if centavos_a_decimal(centavos[campo]) != Decimal(esperado[campo]):
+                    diferencias.append(
+                        f"{nombre} monto={monto} {campo}: esperado {esperado[campo]}, "
+                        f"calcular_centavos {centavos_a_decimal(centavos[campo])}"
+                    )
+    return diferencias
+
+
+def _medir(funcion, ops_por_llamada: int, iteraciones: int, repeticiones: int) -> Dict[str, Any]:
+    """Nanosegundos por operación: mínimo y mediana de `repeticiones` tandas."""
+    funcion()  # calentamiento
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter_ns()
+        for _ in range(iteraciones):
+            funcion()
+        tiempos.append((time.perf_counter_ns() - inicio) / (iteraciones * ops_por_llamada))
+    return {
+        'ops':               iteraciones * ops_por_llamada,
+        'ns_por_op_min':     round(min(tiempos), 1),
+        'ns_por_op_mediana': round(statistics.median(tiempos), 1),
+    }
+
+
+def medir(datos: Dict[str, Any], iteraciones: int = 2000, lote: int = 100, repeticiones: int = 5) -> Dict[str, Any]:
+    """
+    Mide por escenario:
+      resolver_calcular  resolver() + calcular(), lo que hace create_link por link
+      calcular           calcular() con la tarifa ya resuelta
+      calcular_centavos  núcleo entero con la tarifa ya resuelta
+      lote_calcular      calcular() sobre `lote` montos (cotizar_montos, carga masiva)
+    """
+    tarifario = construir_tarifario(datos)
+    rng = random.Random(datos.get('semilla', 0))
+    montos_lote = [centavos_a_decimal(rng.randint(1, 10 ** 9)) for _ in range(lote)]
+    monto = Decimal(datos['monto_benchmark'])
+    monto_centavos = decimal_a_centavos(monto)
+
+    resultados = []
+    for nombre, escenario in datos['escenarios'].items():
+        tipo, cuotas = escenario['tipo_tarjeta'], escenario['cuotas']
+        tarifa, _ = tarifario.resolver(tipo, cuotas)
+
+        def resolver_calcular():
+            tarifario.resolver(tipo, cuotas)[0].calcular(monto)
+
+        def lote_calcular():
+            for m in montos_lote:
+                tarifa.calcular(m)
+
+        casos = (
+            ('resolver_calcular', resolver_calcular, 1, iteraciones),
+            ('calcular', lambda: tarifa.calcular(monto), 1, iteraciones),
+            ('calcular_centavos', lambda: tarifa.calcular_centavos(monto_centavos), 1, iteraciones),
+            ('lote_calcular', lote_calcular, lote, max(1, iteraciones // lote)),
+        )
+        for medicion, funcion, ops, vueltas in casos:
+            resultados.append({'escenario': nombre, 'medicion': medicion,
+                               **_medir(funcion, ops, vueltas, repeticiones)})
+
+    return {
+        'formato':      FORMATO,
+        'fecha':        timezone.now().isoformat(),
+        'python':       platform.python_version(),
+        'django':       django.get_version(),
+        'maquina':      platform.machine(),
+        'iteraciones':  iteraciones,
+        'lote':         lote,
+        'repeticiones': repeticiones,
+        'resultados':   resultados,
+    }
+
+
+def comparar(actual: Dict[str, Any], anterior: Dict[str, Any], tolerancia: float) -> List[str]:
+    """Mediciones cuya mediana empeoró más de `tolerancia` (0.2 = 20 %) respecto de `anterior`."""
+    previas = {(r['escenario'], r['medicion']): r for r in anterior.get('resultados', [])}
+    regresiones = []
+    for r in actual['resultados']:
+        previa = previas.get((r['escenario'], r['medicion']))
+        if previa is None or not previa['ns_por_op_mediana']:
+            continue
+        cambio = r['ns_por_op_mediana'] / previa['ns_por_op_mediana'] - 1
+        r['cambio'] = round(cambio, 4)
+        if cambio > tolerancia:
+            regresiones.append(
+                f"{r['escenario']}/{r['medicion']}: {previa['ns_por_op_mediana']} → "
+                f"{r['ns_por_op_mediana']} ns/op (+{cambio:.0%})"
+            )
+    return regresiones
@@ -1,10 +1,17 @@
+import threading
 from typing import Tuple, Optional, Any, Dict, List
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from app1.models import Cliente
 from django.db.models import Q
 from django.contrib.auth.hashers import make_password
 from .models import User_admin
 from .models import ParametroFinanciero, CuotaConfig
+from utils.versionado import get_version, bump_version
+
+VERSION_CONFIG = 'parametro_financiero'
+
+_config_cache = None  # (versión, ParametroFinanciero)
+_config_lock = threading.Lock()
 
 def list_pending_clientes() -> List[Cliente]:
     return list(Cliente.objects.filter(aprobado=False))
@@ -143,40 +150,154 @@ def delete_admin(pk: Any) -> Tuple[bool, Optional[str]]:
     
     from .models import ParametroFinanciero, CuotaConfig
 
-def get_or_create_config():
+def _leer_o_crear_config():
     config = ParametroFinanciero.objects.first()
     if not config:
         config = ParametroFinanciero.objects.create()
     return config
 
+def get_or_create_config():
+    """
+    ParametroFinanciero único, cacheado en memoria del proceso hasta que cambia
+    el sello de versión (fila de SelloVersion, que app2/signals.py renueva al
+    guardar y que todos los workers leen de la base). La instancia es
+    compartida: usarla solo para leer; para modificar ir por update_financiero.
+    """
+    global _config_cache
+    # La versión se lee antes que la fila: si alguien guarda en el medio, la
+    # próxima llamada ve otra versión y vuelve a leer.
+    version = get_version(VERSION_CONFIG)
+    actual = _config_cache
+    if actual is not None and version is not None and actual[0] == version:
+        return actual[1]
+    with _config_lock:
+        config = _leer_o_crear_config()
+        _config_cache = (version, config)
+    return config
+
+def invalidar_config():
+    global _config_cache
+    _config_cache = None
+    bump_version(VERSION_CONFIG)
+
 def list_cuotas_config():
-    return CuotaConfig.objects.all()
+    return CuotaConfig.objects.select_related('tarjeta_custom')
+
+def asignaciones_por_plan():
+    """{plan_id: set(cliente_id)} de todos los planes, en una sola consulta a la tabla M2M."""
+    asignaciones = {}
+    filas = CuotaConfig.usuarios_asignados.through.objects.values_list('cuotaconfig_id', 'cliente_id')
+    for plan_id, cliente_id in filas:
+        asignaciones.setdefault(plan_id, set()).add(cliente_id)
+    return asignaciones
 
 def list_cuotas_para_usuario(cliente_id):
     """Planes de crédito genérico visibles para un cliente (sin tarjeta custom asignada)."""
-    from django.db.models import Q
     return CuotaConfig.objects.filter(
-        activa=True,
-        tarjeta_custom__isnull=True
-    ).filter(
-        Q(alcance='global') |
-        Q(alcance='usuarios', usuarios_asignados__id=cliente_id)
-    ).distinct().order_by('numero_cuota')
+        visibilidad__cliente_id=cliente_id,
+        visibilidad__tarjeta_slug='',
+    ).order_by('numero_cuota')
 
 
 def list_cuotas_para_tarjeta_custom(cliente_id, slug):
     """Planes de cuotas para una tarjeta custom específica."""
-    from django.db.models import Q
     return CuotaConfig.objects.filter(
-        activa=True,
-        tarjeta_custom__slug=slug
-    ).filter(
-        Q(alcance='global') |
-        Q(alcance='usuarios', usuarios_asignados__id=cliente_id)
-    ).distinct().order_by('numero_cuota')
+        visibilidad__cliente_id=cliente_id,
+        visibilidad__tarjeta_slug=slug,
+    ).order_by('numero_cuota')
+
+def planes_visibles_por_tarjeta(cliente_id):
+    """
+    Todos los planes visibles para un cliente en una sola consulta, agrupados por
+    slug de tarjeta ('' = crédito genérico) y ordenados por número de cuota.
+    """
+    from .models import VisibilidadPlan
+    agrupados = {}
+    filas = (
+        VisibilidadPlan.objects.filter(cliente_id=cliente_id)
+        .select_related('cuota_config')
+        .order_by('cuota_config__numero_cuota', 'cuota_config_id')
+    )
+    for fila in filas:
+        agrupados.setdefault(fila.tarjeta_slug, []).append(fila.cuota_config)
+    return agrupados
+
+def ids_cuotas_visibles(cliente_id):
+    """IDs de todos los planes activos (genéricos y de tarjetas custom) visibles para un cliente."""
+    from .models import VisibilidadPlan
+    return set(
+        VisibilidadPlan.objects.filter(cliente_id=cliente_id).values_list('cuota_config_id', flat=True)
+    )
+
+def sincronizar_visibilidad_plan(plan):
+    """Rehace las filas de VisibilidadPlan de un plan según activa, alcance y usuarios asignados."""
+    from .models import VisibilidadPlan
+    VisibilidadPlan.objects.filter(cuota_config_id=plan.pk).delete()
+    if not plan.activa:
+        return
+    if plan.alcance == CuotaConfig.ALCANCE_GLOBAL:
+        clientes = Cliente.objects.values_list('id', flat=True)
+    else:
+        clientes = plan.usuarios_asignados.values_list('id', flat=True)
+    slug = plan.tarjeta_custom.slug if plan.tarjeta_custom_id else ''
+    VisibilidadPlan.objects.bulk_create(
+        [VisibilidadPlan(cliente_id=c, cuota_config_id=plan.pk, tarjeta_slug=slug) for c in clientes],
+        batch_size=500,
+    )
+
+def sincronizar_visibilidad_cliente(cliente_id):
+    """Rehace las filas de VisibilidadPlan de un cliente (alta de cliente o cambio de sus asignaciones)."""
+    from .models import VisibilidadPlan
+    VisibilidadPlan.objects.filter(cliente_id=cliente_id).delete()
+    planes = CuotaConfig.objects.filter(activa=True).filter(
+        Q(alcance=CuotaConfig.ALCANCE_GLOBAL) |
+        Q(alcance=CuotaConfig.ALCANCE_USUARIOS, usuarios_asignados__id=cliente_id)
+    ).distinct().select_related('tarjeta_custom')
+    VisibilidadPlan.objects.bulk_create([
+        VisibilidadPlan(
+            cliente_id=cliente_id,
+            cuota_config_id=plan.pk,
+            tarjeta_slug=plan.tarjeta_custom.slug if plan.tarjeta_custom_id else '',
+        )
+        for plan in planes
+    ])
+
+def congelar_tarifa(tarifa):
+    """
+    TarifaCongelada para una TarifaEfectiva: la busca por hash o la crea.
+    El id queda en la tarifa, así cada tarifa del tarifario consulta la base una sola vez;
+    se guarda recién al confirmar la transacción para no retener el id de una fila revertida.
+    """
+    from .models import TarifaCongelada
+    if tarifa.congelada_id is not None:
+        return tarifa.congelada_id
+
+    congelada, _ = TarifaCongelada.objects.get_or_create(
+        hash=tarifa.huella(),
+        defaults={
+            'tipo':            tarifa.tipo,
+            'slug':            tarifa.slug or '',
+            'cuotas':          tarifa.cuotas,
+            'plan_id':         tarifa.plan_id,
+            'plan_nombre':     tarifa.plan_nombre or '',
+            'tarjeta_nombre':  tarifa.tarjeta_nombre or '',
+            'arancel':         tarifa.arancel,
+            'pt_eff':          tarifa.pt_eff,
+            'ar_eff':          tarifa.ar_eff,
+            'tasa_eff':        tarifa.tasa_eff,
+            'total_pct':       tarifa.total_pct,
+            'iva_f':           tarifa.iva_f,
+            'iva_fin_f':       tarifa.iva_fin_f,
+            'iva_sobre_total': tarifa.iva_sobre_total,
+            'iva_com':         tarifa.iva_com,
+            'iva_tasa':        tarifa.iva_tasa,
+        },
+    )
+    transaction.on_commit(lambda: setattr(tarifa, 'congelada_id', congelada.pk))
+    return congelada.pk
 
 def update_financiero(data):
-    config = get_or_create_config()
+    config = _leer_o_crear_config()
     config.iva = data.get('iva', config.iva)
     config.iva_financiacion = data.get('iva_financiacion', config.iva_financiacion)
     
@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app2 import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el costo por llamada y en lote del cálculo de comisiones en cada rama de "
+        "create_link y verifica los importes contra app2/benchmark_golden.json. "
+        "Imprime JSON (o lo guarda con --salida)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iteraciones', type=int, default=2000)
+        parser.add_argument('--lote', type=int, default=100, help="Montos por lote en la medición lote_calcular")
+        parser.add_argument('--repeticiones', type=int, default=5)
+        parser.add_argument('--salida', help="Archivo donde guardar el JSON de resultados")
+        parser.add_argument('--comparar', help="JSON de una corrida anterior para detectar regresiones")
+        parser.add_argument('--tolerancia', type=float, default=0.2,
+                            help="Empeoramiento admitido de la mediana al comparar (0.2 = 20%%)")
+        parser.add_argument('--golden', default=str(benchmark.RUTA_GOLDEN))
+        parser.add_argument('--regenerar-golden', action='store_true',
+                            help="Reescribe los valores esperados con la fórmula previa al Tarifario")
+
+    def handle(self, *args, **options):
+        datos = benchmark.cargar_golden(options['golden'])
+
+        if options['regenerar_golden']:
+            datos['esperado'] = benchmark.importes_referencia(datos)
+            with open(options['golden'], 'w', encoding='utf-8') as archivo:
+                json.dump(datos, archivo, ensure_ascii=False, indent=2)
+                archivo.write('\n')
+            self.stderr.write(self.style.WARNING(f"Valores esperados regenerados en {options['golden']}"))
+            return
+
+        if not datos.get('esperado'):
+            raise CommandError("El archivo golden no tiene valores esperados (usar --regenerar-golden).")
+        diferencias = benchmark.verificar_golden(datos)
+        if diferencias:
+            for diferencia in diferencias[:20]:
+                self.stderr.write(diferencia)
+            raise CommandError(f"{len(diferencias)} importes difieren de los valores de referencia.")
+
+        resultado = benchmark.medir(
+            datos, options['iteraciones'], options['lote'], options['repeticiones']
+        )
+        resultado['golden'] = 'ok'
+
+        regresiones = []
+        if options['comparar']:
+            with open(options['comparar'], encoding='utf-8') as archivo:
+                regresiones = benchmark.comparar(resultado, json.load(archivo), options['tolerancia'])
+            resultado['regresiones'] = regresiones
+
+        salida = json.dumps(resultado, ensure_ascii=False, indent=2)
+        if options['salida']:
+            with open(options['salida'], 'w', encoding='utf-8') as archivo:
+                archivo.write(salida + '\n')
+        else:
+            self.stdout.write(salida)
+
+        if regresiones:
+            raise CommandError("Regresiones de rendimiento: " + "; ".join(regresiones))
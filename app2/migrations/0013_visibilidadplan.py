@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def poblar_visibilidad(apps, schema_editor):
+    Cliente = apps.get_model('app1', 'Cliente')
+    CuotaConfig = apps.get_model('app2', 'CuotaConfig')
+    VisibilidadPlan = apps.get_model('app2', 'VisibilidadPlan')
+
+    todos = list(Cliente.objects.values_list('id', flat=True))
+    filas = []
+    for plan in CuotaConfig.objects.filter(activa=True).select_related('tarjeta_custom'):
+        if plan.alcance == 'global':
+            clientes = todos
+        else:
+            clientes = plan.usuarios_asignados.values_list('id', flat=True)
+        slug = plan.tarjeta_custom.slug if plan.tarjeta_custom_id else ''
+        filas.extend(
+            VisibilidadPlan(cliente_id=c, cuota_config_id=plan.id, tarjeta_slug=slug)
+            for c in clientes
+        )
+    VisibilidadPlan.objects.bulk_create(filas, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app1', '0019_alter_cliente_fecha_registro'),
+        ('app2', '0012_terminoscondiciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisibilidadPlan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tarjeta_slug', models.CharField(blank=True, default='', max_length=50)),
+                ('cliente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='app1.cliente')),
+                ('cuota_config', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibilidad', to='app2.cuotaconfig')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['cliente', 'tarjeta_slug'], name='visibilidad_cliente_tarjeta')],
+                'unique_together': {('cliente', 'cuota_config')},
+            },
+        ),
+        migrations.RunPython(poblar_visibilidad, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app2', '0013_visibilidadplan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TarifaCongelada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash', models.CharField(max_length=64, unique=True)),
+                ('tipo', models.CharField(max_length=10)),
+                ('slug', models.CharField(blank=True, default='', max_length=50)),
+                ('cuotas', models.PositiveSmallIntegerField(default=1)),
+                ('plan_id', models.IntegerField(blank=True, null=True)),
+                ('plan_nombre', models.CharField(blank=True, default='', max_length=100)),
+                ('tarjeta_nombre', models.CharField(blank=True, default='', max_length=100)),
+                ('arancel', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('pt_eff', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('ar_eff', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('tasa_eff', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('total_pct', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('iva_f', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('iva_fin_f', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('iva_sobre_total', models.BooleanField(default=False)),
+                ('iva_com', models.BooleanField(default=True)),
+                ('iva_tasa', models.BooleanField(default=False)),
+                ('creado_en', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Tarifa congelada',
+                'verbose_name_plural': 'Tarifas congeladas',
+            },
+        ),
+    ]
@@ -89,6 +89,81 @@ class CuotaConfig(models.Model):
     class Meta:
         ordering = ['numero_cuota']
         
+class VisibilidadPlan(models.Model):
+    """
+    Índice materializado de qué planes de cuotas ve cada cliente.
+    Una fila por (cliente, plan activo visible); tarjeta_slug vacío = crédito genérico.
+    Lo mantiene sincronizado app2/signals.py al cambiar planes, alcance o asignaciones.
+    """
+    cliente      = models.ForeignKey('app1.Cliente', on_delete=models.CASCADE, related_name='+')
+    cuota_config = models.ForeignKey(CuotaConfig, on_delete=models.CASCADE, related_name='visibilidad')
+    tarjeta_slug = models.CharField(max_length=50, blank=True, default='')
+
+    class Meta:
+        unique_together = ('cliente', 'cuota_config')
+        indexes = [
+            models.Index(fields=['cliente', 'tarjeta_slug'], name='visibilidad_cliente_tarjeta'),
+        ]
+
+class TarifaCongelada(models.Model):
+    """
+    Copia inmutable de las tasas efectivas con las que se cotizó un LinkPago.
+    Se deduplica por hash del contenido: todos los links cotizados con la misma
+    tarifa apuntan a la misma fila, y editar la configuración no la modifica.
+    """
+    hash          = models.CharField(max_length=64, unique=True)
+    tipo          = models.CharField(max_length=10)  # debito | credito | custom
+    slug          = models.CharField(max_length=50, blank=True, default='')
+    cuotas        = models.PositiveSmallIntegerField(default=1)
+    plan_id       = models.IntegerField(null=True, blank=True)  # CuotaConfig de origen (sin FK: puede borrarse)
+    plan_nombre   = models.CharField(max_length=100, blank=True, default='')
+    tarjeta_nombre = models.CharField(max_length=100, blank=True, default='')
+
+    # Porcentajes efectivos (con IVA cuando corresponde) y arancel nominal
+    arancel       = models.DecimalField(max_digits=20, decimal_places=10)
+    pt_eff        = models.DecimalField(max_digits=20, decimal_places=10)
+    ar_eff        = models.DecimalField(max_digits=20, decimal_places=10)
+    tasa_eff      = models.DecimalField(max_digits=20, decimal_places=10)
+    total_pct     = models.DecimalField(max_digits=20, decimal_places=10)
+    iva_f         = models.DecimalField(max_digits=20, decimal_places=10)
+    iva_fin_f     = models.DecimalField(max_digits=20, decimal_places=10)
+    iva_sobre_total = models.BooleanField(default=False)
+    iva_com       = models.BooleanField(default=True)
+    iva_tasa      = models.BooleanField(default=False)
+
+    creado_en     = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Tarifa congelada"
+        verbose_name_plural = "Tarifas congeladas"
+
+    def __str__(self):
+        return f"{self.tipo} {self.slug} x{self.cuotas} — {self.total_pct.normalize()}%"
+
+    def save(self, *args, **kwargs):
+        # Solo se crean: una tarifa congelada nunca se actualiza
+        if self.pk is not None:
+            raise ValueError("TarifaCongelada es inmutable.")
+        super().save(*args, **kwargs)
+
+    def como_tarifa(self):
+        """TarifaEfectiva equivalente, para recalcular o auditar sin leer la configuración actual."""
+        from .tarifario import TarifaEfectiva
+        tarifa = TarifaEfectiva(
+            self.tipo, self.cuotas, self.pt_eff, self.ar_eff, self.tasa_eff, self.iva_f,
+            iva_fin_f=self.iva_fin_f,
+            iva_sobre_total=self.iva_sobre_total,
+            iva_com=self.iva_com,
+            iva_tasa=self.iva_tasa,
+            slug=self.slug or None,
+            arancel=self.arancel,
+        )
+        tarifa.plan_id = self.plan_id
+        tarifa.plan_nombre = self.plan_nombre or None
+        tarifa.tarjeta_nombre = self.tarjeta_nombre or None
+        tarifa.congelada_id = self.pk
+        return tarifa
+
 class TarjetaCustom(models.Model):
     nombre              = models.CharField(max_length=100)
     slug                = models.SlugField(max_length=50, unique=True, help_text="Identificador interno ej: naranja_x")
@@ -128,6 +203,18 @@ class TarjetaCustom(models.Model):
             return self.arancel * (1 + self.iva / 100)
         return self.arancel
     
+class SelloVersion(models.Model):
+    """
+    Sello de versión de datos que los procesos copian en memoria (tarifario, parámetros
+    financieros). Lo renueva utils/versionado.py al guardar; vive en la base para que
+    todos los workers lo vean, sea cual sea el backend de cache.
+    """
+    nombre  = models.CharField(max_length=50, primary_key=True)
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return f"{self.nombre}={self.version}"
+
 class TerminosCondiciones(models.Model):
     version    = models.CharField(max_length=10, unique=True)
     contenido  = models.TextField(help_text="Formato Markdown")
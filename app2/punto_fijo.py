@@ -0,0 +1,126 @@
+"""
+Aritmética de punto fijo sobre enteros para el tarifario.
+
+Un valor es un par (mantisa, exponente) de enteros: valor = mantisa × 10**exponente.
+Los montos quedan en centavos (exponente -2) y los porcentajes con la escala que
+traen de la base (hasta 8 decimales), sin pasar por float.
+
+Cada operación reproduce lo que hace `decimal` con el contexto por defecto
+(28 dígitos significativos, ROUND_HALF_EVEN) y `a_centavos` reproduce
+quantize(Decimal('0.01'), ROUND_HALF_UP), así los resultados son idénticos
+a los del cálculo con Decimal, incluidos los redondeos intermedios.
+"""
+from decimal import Decimal
+from typing import Tuple
+
+Fijo = Tuple[int, int]
+
+PRECISION = 28  # decimal.DefaultContext.prec
+_LIMITE = 10 ** PRECISION
+_POTENCIAS = [10 ** i for i in range(4 * PRECISION)]
+
+
+def a_fijo(valor) -> Fijo:
+    """Decimal (o algo convertible con str) → (mantisa, exponente)."""
+    if not isinstance(valor, Decimal):
+        valor = Decimal(str(valor))
+    signo, digitos, exponente = valor.as_tuple()
+    mantisa = int(''.join(map(str, digitos))) if digitos else 0
+    return (-mantisa if signo else mantisa), exponente
+
+
+def _potencia(n: int) -> int:
+    return _POTENCIAS[n] if n < len(_POTENCIAS) else 10 ** n
+
+
+def _digitos(absoluto: int) -> int:
+    """Cantidad de dígitos decimales de un entero positivo, sin pasar por str()."""
+    digitos = (absoluto.bit_length() * 1233) >> 12
+    return digitos + 1 if absoluto >= _potencia(digitos) else digitos
+
+
+def _redondear(mantisa: int, exponente: int, resto: bool = False) -> Fijo:
+    """
+    Recorta a PRECISION dígitos significativos con ROUND_HALF_EVEN.
+    `resto` indica que hay dígitos no nulos descartados antes (división inexacta).
+    """
+    absoluto = -mantisa if mantisa < 0 else mantisa
+    if absoluto < _LIMITE and not resto:
+        return mantisa, exponente
+
+    sobrantes = _digitos(absoluto) - PRECISION
+    if sobrantes <= 0:
+        return mantisa, exponente
+
+    potencia = _potencia(sobrantes)
+    cociente, descartado = divmod(absoluto, potencia)
+    mitad = potencia // 2
+    if descartado > mitad or (descartado == mitad and (resto or cociente & 1)):
+        cociente += 1
+    return (-cociente if mantisa < 0 else cociente), exponente + sobrantes
+
+
+def _alinear(a: Fijo, b: Fijo) -> Tuple[int, int, int]:
+    (ma, ea), (mb, eb) = a, b
+    if ea == eb:
+        return ma, mb, ea
+    if ea > eb:
+        return ma * _potencia(ea - eb), mb, eb
+    return ma, mb * _potencia(eb - ea), ea
+
+
+def sumar(a: Fijo, b: Fijo) -> Fijo:
+    ma, mb, exponente = _alinear(a, b)
+    return _redondear(ma + mb, exponente)
+
+
+def restar(a: Fijo, b: Fijo) -> Fijo:
+    ma, mb, exponente = _alinear(a, b)
+    return _redondear(ma - mb, exponente)
+
+
+def multiplicar(a: Fijo, b: Fijo) -> Fijo:
+    return _redondear(a[0] * b[0], a[1] + b[1])
+
+
+def dividir(a: Fijo, b: Fijo) -> Fijo:
+    """a / b con redondeo correcto a PRECISION dígitos (como Decimal)."""
+    (ma, ea), (mb, eb) = a, b
+    if ma == 0:
+        return 0, ea - eb
+    negativo = (ma < 0) != (mb < 0)
+    ma, mb = abs(ma), abs(mb)
+
+    # Escala para que el cociente entero tenga al menos PRECISION + 2 dígitos
+    escala = max(0, PRECISION + 2 - _digitos(ma) + _digitos(mb))
+    cociente, resto = divmod(ma * _potencia(escala), mb)
+    mantisa, exponente = _redondear(cociente, ea - eb - escala, resto != 0)
+    return (-mantisa if negativo else mantisa), exponente
+
+
+def a_centavos(a: Fijo) -> int:
+    """quantize(Decimal('0.01'), ROUND_HALF_UP) expresado en centavos."""
+    mantisa, exponente = a
+    if exponente >= -2:
+        return mantisa * _potencia(exponente + 2)
+    potencia = _potencia(-2 - exponente)
+    absoluto = -mantisa if mantisa < 0 else mantisa
+    centavos, descartado = divmod(absoluto, potencia)
+    if 2 * descartado >= potencia:
+        centavos += 1
+    return -centavos if mantisa < 0 else centavos
+
+
+def centavos_a_decimal(centavos: int) -> Decimal:
+    return Decimal(centavos).scaleb(-2)
+
+
+def decimal_a_centavos(valor) -> int:
+    """Importe con hasta dos decimales (ej: LinkPago.monto) → centavos. Más decimales es error."""
+    mantisa, exponente = a_fijo(valor)
+    if exponente >= -2:
+        return mantisa * _potencia(exponente + 2)
+    potencia = _potencia(-2 - exponente)
+    if mantisa % potencia:
+        raise ValueError(f"{valor} tiene más de dos decimales")
+    return mantisa // potencia
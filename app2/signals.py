@@ -0,0 +1,69 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from app1.models import Cliente
+from .models import ParametroFinanciero, CuotaConfig, TarjetaCustom, VisibilidadPlan
+from .tarifario import invalidar_tarifario
+from .crud import invalidar_config, sincronizar_visibilidad_plan, sincronizar_visibilidad_cliente
+
+
+@receiver(post_save, sender=ParametroFinanciero)
+@receiver(post_delete, sender=ParametroFinanciero)
+def invalidar_config_al_guardar(sender, **kwargs):
+    # Antes que el tarifario: al reconstruirse ya lee la configuración nueva.
+    invalidar_config()
+    transaction.on_commit(invalidar_config)
+
+
+@receiver(post_save, sender=ParametroFinanciero)
+@receiver(post_delete, sender=ParametroFinanciero)
+@receiver(post_save, sender=CuotaConfig)
+@receiver(post_delete, sender=CuotaConfig)
+@receiver(post_save, sender=TarjetaCustom)
+@receiver(post_delete, sender=TarjetaCustom)
+@receiver(m2m_changed, sender=CuotaConfig.usuarios_asignados.through)
+def invalidar_tarifario_al_guardar(sender, **kwargs):
+    if kwargs.get('action', '').startswith('pre_'):
+        return
+    # Se invalida ya (mismo proceso) y otra vez al confirmar la transacción,
+    # para que ningún worker se quede con una tabla armada antes del commit.
+    invalidar_tarifario()
+    transaction.on_commit(invalidar_tarifario)
+
+
+# ── Índice de visibilidad de planes (VisibilidadPlan) ──────────────────────
+
+@receiver(post_save, sender=CuotaConfig)
+def sincronizar_visibilidad_al_guardar_plan(sender, instance, **kwargs):
+    sincronizar_visibilidad_plan(instance)
+
+
+@receiver(m2m_changed, sender=CuotaConfig.usuarios_asignados.through)
+def sincronizar_visibilidad_al_asignar(sender, instance, action, reverse, **kwargs):
+    if action.startswith('pre_'):
+        return
+    if reverse:
+        # cliente.planes_personalizados.add(...): instance es el Cliente
+        sincronizar_visibilidad_cliente(instance.pk)
+    else:
+        sincronizar_visibilidad_plan(instance)
+
+
+@receiver(post_save, sender=Cliente)
+def sincronizar_visibilidad_cliente_nuevo(sender, instance, created, **kwargs):
+    if created:
+        sincronizar_visibilidad_cliente(instance.pk)
+
+
+@receiver(post_save, sender=TarjetaCustom)
+def actualizar_slug_visibilidad(sender, instance, **kwargs):
+    VisibilidadPlan.objects.filter(
+        cuota_config__tarjeta_custom=instance
+    ).exclude(tarjeta_slug=instance.slug).update(tarjeta_slug=instance.slug)
+
+
+@receiver(post_delete, sender=TarjetaCustom)
+def limpiar_slug_visibilidad(sender, instance, **kwargs):
+    # Los planes de la tarjeta quedan como crédito genérico (on_delete=SET_NULL)
+    VisibilidadPlan.objects.filter(tarjeta_slug=instance.slug).update(tarjeta_slug='')
@@ -0,0 +1,431 @@
+"""
+Tarifario compilado — tasas efectivas por (tipo_tarjeta, slug, cuotas).
+
+Reúne en un solo lugar la lógica de IVA / overrides / tasa de financiación que
+usan create_link, el preview de creacion_link y las proyecciones del panel
+financiero. Las tasas se arman una vez a partir de ParametroFinanciero,
+CuotaConfig y TarjetaCustom y quedan en memoria del proceso hasta que alguno
+de esos modelos se guarda (ver app2/signals.py).
+"""
+import hashlib
+import logging
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Optional, Tuple, List, Dict, Any, Iterable
+
+from django.utils import timezone
+
+from utils.versionado import get_version, bump_version
+from .punto_fijo import a_fijo, a_centavos, dividir, multiplicar, restar
+
+logger = logging.getLogger('app2')
+
+VERSION_TARIFARIO = 'tarifario'
+
+CENTAVO = Decimal('0.01')
+CERO = Decimal('0')
+CERO_PESOS = Decimal('0.00')
+
+
+def _d(valor) -> Decimal:
+    return Decimal(str(valor))
+
+
+class TarifaEfectiva:
+    """
+    Porcentajes efectivos (ya con IVA cuando corresponde) de un medio de pago
+    y plan de cuotas, más los factores necesarios para desglosar el IVA.
+    """
+    __slots__ = (
+        'tipo', 'slug', 'cuotas', 'plan_id', 'plan_nombre',
+        'tarjeta_nombre', 'payzen_code', 'acepta_cuotas', 'congelada_id',
+        'arancel', 'pt_eff', 'ar_eff', 'tasa_eff', 'total_pct',
+        'iva_f', 'iva_fin_f', 'iva_sobre_total', 'iva_com', 'iva_tasa',
+        '_factor', '_ratio_ar', '_ratio_tasa', '_div_iva', '_div_iva_fin', '_fijos',
+    )
+
+    def __init__(self, tipo, cuotas, pt_eff, ar_eff, tasa_eff, iva_f,
+                 iva_fin_f=CERO, iva_sobre_total=False, iva_com=True, iva_tasa=False,
+                 slug=None, plan=None, tarjeta=None, arancel=None):
+        self.tipo = tipo
+        self.slug = slug
+        self.cuotas = cuotas
+        self.plan_id = plan.id if plan is not None else None
+        self.plan_nombre = plan.nombre if plan is not None else None
+        self.tarjeta_nombre = tarjeta.nombre if tarjeta is not None else None
+        self.payzen_code = tarjeta.payzen_code if tarjeta is not None else ''
+        self.acepta_cuotas = tarjeta.acepta_cuotas if tarjeta is not None else tipo == 'credito'
+        self.congelada_id = None  # TarifaCongelada de esta tarifa, una vez guardada
+
+        self.arancel = arancel if arancel is not None else CERO  # nominal, sin IVA
+        self.pt_eff = pt_eff
+        self.ar_eff = ar_eff
+        self.tasa_eff = tasa_eff
+        self.total_pct = tasa_eff + pt_eff + ar_eff
+
+        self.iva_f = iva_f
+        self.iva_fin_f = iva_fin_f
+        self.iva_sobre_total = iva_sobre_total
+        self.iva_com = iva_com
+        self.iva_tasa = iva_tasa
+
+        # Factores precalculados: el cálculo por monto queda en multiplicaciones
+        self._factor = self.total_pct / 100
+        if self.total_pct > 0:
+            self._ratio_ar = self.ar_eff / self.total_pct
+            self._ratio_tasa = self.tasa_eff / self.total_pct
+        else:
+            self._ratio_ar = None
+            self._ratio_tasa = None
+        self._div_iva = 1 + iva_f
+        self._div_iva_fin = 1 + iva_fin_f
+        # Los mismos factores en punto fijo, para calcular_centavos
+        self._fijos = (
+            a_fijo(self._factor),
+            a_fijo(self._ratio_ar) if self._ratio_ar is not None else None,
+            a_fijo(self._ratio_tasa) if self._ratio_tasa is not None else None,
+            a_fijo(self._div_iva),
+            a_fijo(self._div_iva_fin),
+        )
+
+    @property
+    def tipo_tarjeta(self) -> str:
+        """Valor del select `tipo_tarjeta` del formulario de creación de link."""
+        return f"custom_{self.slug}" if self.tipo == 'custom' else self.tipo
+
+    @property
+    def nombre(self) -> str:
+        if self.plan_nombre:
+            return self.plan_nombre
+        if self.tarjeta_nombre:
+            return self.tarjeta_nombre
+        return 'Débito' if self.tipo == 'debito' else 'Crédito'
+
+    def huella(self) -> str:
+        """Hash del contenido que define el cálculo y el ticket (dedup de TarifaCongelada)."""
+        partes = [
+            self.tipo, self.slug or '', str(self.cuotas), str(self.plan_id or ''),
+            self.plan_nombre or '', self.tarjeta_nombre or '',
+            *(format(_d(v).normalize(), 'f') for v in (
+                self.arancel, self.pt_eff, self.ar_eff, self.tasa_eff, self.iva_f, self.iva_fin_f,
+            )),
+            str(int(self.iva_sobre_total)), str(int(self.iva_com)), str(int(self.iva_tasa)),
+        ]
+        return hashlib.sha256('|'.join(partes).encode('utf-8')).hexdigest()
+
+    @property
+    def valida(self) -> bool:
+        return self.total_pct < 100
+
+    def calcular(self, monto) -> Dict[str, Decimal]:
+        """Modelo ABSORBE: descuentos y desglose sobre el monto cobrado al cliente."""
+        monto = _d(monto)
+        commission_amount = (monto * self._factor).quantize(CENTAVO, rounding=ROUND_HALF_UP)
+        receiver_amount = (monto - commission_amount).quantize(CENTAVO, rounding=ROUND_HALF_UP)
+
+        if self._ratio_ar is not None:
+            d_ar   = (commission_amount * self._ratio_ar).quantize(CENTAVO, ROUND_HALF_UP)
+            d_tasa = (commission_amount * self._ratio_tasa).quantize(CENTAVO, ROUND_HALF_UP)
+            d_com  = commission_amount - d_ar - d_tasa
+        else:
+            d_ar   = CERO_PESOS
+            d_tasa = CERO_PESOS
+            d_com  = commission_amount
+
+        d_iva_21  = CERO_PESOS
+        d_iva_105 = CERO_PESOS
+
+        if self.iva_sobre_total:
+            # Débito: IVA 21% sobre el total de la comisión
+            base_sin_iva = commission_amount / self._div_iva
+            d_iva_21 = (commission_amount - base_sin_iva).quantize(CENTAVO, ROUND_HALF_UP)
+        else:
+            if self.iva_com and (d_ar + d_com) > 0:
+                base_com_ar = (d_ar + d_com) / self._div_iva
+                d_iva_21 = (d_ar + d_com - base_com_ar).quantize(CENTAVO, ROUND_HALF_UP)
+            if self.iva_tasa and d_tasa > 0:
+                base_tasa = d_tasa / self._div_iva_fin
+                d_iva_105 = (d_tasa - base_tasa).quantize(CENTAVO, ROUND_HALF_UP)
+
+        return {
+            'monto':             monto,
+            'cuotas':            self.cuotas,
+            'commission_percent': self.total_pct,
+            'commission_amount': commission_amount,
+            'receiver_amount':   receiver_amount,
+            'desglose_arancel':  d_ar,
+            'desglose_comision': d_com,
+            'desglose_tasa':     d_tasa,
+            'desglose_iva_21':   d_iva_21,
+            'desglose_iva_105':  d_iva_105,
+            'desglose_cuota_valor': (monto / self.cuotas).quantize(CENTAVO, ROUND_HALF_UP),
+        }
+
+    def calcular_centavos(self, monto_centavos: int) -> Dict[str, int]:
+        """
+        Lo mismo que calcular() pero en enteros: recibe y devuelve centavos.
+        Reproduce los redondeos de Decimal paso a paso (ver punto_fijo.py), así
+        los resultados son idénticos; lo usan los recálculos sobre el histórico
+        (crud.auditar_liquidaciones), donde se suman y agrupan montos.
+        """
+        factor, ratio_ar, ratio_tasa, div_iva, div_iva_fin = self._fijos
+        monto = (monto_centavos, -2)
+        commission = a_centavos(multiplicar(monto, factor))
+        receiver = monto_centavos - commission
+
+        if ratio_ar is not None:
+            d_ar   = a_centavos(multiplicar((commission, -2), ratio_ar))
+            d_tasa = a_centavos(multiplicar((commission, -2), ratio_tasa))
+            d_com  = commission - d_ar - d_tasa
+        else:
+            d_ar   = 0
+            d_tasa = 0
+            d_com  = commission
+
+        d_iva_21  = 0
+        d_iva_105 = 0
+
+        if self.iva_sobre_total:
+            d_iva_21 = _iva_contenido(commission, div_iva)
+        else:
+            if self.iva_com and (d_ar + d_com) > 0:
+                d_iva_21 = _iva_contenido(d_ar + d_com, div_iva)
+            if self.iva_tasa and d_tasa > 0:
+                d_iva_105 = _iva_contenido(d_tasa, div_iva_fin)
+
+        return {
+            'commission_amount':    commission,
+            'receiver_amount':      receiver,
+            'desglose_arancel':     d_ar,
+            'desglose_comision':    d_com,
+            'desglose_tasa':        d_tasa,
+            'desglose_iva_21':      d_iva_21,
+            'desglose_iva_105':     d_iva_105,
+            'desglose_cuota_valor': a_centavos(dividir(monto, (self.cuotas, 0))),
+        }
+
+
+def _iva_contenido(centavos: int, divisor) -> int:
+    """IVA incluido en un importe: importe - importe / (1 + iva), en centavos."""
+    importe = (centavos, -2)
+    return a_centavos(restar(importe, dividir(importe, divisor)))
+
+
+def _tarifa_contado(tipo, comision, arancel, iva, aplica_iva=True, slug=None, tarjeta=None):
+    iva_f  = _d(iva) / 100
+    pt_eff = _d(comision) * (1 + iva_f) if aplica_iva else _d(comision)
+    ar_eff = _d(arancel)  * (1 + iva_f) if aplica_iva else _d(arancel)
+    return TarifaEfectiva(
+        tipo, 1, pt_eff, ar_eff, CERO, iva_f,
+        iva_sobre_total=(tipo == 'debito'),
+        slug=slug, tarjeta=tarjeta, arancel=_d(arancel),
+    )
+
+
+def _tarifa_plan(plan, config, tarjeta=None):
+    # Valores base: config global para crédito genérico, la tarjeta para custom
+    if tarjeta is None:
+        iva_base, iva_fin_base = config.iva, config.iva_financiacion
+        com_base, ar_base = config.comision_pago_tech, config.arancel_plataforma
+    else:
+        iva_base, iva_fin_base = tarjeta.iva, tarjeta.iva
+        com_base, ar_base = tarjeta.comision, tarjeta.arancel
+
+    iva_val     = plan.iva_override              if plan.iva_override is not None              else iva_base
+    iva_fin_val = plan.iva_financiacion_override if plan.iva_financiacion_override is not None else iva_fin_base
+    com_val     = plan.com_credito_override      if plan.com_credito_override is not None      else com_base
+    ar_val      = plan.arancel_credito_override  if plan.arancel_credito_override is not None  else ar_base
+
+    iva_f     = _d(iva_val)     / 100
+    iva_fin_f = _d(iva_fin_val) / 100
+
+    # Cada toggle es independiente
+    tasa_eff = _d(plan.tasa_base) * (1 + iva_fin_f) if plan.tasa_aplica_iva_fin else _d(plan.tasa_base)
+    pt_eff   = _d(com_val)        * (1 + iva_f)     if plan.comision_aplica_iva  else _d(com_val)
+    ar_eff   = _d(ar_val)         * (1 + iva_f)     if plan.comision_aplica_iva  else _d(ar_val)
+
+    # El desglose del IVA 10,5% usa siempre el IVA de financiación global (u override)
+    iva_fin_desglose = plan.iva_financiacion_override if plan.iva_financiacion_override is not None else config.iva_financiacion
+
+    return TarifaEfectiva(
+        'custom' if tarjeta is not None else 'credito',
+        plan.numero_cuota, pt_eff, ar_eff, tasa_eff, iva_f,
+        iva_fin_f=_d(iva_fin_desglose) / 100,
+        iva_com=plan.comision_aplica_iva,
+        iva_tasa=plan.tasa_aplica_iva_fin,
+        slug=tarjeta.slug if tarjeta is not None else None,
+        plan=plan, tarjeta=tarjeta, arancel=_d(ar_val),
+    )
+
+
+class Tarifario:
+    """
+    Tabla en memoria con las tarifas efectivas.
+
+    `tabla[(tipo, slug, cuotas)]` guarda las tarifas candidatas en orden
+    (tipo = 'debito' | 'credito' | 'custom'); `por_plan[plan_id]` guarda la
+    tarifa de cada CuotaConfig, activa o no, para las proyecciones del admin.
+    """
+
+    def __init__(self, config, planes: Iterable, tarjetas: Iterable, version=None):
+        self.version = version
+        self.config = config
+        self.construido_en = timezone.now()
+        self.tabla: Dict[Tuple[str, Optional[str], int], List[TarifaEfectiva]] = {}
+        self.por_plan: Dict[Any, TarifaEfectiva] = {}
+        self._orden_tarjetas: Dict[str, int] = {}
+        self._proyecciones: Dict[Any, Tuple[Decimal, Decimal]] = {}
+
+        self.debito = _tarifa_contado(
+            'debito', config.comision_pago_tech_debito, config.arancel_plataforma_debito, config.iva
+        )
+        self.credito = _tarifa_contado(
+            'credito', config.comision_pago_tech, config.arancel_plataforma, config.iva
+        )
+        self.tabla[('debito', None, 1)] = [self.debito]
+        self.tabla[('credito', None, 1)] = [self.credito]
+
+        tarjetas_activas = {}
+        for tc in tarjetas:
+            if not tc.activa:
+                continue
+            tarjetas_activas[tc.slug] = tc
+            self._orden_tarjetas[tc.slug] = len(self._orden_tarjetas)
+            self.tabla[('custom', tc.slug, 1)] = [
+                _tarifa_contado('custom', tc.comision, tc.arancel, tc.iva, tc.aplica_iva, slug=tc.slug, tarjeta=tc)
+            ]
+
+        for plan in sorted(planes, key=lambda p: (p.numero_cuota, p.pk)):
+            tarifa = _tarifa_plan(plan, config, plan.tarjeta_custom)
+            self.por_plan[plan.pk] = tarifa
+
+            if not plan.activa or plan.numero_cuota <= 1:
+                continue
+            if plan.tarjeta_custom is None:
+                clave = ('credito', None, plan.numero_cuota)
+            else:
+                tc = tarjetas_activas.get(plan.tarjeta_custom.slug)
+                if tc is None or not tc.acepta_cuotas:
+                    continue
+                clave = ('custom', tc.slug, plan.numero_cuota)
+            self.tabla.setdefault(clave, []).append(tarifa)
+
+    def tarifa_plan(self, plan) -> TarifaEfectiva:
+        tarifa = self.por_plan.get(plan.pk)
+        if tarifa is None:
+            # Plan guardado después de armar esta tabla
+            tarifa = _tarifa_plan(plan, self.config, plan.tarjeta_custom)
+        return tarifa
+
+    def proyeccion(self, plan) -> Tuple[Decimal, Decimal]:
+        """
+        (total_descuentos, coeficiente) del plan para el panel financiero, ya
+        redondeados. Se calculan una vez por versión del tarifario.
+        """
+        proyeccion = self._proyecciones.get(plan.pk)
+        if proyeccion is None:
+            total_descuentos = self.tarifa_plan(plan).total_pct
+            divisor_transaccional = 1 - (total_descuentos / 100)
+            coeficiente = Decimal('1') / divisor_transaccional if divisor_transaccional > 0 else CERO
+            proyeccion = (
+                total_descuentos.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP),
+                coeficiente.quantize(Decimal('0.000000'), rounding=ROUND_HALF_UP),
+            )
+            if plan.pk in self.por_plan:
+                self._proyecciones[plan.pk] = proyeccion
+        return proyeccion
+
+    def buscar(self, tipo, slug=None, cuotas=1, planes_visibles=None) -> Optional[TarifaEfectiva]:
+        for tarifa in self.tabla.get((tipo, slug, cuotas), ()):
+            if planes_visibles is None or tarifa.plan_id is None or tarifa.plan_id in planes_visibles:
+                return tarifa
+        return None
+
+    def tarifas_visibles(self, planes_visibles=None) -> List[TarifaEfectiva]:
+        """
+        Una tarifa por (tipo, slug, cuotas) — la misma que elegiría resolver() —
+        ordenadas como en el formulario: débito, crédito y cada tarjeta custom.
+        """
+        tarifas = []
+        for (tipo, slug, cuotas) in self.tabla:
+            tarifa = self.buscar(tipo, slug, cuotas, planes_visibles)
+            if tarifa is not None and tarifa.valida:
+                tarifas.append(tarifa)
+
+        grupos = {'debito': 0, 'credito': 1}
+        tarifas.sort(key=lambda t: (
+            grupos.get(t.tipo, 2 + self._orden_tarjetas.get(t.slug, 0)), t.cuotas
+        ))
+        return tarifas
+
+    def resolver(self, tipo_tarjeta, cuotas=1, planes_visibles=None) -> Tuple[Optional[TarifaEfectiva], List[str]]:
+        """
+        Tarifa aplicable a un link. Aplica las mismas reglas que create_link:
+        débito siempre contado, tarjetas custom sin cuotas caen a contado y
+        crédito genérico con cuotas requiere un plan activo.
+        `planes_visibles` (ids de CuotaConfig) restringe los planes elegibles.
+        """
+        if tipo_tarjeta == 'debito':
+            return self.debito, []
+
+        if tipo_tarjeta.startswith('custom_'):
+            slug = tipo_tarjeta.replace('custom_', '')
+            contado = self.buscar('custom', slug, 1)
+            if contado is None:
+                return None, ['La tarjeta seleccionada no esta disponible.']
+            if contado.acepta_cuotas and cuotas > 1:
+                tarifa = self.buscar('custom', slug, cuotas, planes_visibles)
+                if tarifa is None:
+                    return None, [f'No hay plan de {cuotas} cuotas configurado para {contado.tarjeta_nombre}.']
+                return tarifa, []
+            return contado, []
+
+        if cuotas > 1:
+            tarifa = self.buscar('credito', None, cuotas, planes_visibles)
+            if tarifa is None:
+                return None, [f'El plan de {cuotas} cuotas no está habilitado actualmente.']
+            return tarifa, []
+        return self.credito, []
+
+
+# ==============================================================================
+# CACHE DE PROCESO
+# ==============================================================================
+
+_tarifario: Optional[Tarifario] = None
+_lock = threading.Lock()
+
+
+def _construir_tarifario(version) -> Tarifario:
+    from .models import CuotaConfig, TarjetaCustom
+    from . import crud as admin_crud
+
+    config = admin_crud.get_or_create_config()
+    planes = list(CuotaConfig.objects.select_related('tarjeta_custom'))
+    tarjetas = list(TarjetaCustom.objects.all())
+    tarifario = Tarifario(config, planes, tarjetas, version=version)
+    logger.debug(
+        f"tarifario — reconstruido version={version} planes={len(planes)} "
+        f"tarjetas={len(tarjetas)} entradas={len(tarifario.tabla)}"
+    )
+    return tarifario
+
+
+def get_tarifario() -> Tarifario:
+    global _tarifario
+    version = get_version(VERSION_TARIFARIO)
+    actual = _tarifario
+    if actual is not None and version is not None and actual.version == version:
+        return actual
+    with _lock:
+        actual = _tarifario
+        if actual is None or version is None or actual.version != version:
+            actual = _construir_tarifario(version)
+            _tarifario = actual
+    return actual
+
+
+def invalidar_tarifario():
+    global _tarifario
+    _tarifario = None
+    bump_version(VERSION_TARIFARIO)
@@ -1,3 +1,127 @@
-from django.test import TestCase
+import random
+from decimal import Decimal, ROUND_HALF_UP
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import benchmark, punto_fijo
+from .tarifario import TarifaEfectiva
+
+
+CENTAVO = Decimal('0.01')
+
+
+def _decimal_al_azar(rng, enteros, decimales):
+    return Decimal(rng.randint(0, 10 ** (enteros + decimales))).scaleb(-decimales)
+
+
+def _tarifa_al_azar(rng):
+    """Tasas con la misma forma que arma el tarifario: base × (1 + IVA/100)."""
+    iva_f = _decimal_al_azar(rng, 2, 2) / 100
+    iva_fin_f = _decimal_al_azar(rng, 2, 2) / 100
+    pt = _decimal_al_azar(rng, 1, 2) * (1 + iva_f)
+    ar = _decimal_al_azar(rng, 1, 2) * rng.choice([1, 1 + iva_f])
+    tasa = _decimal_al_azar(rng, 2, 4) * rng.choice([1, 1 + iva_fin_f])
+    if rng.random() < 0.3:
+        tasa = Decimal('0')
+    return TarifaEfectiva(
+        rng.choice(['debito', 'credito', 'custom']), rng.choice([1, 2, 3, 6, 7, 12, 18]),
+        pt, ar, tasa, iva_f, iva_fin_f,
+        iva_sobre_total=rng.random() < 0.3,
+        iva_com=rng.random() < 0.8,
+        iva_tasa=rng.random() < 0.8,
+        slug='prueba',
+    )
+
+
+class PuntoFijoTests(SimpleTestCase):
+    """Cada operación en enteros da el mismo valor que Decimal con el contexto por defecto."""
+
+    def test_operaciones_equivalentes_a_decimal(self):
+        rng = random.Random(20240501)
+        for _ in range(5000):
+            a = _decimal_al_azar(rng, rng.randint(0, 8), rng.randint(0, 20)) * rng.choice([1, -1])
+            b = _decimal_al_azar(rng, rng.randint(0, 8), rng.randint(0, 20)) + Decimal('0.001')
+            fa, fb = punto_fijo.a_fijo(a), punto_fijo.a_fijo(b)
+            for fijo, esperado in (
+                (punto_fijo.multiplicar(fa, fb), a * b),
+                (punto_fijo.dividir(fa, fb), a / b),
+                (punto_fijo.restar(fa, fb), a - b),
+                (punto_fijo.sumar(fa, fb), a + b),
+            ):
+                self.assertEqual(Decimal(fijo[0]).scaleb(fijo[1]), esperado, (a, b))
+                self.assertEqual(
+                    punto_fijo.a_centavos(fijo),
+                    int(esperado.quantize(CENTAVO, ROUND_HALF_UP).scaleb(2)),
+                    (a, b),
+                )
+
+    def test_redondeo_half_up_en_el_medio_centavo(self):
+        self.assertEqual(punto_fijo.a_centavos(punto_fijo.a_fijo(Decimal('51.905'))), 5191)
+        self.assertEqual(punto_fijo.a_centavos(punto_fijo.a_fijo(Decimal('-51.905'))), -5191)
+        self.assertEqual(punto_fijo.a_centavos(punto_fijo.a_fijo(Decimal('51.9049999'))), 5190)
+
+    def test_decimal_a_centavos(self):
+        self.assertEqual(punto_fijo.decimal_a_centavos(Decimal('1234.5')), 123450)
+        self.assertEqual(punto_fijo.decimal_a_centavos(Decimal('1E+3')), 100000)
+        self.assertEqual(punto_fijo.decimal_a_centavos(Decimal('0.100')), 10)
+        with self.assertRaises(ValueError):
+            punto_fijo.decimal_a_centavos(Decimal('0.005'))
+
+
+class TarifaEfectivaTests(SimpleTestCase):
+
+    def test_calcular(self):
+        tarifa = TarifaEfectiva('credito', 3, Decimal('4.84'), Decimal('2.178'), Decimal('5.525'),
+                                Decimal('0.21'), Decimal('0.105'), iva_tasa=True)
+        calculo = tarifa.calcular(Decimal('1000'))
+        self.assertEqual(calculo['commission_amount'], Decimal('125.43'))
+        self.assertEqual(calculo['receiver_amount'], Decimal('874.57'))
+        self.assertEqual(calculo['desglose_cuota_valor'], Decimal('333.33'))
+        self.assertEqual(
+            calculo['desglose_arancel'] + calculo['desglose_comision'] + calculo['desglose_tasa'],
+            calculo['commission_amount'],
+        )
+
+    def test_calcular_centavos_identico_a_calcular(self):
+        """Propiedad: para cualquier tarifa y monto, el núcleo entero coincide con Decimal."""
+        rng = random.Random(1789)
+        for _ in range(20000):
+            tarifa = _tarifa_al_azar(rng)
+            centavos = rng.randint(1, 10 ** rng.randint(1, 14))
+            esperado = tarifa.calcular(punto_fijo.centavos_a_decimal(centavos))
+            obtenido = tarifa.calcular_centavos(centavos)
+            for campo, valor in obtenido.items():
+                self.assertEqual(
+                    punto_fijo.centavos_a_decimal(valor), esperado[campo],
+                    (campo, centavos, tarifa.total_pct),
+                )
+
+    def test_calcular_centavos(self):
+        tarifa = TarifaEfectiva('credito', 3, Decimal('4.84'), Decimal('2.178'), Decimal('5.525'),
+                                Decimal('0.21'), Decimal('0.105'), iva_tasa=True)
+        centavos = tarifa.calcular_centavos(100000)
+        self.assertEqual(centavos['commission_amount'], 12543)
+        self.assertEqual(centavos['receiver_amount'], 87457)
+        self.assertEqual(centavos['desglose_cuota_valor'], 33333)
+        self.assertEqual(
+            centavos['desglose_arancel'] + centavos['desglose_comision'] + centavos['desglose_tasa'],
+            centavos['commission_amount'],
+        )
+
+
+class BenchmarkGoldenTests(SimpleTestCase):
+
+    def test_importes_coinciden_con_golden(self):
+        datos = benchmark.cargar_golden()
+        self.assertEqual(set(datos['esperado']), set(datos['escenarios']))
+        self.assertEqual(benchmark.verificar_golden(datos), [])
+
+    def test_golden_sale_de_la_formula_previa_al_tarifario(self):
+        datos = benchmark.cargar_golden()
+        self.assertEqual(datos['esperado'], benchmark.importes_referencia(datos))
+
+    def test_medir_devuelve_todas_las_mediciones(self):
+        datos = benchmark.cargar_golden()
+        resultado = benchmark.medir(datos, iteraciones=2, lote=2, repeticiones=1)
+        self.assertEqual(len(resultado['resultados']), 4 * len(datos['escenarios']))
+        self.assertEqual(benchmark.comparar(resultado, resultado, 0.0), [])
@@ -20,4 +20,5 @@ urlpatterns = [
     path('mensajes/ping/', views.ping_mensajes_admin, name='ping_mensajes_admin'),
     path('mensajes/iniciar/<int:cliente_id>/', views.iniciar_chat_admin, name='iniciar_chat_admin'),
     path('terminos/', views.terminos_condiciones, name='terminos_admin'),
+    path('payzen/circuito/', views.circuito_payzen, name='circuito_payzen'),
 ]
\ No newline at end of file
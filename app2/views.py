@@ -5,7 +5,6 @@ from .models import User_admin
 from . import crud as admin_crud
 from app1 import models as app1_models
 from django.core.paginator import Paginator
-from decimal import Decimal, ROUND_HALF_UP
 from utils.email_utils import mail
 from django.urls import reverse
 import logging
@@ -512,45 +511,29 @@ def configuracion_financiera(request):
     cuotas  = admin_crud.list_cuotas_config()
     clientes_todos = Cliente.objects.filter(aprobado=True, bloqueado=False).order_by('nombre')
 
-    iva_global_f     = Decimal(str(config.iva)) / 100
-    com_pt_cred_iva  = Decimal(str(config.comision_pago_tech))        * (1 + iva_global_f)
-    arancel_cred_iva = Decimal(str(config.arancel_plataforma))        * (1 + iva_global_f)
-    com_pt_deb_iva   = Decimal(str(config.comision_pago_tech_debito)) * (1 + iva_global_f)
-    arancel_deb_iva  = Decimal(str(config.arancel_plataforma_debito)) * (1 + iva_global_f)
+    from .tarifario import get_tarifario
+    tarifario = get_tarifario()
 
-    proyecciones = []
-    for c in cuotas:
-        iva_val     = c.iva_override              if c.iva_override is not None              else config.iva
-        iva_fin_val = c.iva_financiacion_override if c.iva_financiacion_override is not None else config.iva_financiacion
-        com_cred    = c.com_credito_override      if c.com_credito_override is not None      else config.comision_pago_tech
-        ar_cred     = c.arancel_credito_override  if c.arancel_credito_override is not None  else config.arancel_plataforma
-
-        iva_f     = Decimal(str(iva_val))     / 100
-        iva_fin_f = Decimal(str(iva_fin_val)) / 100
+    com_pt_cred_iva  = tarifario.credito.pt_eff
+    arancel_cred_iva = tarifario.credito.ar_eff
+    com_pt_deb_iva   = tarifario.debito.pt_eff
+    arancel_deb_iva  = tarifario.debito.ar_eff
 
-        tasa_eff = Decimal(str(c.tasa_base)) * (1 + iva_fin_f) if c.tasa_aplica_iva_fin else Decimal(str(c.tasa_base))
-        com_eff  = Decimal(str(com_cred))    * (1 + iva_f)     if c.comision_aplica_iva  else Decimal(str(com_cred))
-        ar_eff   = Decimal(str(ar_cred))     * (1 + iva_f)     if c.comision_aplica_iva  else Decimal(str(ar_cred))
+    # Asignaciones de todos los planes en una consulta (para pre-marcar checkboxes)
+    asignaciones = admin_crud.asignaciones_por_plan()
 
-        total_descuentos      = tasa_eff + com_eff + ar_eff
-        divisor_transaccional = 1 - (total_descuentos / 100)
-
-        try:
-            coeficiente = Decimal('1') / divisor_transaccional if divisor_transaccional > 0 else Decimal('0')
-        except Exception:
-            coeficiente = Decimal('0')
-
-        # IDs ya asignados (para pre-marcar checkboxes en el template)
-        asignados_ids = list(c.usuarios_asignados.values_list('id', flat=True))
+    proyecciones = []
+    for c in cuotas:
+        total_descuentos, coeficiente = tarifario.proyeccion(c)
 
         proyecciones.append({
             'obj':              c,
-            'total_descuentos': total_descuentos.quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP),
-            'coeficiente':      coeficiente.quantize(Decimal('0.000000'),    rounding=ROUND_HALF_UP),
-            'asignados_ids':    asignados_ids,
+            'total_descuentos': total_descuentos,
+            'coeficiente':      coeficiente,
+            'asignados_ids':    asignaciones.get(c.id, set()),
         })
-        
-        tarjetas_custom = admin_crud.list_tarjetas_custom()
+
+    tarjetas_custom = admin_crud.list_tarjetas_custom()
 
     context = {
         'user':             user_admin,
@@ -696,6 +679,20 @@ def liquidaciones(request):
             ])
         return response_csv
 
+    # Exportar los tickets PDF en un ZIP que se envía a medida que se arma
+    if request.GET.get('exportar') == 'zip':
+        from django.http import StreamingHttpResponse
+        from django.utils import timezone
+        from app1 import crud as app1_crud
+        logger.info(f"liquidaciones — exportando ZIP de tickets — admin={user_id} operaciones={total_ops}")
+        response_zip = StreamingHttpResponse(
+            app1_crud.zip_tickets(qs.select_related('tarifa')), content_type='application/zip'
+        )
+        response_zip['Content-Disposition'] = (
+            f'attachment; filename="liquidaciones_{timezone.now():%Y%m%d_%H%M}.zip"'
+        )
+        return response_zip
+
     # Paginacion
     per_page_options = [10, 25, 50, 100]
     try:
@@ -961,7 +958,7 @@ def finalizar_chat_admin(request, cliente_id):
         try:
             from utils.email_utils import mail_con_pdf
             from django.template.loader import render_to_string
-            from weasyprint import HTML
+            from app1 import pdfs
 
             # Generar PDF
             html_pdf = render_to_string('emails/resumen_chat_pdf.html', {
@@ -970,7 +967,7 @@ def finalizar_chat_admin(request, cliente_id):
                 'total_mensajes': total,
                 'mensajes':       mensajes_lista,
             })
-            pdf_bytes = HTML(string=html_pdf).write_pdf()
+            pdf_bytes = pdfs.renderizar(html_pdf)
             pdf_nombre = f"resumen_chat_{cliente_nombre.replace(' ', '_')}_{fecha_cierre[:10].replace('/', '-')}.pdf"
 
             # Contexto para el email
@@ -1117,4 +1114,44 @@ def terminos_condiciones(request):
         'tyc_activo': tyc_activo,
         'historial':  historial,
         'nueva_v':    nueva_v,
-    })
\ No newline at end of file
+    })
+
+def circuito_payzen(request):
+    """
+    Métricas del circuit breaker de PayZen del proceso que atiende el request: cada
+    worker tiene su propio circuito, así que la respuesta lleva host y pid y no
+    representa al resto. JSON para admins; con ?formato=prometheus, texto para un
+    scraper autenticado con 'Authorization: Bearer <METRICAS_TOKEN>'.
+    """
+    import os
+    import socket
+    from django.conf import settings
+    from django.utils.crypto import constant_time_compare
+    from app1 import payzen
+
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    token_ok = bool(settings.METRICAS_TOKEN) and constant_time_compare(token, settings.METRICAS_TOKEN)
+    if not request.session.get('user_admin_id') and not token_ok:
+        return JsonResponse({'error': 'No autorizado'}, status=401)
+
+    metricas = payzen.circuito.metricas()
+    host, pid = socket.gethostname(), os.getpid()
+    if request.GET.get('formato') != 'prometheus':
+        return JsonResponse({'alcance': 'proceso', 'host': host, 'pid': pid, **metricas})
+
+    estados = (payzen.Circuito.CERRADO, payzen.Circuito.SEMIABIERTO, payzen.Circuito.ABIERTO)
+    proceso = f'{{host="{host}",pid="{pid}"}}'
+    lineas = [
+        '# HELP payzen_circuito_estado Estado del circuito de este proceso: 0 cerrado, 1 semiabierto, 2 abierto.',
+        '# TYPE payzen_circuito_estado gauge',
+        f"payzen_circuito_estado{proceso} {estados.index(metricas['estado'])}",
+        '# TYPE payzen_circuito_tasa_error gauge',
+        f"payzen_circuito_tasa_error{proceso} {metricas['tasa_error']}",
+        '# TYPE payzen_circuito_llamadas_ventana gauge',
+        f"payzen_circuito_llamadas_ventana{proceso} {metricas['llamadas_ventana']}",
+        '# TYPE payzen_circuito_aperturas_total counter',
+        f"payzen_circuito_aperturas_total{proceso} {metricas['aperturas_total']}",
+        '# TYPE payzen_circuito_rechazadas_total counter',
+        f"payzen_circuito_rechazadas_total{proceso} {metricas['rechazadas_total']}",
+    ]
+    return HttpResponse('\n'.join(lineas) + '\n', content_type='text/plain; version=0.0.4')
@@ -107,11 +107,69 @@ else:
         }
     }
 
+# Cache
+# En producción con varios workers usar un backend compartido (ej: filecache:///tmp/pagotech_cache
+# o redis://...) para que el cache de estados de PayZen y sus locks se compartan entre procesos.
+# Los sellos de versión de utils/versionado.py no dependen del cache: viven en la base.
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
 # Payzen Configuration
 PAYZEN_SHOP_ID = env('PAYZEN_SHOP_ID', default='')
 PAYZEN_REST_PASS = env('PAYZEN_REST_PASS', default='')
 PAYZEN_URL = env('PAYZEN_URL', default='https://api.payzen.lat/api-payment/V4/Charge/CreatePaymentOrder')
 PAYZEN_CHECK_URL = env('PAYZEN_CHECK_URL', default='https://api.payzen.lat/api-payment/V4/Order/Get')
+# Órdenes simultáneas contra PayZen en la creación masiva de links
+PAYZEN_CONCURRENCIA = env.int('PAYZEN_CONCURRENCIA', default=4)
+# Cliente HTTP (app1/payzen.py): conexiones keep-alive por proceso, timeouts en segundos
+# y reintentos con backoff exponencial + jitter solo para Order/Get
+PAYZEN_POOL_SIZE = env.int('PAYZEN_POOL_SIZE', default=10)
+PAYZEN_CONNECT_TIMEOUT = env.float('PAYZEN_CONNECT_TIMEOUT', default=5.0)
+PAYZEN_READ_TIMEOUT = env.float('PAYZEN_READ_TIMEOUT', default=20.0)
+PAYZEN_REINTENTOS = env.int('PAYZEN_REINTENTOS', default=2)
+PAYZEN_BACKOFF = env.float('PAYZEN_BACKOFF', default=0.5)
+# Circuit breaker (por proceso): se abre si en los últimos PAYZEN_CIRCUITO_VENTANA segundos,
+# con al menos PAYZEN_CIRCUITO_MIN_LLAMADAS llamadas, la proporción de fallas (red, timeout,
+# 429/5xx) o de llamadas más lentas que PAYZEN_CIRCUITO_LATENCIA supera su umbral. Abierto,
+# rechaza al instante durante PAYZEN_CIRCUITO_PAUSA segundos y luego prueba con una llamada.
+PAYZEN_CIRCUITO_ACTIVO = env.bool('PAYZEN_CIRCUITO_ACTIVO', default=True)
+PAYZEN_CIRCUITO_VENTANA = env.int('PAYZEN_CIRCUITO_VENTANA', default=60)
+PAYZEN_CIRCUITO_MIN_LLAMADAS = env.int('PAYZEN_CIRCUITO_MIN_LLAMADAS', default=10)
+PAYZEN_CIRCUITO_TASA_ERROR = env.float('PAYZEN_CIRCUITO_TASA_ERROR', default=0.5)
+PAYZEN_CIRCUITO_LATENCIA = env.float('PAYZEN_CIRCUITO_LATENCIA', default=8.0)
+PAYZEN_CIRCUITO_TASA_LENTAS = env.float('PAYZEN_CIRCUITO_TASA_LENTAS', default=0.5)
+PAYZEN_CIRCUITO_PAUSA = env.int('PAYZEN_CIRCUITO_PAUSA', default=30)
+# Token para leer /app2/payzen/circuito/ sin sesión de admin (ej: Prometheus); vacío = solo admins
+METRICAS_TOKEN = env('METRICAS_TOKEN', default='')
+# Bajo ASGI (PAYZEN_ASYNC) la creación de links y el polling de estado usan vistas async
+# con httpx: PAYZEN_ASYNC_CONEXIONES acota las conexiones simultáneas por proceso
+PAYZEN_ASYNC = env.bool('PAYZEN_ASYNC', default=False)
+PAYZEN_ASYNC_CONEXIONES = env.int('PAYZEN_ASYNC_CONEXIONES', default=100)
+# Segundos que se reutiliza la respuesta de Order/Get para una misma orden
+PAYZEN_ESTADO_TTL = env.int('PAYZEN_ESTADO_TTL', default=10)
+# IPN (notificaciones de PayZen a /payzen/ipn/). Con PAYZEN_IPN_ACTIVO el polling del
+# navegador lee el estado de la base y solo consulta PayZen si el link no tuvo novedades
+# en PAYZEN_IPN_RESPALDO segundos. PAYZEN_HMAC_KEY firma el retorno del navegador.
+PAYZEN_IPN_ACTIVO = env.bool('PAYZEN_IPN_ACTIVO', default=False)
+PAYZEN_IPN_RESPALDO = env.int('PAYZEN_IPN_RESPALDO', default=300)
+PAYZEN_HMAC_KEY = env('PAYZEN_HMAC_KEY', default='')
+# Vigencia de los links (se guarda en LinkPago.expires_at y se envía a PayZen como
+# expirationDate). PAYZEN_HORAS_EXPIRACION_POR_TARJETA la ajusta por tipo de tarjeta,
+# p. ej. "credito=48;custom_naranja=72". Un link vencido pasa a EXPIRED recién cuando
+# PayZen confirma que no tuvo actividad (`expirar_links`, conciliación o polling), y la
+# conciliación lo sigue mirando PAYZEN_HORAS_GRACIA_EXPIRADOS horas por pagos sobre la hora.
+PAYZEN_HORAS_EXPIRACION = env.int('PAYZEN_HORAS_EXPIRACION', default=24)
+PAYZEN_HORAS_EXPIRACION_POR_TARJETA = env.dict('PAYZEN_HORAS_EXPIRACION_POR_TARJETA', cast={'value': int}, default={})
+PAYZEN_HORAS_GRACIA_EXPIRADOS = env.int('PAYZEN_HORAS_GRACIA_EXPIRADOS', default=48)
+# Conciliación en segundo plano (manage.py conciliar_pagos). Con PAYZEN_CONCILIADOR_ACTIVO
+# las pantallas leen el estado solo de la base. Cada link pendiente se consulta cada
+# PAYZEN_CONCILIACION_BASE segundos, duplicando el intervalo a medida que envejece
+# (tope PAYZEN_CONCILIACION_MAX), sin superar PAYZEN_CONCILIACION_POR_SEGUNDO consultas/s.
+PAYZEN_CONCILIADOR_ACTIVO = env.bool('PAYZEN_CONCILIADOR_ACTIVO', default=False)
+PAYZEN_CONCILIACION_BASE = env.int('PAYZEN_CONCILIACION_BASE', default=60)
+PAYZEN_CONCILIACION_MAX = env.int('PAYZEN_CONCILIACION_MAX', default=3600)
+PAYZEN_CONCILIACION_POR_SEGUNDO = env.float('PAYZEN_CONCILIACION_POR_SEGUNDO', default=5.0)
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -153,6 +211,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # Nueva carpeta
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')  # Solo una vez
+# PDFs renderizados (tickets), uno por versión de contenido (ver app1/pdfs.py)
+PDF_CACHE_DIR = env('PDF_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'pdfs'))
+# Hilos por proceso que pre-renderizan el ticket al confirmarse un pago (el email sale en el request)
+PDF_HILOS_FONDO = env.int('PDF_HILOS_FONDO', default=2)
+# Procesos de WeasyPrint por proceso web (0 = renderizar en el mismo proceso) y
+# segundos máximos de espera por un PDF. Se multiplica por la cantidad de workers
+# (4 workers × PDF_PROCESOS=2 son 8 procesos de ~100 MB cada uno): subirlo solo si
+# el host tiene CPU y memoria para workers × PDF_PROCESOS renders a la vez.
+PDF_PROCESOS = env.int('PDF_PROCESOS', default=1)
+PDF_TIMEOUT = env.int('PDF_TIMEOUT', default=60)
+# Procesos de WeasyPrint del ZIP de tickets de liquidaciones: un pool propio que
+# existe solo mientras dura la exportación (0 = de a un ticket en el mismo proceso)
+PDF_ZIP_PROCESOS = env.int('PDF_ZIP_PROCESOS', default=2)
 
 # Directorios adicionales donde Django buscará archivos estáticos
 STATICFILES_DIRS = [
@@ -0,0 +1,58 @@
+# utils/versionado.py
+import threading
+import uuid
+
+from django.core.signals import request_finished, request_started
+from django.db import IntegrityError, transaction
+
+# Sellos de versión compartidos entre workers (tabla app2.SelloVersion).
+# Cada proceso guarda en memoria la versión con la que armó su copia local
+# y la compara contra el sello antes de usarla; si cambió, la reconstruye.
+# Dentro de un request el sello se lee de la base una sola vez por nombre.
+
+_local = threading.local()
+
+
+def _memo():
+    return getattr(_local, 'sellos', None)
+
+
+def _abrir_request(**kwargs):
+    _local.sellos = {}
+
+
+def _cerrar_request(**kwargs):
+    _local.sellos = None
+
+
+request_started.connect(_abrir_request, dispatch_uid='versionado_abrir')
+request_finished.connect(_cerrar_request, dispatch_uid='versionado_cerrar')
+
+
+def get_version(nombre):
+    memo = _memo()
+    if memo is not None and nombre in memo:
+        return memo[nombre]
+
+    from app2.models import SelloVersion
+    version = SelloVersion.objects.filter(nombre=nombre).values_list('version', flat=True).first()
+    if version is None:
+        # Sello inexistente: se crea uno (si otro worker lo creó al mismo tiempo, vale el suyo)
+        try:
+            with transaction.atomic():
+                version = SelloVersion.objects.create(nombre=nombre, version=uuid.uuid4().hex).version
+        except IntegrityError:
+            version = SelloVersion.objects.values_list('version', flat=True).get(nombre=nombre)
+    if memo is not None:
+        memo[nombre] = version
+    return version
+
+
+def bump_version(nombre):
+    from app2.models import SelloVersion
+    version = uuid.uuid4().hex
+    SelloVersion.objects.update_or_create(nombre=nombre, defaults={'version': version})
+    memo = _memo()
+    if memo is not None:
+        memo[nombre] = version
+    return version